@@ -1,122 +1,87 @@
-from graph_interfaces import IGraph, IVertex
+from graph_interfaces import IGraph
 from graph_interfaces import IAlgorithm
 from graph_interfaces import AlgorithmResult
-from typing import List
+from typing import Dict, Optional
 import time
-from queue import PriorityQueue
-from graph_impl import Vertex, Edge
-from itertools import count
+from compact_graph import CompactGraph
+from cost_profiles import CompiledProfile, CostProfile
+from instrumentation import active_kernels, probe_queries
+from search_kernels import SearchOutcome, SearchScratch
+from query_context import get_query_context
 
 """
 Tie-Breaker Implementation Explanation:
 
-I use a tie-breaker to avoid comparison errors in the PriorityQueue 
-when two vertices have the same priority (cost/heuristic). 
+I use a tie-breaker to avoid comparison errors in the priority queue
+when two vertices have the same priority (cost/heuristic).
 It prevents the runtime error that happens when two vertices have
-the same priority and Python tries to compare the Vertex objects directly.
+the same priority and Python tries to compare the queued items directly.
 
-The tie-breaker generates a unique integer for each queue entry
-using next(counter) from itertools.count(). It then includes it as 
-the second element in the tuple that is pushed to the queue.
+The tie-breaker is a unique, increasing integer for each queue entry.
+It is included as the second element in the tuple that is pushed to
+the queue.
 
-This makes sure that all queue items are always comparable, 
-even if their priorities are technically the same, and prevents 
-runtime errors, since the tie-breaker ensures a unique ordering. 
+This makes sure that all queue items are always comparable,
+even if their priorities are technically the same, and prevents
+runtime errors, since the tie-breaker ensures a unique ordering.
+
+Search Kernel Explanation:
+
+The search loops themselves live in search_kernels.py. They run on the
+integer-id CSR arrays of a CompactGraph with a heapq frontier and dense
+distance/parent/closed arrays. The CSR form of the graph, the radian
+coordinates the heuristic needs and the scratch arrays come from the graph's
+QueryContext (query_context.py), which is built once per graph version and
+shared by all three algorithms. The kernels are looked up through
+instrumentation.active_kernels(), which attaches a counting probe to them
+while a query is being recorded (see instrumentation.py).
 """
 
 class greedyBestFirstAlgorithm(IAlgorithm):
+    def __init__(self, approximate_heuristic: bool = False) -> None:
+        """
+        Args:
+            approximate_heuristic: Use the equirectangular lower bound from
+            coordinates.py instead of the haversine distance.
+        """
+        self.approximate_heuristic = approximate_heuristic
+
+    @probe_queries
     def find_path(self, graph: IGraph, start_vertex_name: str, destination_vertex_name: str) -> AlgorithmResult:
         """
         Implements Greedy Best-First Search algorithm to find the shortest path
         from start_vertex_name to destination_vertex_name in the given graph.
         Uses a priority queue to explore vertices based on their heuristic
-        distance to the goal. 
+        distance to the goal.
 
-        Args: 
+        Args:
             graph: The graph to search.
             start_vertex_name: The name of the starting vertex.
             destination_vertex_name: The name of the destination vertex.
-        Returns: 
+        Returns:
             AlgorithmResult containing path details and performance metrics.
         """
         start_time = time.time()
-        vertices_explored = 0
-        edges_evaluated = 0
-
-        vertices = {v.get_name(): v for v in graph.get_vertices()}
-        start = vertices.get(start_vertex_name)
-        goal = vertices.get(destination_vertex_name)
-        if not start or not goal:
-            return AlgorithmResult(
-                textual_directions="Start/destination vertex not found.",
-                total_distance=0.0,
-                vertices_explored=vertices_explored,
-                edges_evaluated=edges_evaluated,
-                execution_time=time.time() - start_time,
-                path_found=False
-            )
+        context = get_query_context(graph)
+        compact = context.graph
+        start = compact.vertex_id(start_vertex_name)
+        goal = compact.vertex_id(destination_vertex_name)
+        if start is None or goal is None:
+            return _not_found_result(start_time)
 
-        frontier = PriorityQueue()
-        counter = count()
-        frontier.put((start.straight_line_distance(goal), next(counter), start))
-        came_from = {start.get_name(): None}
-        total_distance = {start.get_name(): 0.0}
-        explored = set()
-
-        while not frontier.empty():
-            priority1, tie_break, current = frontier.get()
-            if current.get_name() in explored:
-                continue
-            vertices_explored += 1
-
-            """print(f"\nCurrent: {current.get_name()}")
-            print("Neighbor distances to Medford:")
-            for edge in current.get_edges():
-                neighbor = edge.get_destination()
-                h_dist = neighbor.straight_line_distance(goal)
-                print(f"  {neighbor.get_name()}: {h_dist:.2f} miles")"""
-
-            if current.get_name() == goal.get_name():
-                path = []
-                node = current.get_name()
-                while node:
-                    path.append(node)
-                    node = came_from[node]
-                path.reverse()
-                textual_directions = " -> ".join(path)
-                execution_time = time.time() - start_time
-                return AlgorithmResult(
-                    textual_directions = textual_directions,
-                    total_distance = total_distance[goal.get_name()],
-                    vertices_explored = vertices_explored,
-                    edges_evaluated = edges_evaluated,
-                    execution_time = execution_time,
-                    path_found = True
-                )
-
-            explored.add(current.get_name())
-            for edge in current.get_edges():
-                edges_evaluated += 1
-                neighbor = edge.get_destination()
-                if neighbor.get_name() not in explored and neighbor.get_name() not in came_from:
-                    frontier.put((neighbor.straight_line_distance(goal), next(counter), neighbor))
-                    came_from[neighbor.get_name()] = current.get_name()
-                    total_distance[neighbor.get_name()] = total_distance[current.get_name()] + edge.get_weight()
-
-        execution_time = time.time() - start_time
-        return AlgorithmResult(
-            textual_directions="No path found.",
-            total_distance=0.0,
-            vertices_explored=vertices_explored,
-            edges_evaluated=edges_evaluated,
-            execution_time=execution_time,
-            path_found=False
-        )
+        scratch = context.acquire_scratch()
+        try:
+            h = context.heuristic(goal, self.approximate_heuristic)
+            outcome = active_kernels().greedy(compact.offsets, compact.targets, compact.weights,
+                                              start, goal, h, scratch)
+            return _outcome_result(compact, scratch, goal, outcome, start_time)
+        finally:
+            context.release_scratch(scratch)
 
     def get_name(self) -> str:
         """
         Returns the name of the algorithm.
-        
+
         Args:
             None
         Returns:
@@ -125,154 +90,222 @@ class greedyBestFirstAlgorithm(IAlgorithm):
         return "Greedy Best-First Search Algorithm"
 
 class AStarAlgorithm(IAlgorithm):
-    def find_path(self, graph: IGraph, start_vertex_name: str, 
+    def __init__(self, approximate_heuristic: bool = False, profile: Optional[CostProfile] = None) -> None:
+        """
+        Args:
+            approximate_heuristic: Use the equirectangular lower bound from
+            coordinates.py instead of the haversine distance. It is cheaper
+            to evaluate and still admissible, so paths stay optimal.
+            profile: Cost profile (cost_profiles.py) to route by; the
+            reported total_distance is still the route's length.
+        """
+        self.approximate_heuristic = approximate_heuristic
+        self.profile = profile
+
+    @probe_queries
+    def find_path(self, graph: IGraph, start_vertex_name: str,
                   destination_vertex_name: str) -> AlgorithmResult:
         start_time = time.time()
-        vertices_explored = 0
-        edges_evaluated = 0
+        context = get_query_context(graph)
+        compact = context.graph
+        start = compact.vertex_id(start_vertex_name)
+        goal = compact.vertex_id(destination_vertex_name)
+        if start is None or goal is None:
+            return _not_found_result(start_time)
 
-        vertices = {v.get_name(): v for v in graph.get_vertices()}
-        start = vertices.get(start_vertex_name)
-        goal = vertices.get(destination_vertex_name)
-        if not start or not goal:
-            return AlgorithmResult(
-                textual_directions="Start/destination vertex not found.",
-                total_distance=0.0,
-                vertices_explored=vertices_explored,
-                edges_evaluated=edges_evaluated,
-                execution_time=time.time() - start_time,
-                path_found=False
-            )
-
-        frontier = PriorityQueue()
-        frontier.put((start.straight_line_distance(goal), start))
-        g_scores = {start.get_name(): 0.0}
-        f_scores = {start.get_name(): start.straight_line_distance(goal)}
-        came_from = {start.get_name(): None}
-        explored = set()
-
-        while not frontier.empty():
-            current_f, current = frontier.get()
-            vertices_explored += 1
-
-            if current.get_name() == goal.get_name():
-                path = []
-                node = current.get_name()
-                while node:
-                    path.append(node)
-                    node = came_from[node]
-                path.reverse()
-                textual_directions = " -> ".join(path)
-                execution_time = time.time() - start_time
-                return AlgorithmResult(
-                    textual_directions=textual_directions,
-                    total_distance=g_scores[goal.get_name()],
-                    vertices_explored=vertices_explored,
-                    edges_evaluated=edges_evaluated,
-                    execution_time=execution_time,
-                    path_found=True
-                )
-
-            explored.add(current.get_name())
-            for edge in current.get_edges():
-                edges_evaluated += 1
-                neighbor = edge.get_destination()
-                cost = edge.get_weight()
-                tentative_g = g_scores[current.get_name()] + cost
-                if neighbor.get_name() not in explored or tentative_g < g_scores.get(neighbor.get_name(), float('inf')):
-                    g_scores[neighbor.get_name()] = tentative_g
-                    h_neighbor = neighbor.straight_line_distance(goal)
-                    f_neighbor = tentative_g + (h_neighbor if h_neighbor is not None else 0)
-                    f_scores[neighbor.get_name()] = f_neighbor
-                    frontier.put((f_neighbor, neighbor))
-                    came_from[neighbor.get_name()] = current.get_name()
-
-        execution_time = time.time() - start_time
-        return AlgorithmResult(
-            textual_directions="No path found.",
-            total_distance=0.0,
-            vertices_explored=vertices_explored,
-            edges_evaluated=edges_evaluated,
-            execution_time=execution_time,
-            path_found=False
-        )
+        compiled = self.profile.compile(compact) if self.profile else None
+        scratch = context.acquire_scratch()
+        try:
+            h = context.heuristic(goal, self.approximate_heuristic)
+            if compiled is not None and compiled.heuristic_scale < 1.0:
+                distance_h, scale = h, compiled.heuristic_scale
+                h = lambda v: distance_h(v) * scale
+            weights = compiled.weights if compiled is not None else compact.weights
+            outcome = active_kernels().astar(compact.offsets, compact.targets, weights,
+                                            start, goal, h, scratch)
+            return _outcome_result(compact, scratch, goal, outcome, start_time, compiled)
+        finally:
+            context.release_scratch(scratch)
 
     def get_name(self) -> str:
-        return "A* Search Algorithm"
+        return _with_profile("A* Search Algorithm", self.profile)
 
 class DijkstraAlgorithm(IAlgorithm):
+    def __init__(self, profile: Optional[CostProfile] = None) -> None:
+        """
+        Args:
+            profile: Cost profile (cost_profiles.py) to route by; the
+            reported total_distance is still the route's length.
+        """
+        self.profile = profile
+
+    @probe_queries
     def find_path(self, graph: IGraph, start_vertex_name: str, destination_vertex_name: str) -> AlgorithmResult:
         start_time = time.time()
-        vertices_explored = 0
-        edges_evaluated = 0
+        context = get_query_context(graph)
+        compact = context.graph
+        start = compact.vertex_id(start_vertex_name)
+        goal = compact.vertex_id(destination_vertex_name)
+        if start is None or goal is None:
+            return _not_found_result(start_time)
 
-        vertices = {v.get_name(): v for v in graph.get_vertices()}
-        start = vertices.get(start_vertex_name)
-        goal = vertices.get(destination_vertex_name)
-        if not start or not goal:
+        compiled = self.profile.compile(compact) if self.profile else None
+        scratch = context.acquire_scratch()
+        try:
+            weights = compiled.weights if compiled is not None else compact.weights
+            outcome = active_kernels().dijkstra(compact.offsets, compact.targets, weights,
+                                               start, goal, scratch)
+            return _outcome_result(compact, scratch, goal, outcome, start_time, compiled)
+        finally:
+            context.release_scratch(scratch)
+
+    def get_name(self) -> str:
+        return _with_profile("Dijkstra's Algorithm", self.profile)
+
+
+class BidirectionalDijkstraAlgorithm(IAlgorithm):
+    @probe_queries
+    def find_path(self, graph: IGraph, start_vertex_name: str, destination_vertex_name: str) -> AlgorithmResult:
+        """
+        Runs Dijkstra's algorithm forward from the start and backward from the
+        destination (over the reversed edges) at the same time, stopping once
+        the two searches have met on a provably shortest path.
+
+        Args:
+            graph: The graph to search.
+            start_vertex_name: The name of the starting vertex.
+            destination_vertex_name: The name of the destination vertex.
+        Returns:
+            AlgorithmResult containing path details and performance metrics.
+        """
+        return _bidirectional_find_path(graph, start_vertex_name, destination_vertex_name, False)
+
+    def get_name(self) -> str:
+        return "Bidirectional Dijkstra's Algorithm"
+
+class BidirectionalAStarAlgorithm(IAlgorithm):
+    @probe_queries
+    def find_path(self, graph: IGraph, start_vertex_name: str, destination_vertex_name: str) -> AlgorithmResult:
+        """
+        Bidirectional A* with the average potential
+        p(v) = (h_destination(v) - h_start(v)) / 2, where both h are haversine
+        distances. The forward search uses p and the backward search -p, so
+        the two searches stay consistent with each other and can stop as soon
+        as their frontiers meet. That needs p to be consistent, which holds
+        only when every vertex has coordinates and no edge is shorter than
+        the great-circle distance between its ends; on any other graph
+        (including the Oregon map) this runs bidirectional Dijkstra.
+
+        Args:
+            graph: The graph to search.
+            start_vertex_name: The name of the starting vertex.
+            destination_vertex_name: The name of the destination vertex.
+        Returns:
+            AlgorithmResult containing path details and performance metrics.
+        """
+        return _bidirectional_find_path(graph, start_vertex_name, destination_vertex_name, True)
+
+    def get_name(self) -> str:
+        return "Bidirectional A* Search Algorithm"
+
+def _bidirectional_find_path(graph: IGraph, start_vertex_name: str, destination_vertex_name: str,
+                             use_potential: bool) -> AlgorithmResult:
+    start_time = time.time()
+    context = get_query_context(graph)
+    compact = context.graph
+    reverse = compact.reversed()
+    start = compact.vertex_id(start_vertex_name)
+    goal = compact.vertex_id(destination_vertex_name)
+    if start is None or goal is None:
+        return _not_found_result(start_time)
+
+    potential = None
+    if use_potential and context.haversine_consistent:
+        h_goal = context.heuristic(goal)
+        h_start = context.heuristic(start)
+        potential = lambda v: (h_goal(v) - h_start(v)) / 2
+    forward_scratch = context.acquire_scratch()
+    backward_scratch = context.acquire_scratch()
+    try:
+        outcome = active_kernels().bidirectional(
+            (compact.offsets, compact.targets, compact.weights),
+            (reverse.offsets, reverse.targets, reverse.weights),
+            start, goal, forward_scratch, backward_scratch, potential)
+        if not outcome.found:
             return AlgorithmResult(
-                textual_directions="Start/destination vertex not found.",
+                textual_directions="No path found.",
                 total_distance=0.0,
-                vertices_explored=vertices_explored,
-                edges_evaluated=edges_evaluated,
+                vertices_explored=outcome.vertices_explored,
+                edges_evaluated=outcome.edges_evaluated,
                 execution_time=time.time() - start_time,
                 path_found=False
             )
+        path = forward_scratch.path_to(outcome.meeting_vertex)
+        vertex = backward_scratch.parent[outcome.meeting_vertex]
+        while vertex != -1:
+            path.append(vertex)
+            vertex = backward_scratch.parent[vertex]
+        return AlgorithmResult(
+            textual_directions=" -> ".join(compact.names[v] for v in path),
+            total_distance=outcome.distance,
+            vertices_explored=outcome.vertices_explored,
+            edges_evaluated=outcome.edges_evaluated,
+            execution_time=time.time() - start_time,
+            path_found=True
+        )
+    finally:
+        context.release_scratch(forward_scratch)
+        context.release_scratch(backward_scratch)
+
 
-        frontier = PriorityQueue()
-        counter = count()
-        frontier.put((0.0, next(counter), start))
-        g_scores = {start.get_name(): 0.0}
-        came_from = {start.get_name(): None}
-        explored = set()
-
-        while not frontier.empty():
-            current_g, priority, current = frontier.get()
-            if current.get_name() in explored:
-                continue 
-            vertices_explored += 1
-
-            if current.get_name() == goal.get_name():
-                path = []
-                node = current.get_name()
-                while node:
-                    path.append(node)
-                    node = came_from[node]
-                path.reverse()
-                textual_directions = " -> ".join(path)
-                execution_time = time.time() - start_time
-                return AlgorithmResult(
-                    textual_directions=textual_directions,
-                    total_distance=g_scores[goal.get_name()],
-                    vertices_explored=vertices_explored,
-                    edges_evaluated=edges_evaluated,
-                    execution_time=execution_time,
-                    path_found=True
-                )
-
-            explored.add(current.get_name())
-            for edge in current.get_edges():
-                edges_evaluated += 1
-                neighbor = edge.get_destination()
-                cost = edge.get_weight()
-                tentative_g = g_scores[current.get_name()] + cost
-                if neighbor.get_name() not in explored and tentative_g < g_scores.get(neighbor.get_name(), float('inf')):
-                    g_scores[neighbor.get_name()] = tentative_g
-                    frontier.put((tentative_g, next(counter), neighbor)) 
-                    # next(counter) is the tie-breaker to avoid
-                    # the comparison error with two vertices having the same cost score
-                    came_from[neighbor.get_name()] = current.get_name()
-                    # Records the path taken
-
-        execution_time = time.time() - start_time
+def _not_found_result(start_time: float) -> AlgorithmResult:
+    return AlgorithmResult(
+        textual_directions="Start/destination vertex not found.",
+        total_distance=0.0,
+        vertices_explored=0,
+        edges_evaluated=0,
+        execution_time=time.time() - start_time,
+        path_found=False
+    )
+
+def _with_profile(name: str, profile: Optional[CostProfile]) -> str:
+    return f"{name} ({profile.name})" if profile else name
+
+def _outcome_result(graph: CompactGraph, scratch: SearchScratch, goal: int, outcome: SearchOutcome,
+                    start_time: float, compiled: Optional[CompiledProfile] = None) -> AlgorithmResult:
+    """Turn a kernel outcome into the AlgorithmResult reported to callers.
+    With a cost profile that changes weights, the distance is recomputed from
+    the path, since the kernel's distance is the profile's cost."""
+    if not outcome.found:
         return AlgorithmResult(
             textual_directions="No path found.",
             total_distance=0.0,
-            vertices_explored=vertices_explored,
-            edges_evaluated=edges_evaluated,
-            execution_time=execution_time,
+            vertices_explored=outcome.vertices_explored,
+            edges_evaluated=outcome.edges_evaluated,
+            execution_time=time.time() - start_time,
             path_found=False
         )
+    names = graph.names
+    path = scratch.path_to(goal)
+    distance = outcome.distance
+    if compiled is not None and not compiled.is_identity:
+        distance = compiled.path_length(path)
+    return AlgorithmResult(
+        textual_directions=" -> ".join(names[v] for v in path),
+        total_distance=distance,
+        vertices_explored=outcome.vertices_explored,
+        edges_evaluated=outcome.edges_evaluated,
+        execution_time=time.time() - start_time,
+        path_found=True
+    )
 
-    def get_name(self) -> str:
-        return "Dijkstra's Algorithm"
\ No newline at end of file
+
+# Algorithm registry for front ends that pick an algorithm by key. The
+# instances keep no per-query state, so they can be shared between threads.
+ALGORITHMS: Dict[str, IAlgorithm] = {
+    "dijkstra": DijkstraAlgorithm(),
+    "greedy": greedyBestFirstAlgorithm(),
+    "astar": AStarAlgorithm(),
+    "bidirectional-dijkstra": BidirectionalDijkstraAlgorithm(),
+    "bidirectional-astar": BidirectionalAStarAlgorithm(),
+}
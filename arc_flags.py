@@ -0,0 +1,470 @@
+from __future__ import annotations
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+from typing import Callable, List, Optional, Sequence
+import argparse
+import heapq
+import math
+import os
+import struct
+import sys
+import time
+import zlib
+
+from graph_interfaces import IAlgorithm, IGraph, AlgorithmResult
+from compact_graph import CompactGraph
+from query_context import get_query_context
+from parallel import SharedGraph, attach_shared_graph
+from search_kernels import INF, NO_GOAL, SearchOutcome, SearchScratch
+import search_kernels
+from instrumentation import probe_queries
+
+"""
+Arc flags.
+
+The vertices are split into cells, and every edge gets one flag per cell:
+the flag for cell C is set when the edge lies on some shortest path to a
+vertex in C. A search for a goal in cell C can then skip every edge whose
+C flag is clear, which keeps it from wandering into parts of the map that
+lead away from the goal. The result is still exact.
+
+partition_by_coordinates cuts the graph into cells with k-d splits: the
+vertices are split at the median of their longer side (latitude, or
+longitude scaled by the cosine of the latitude) and each half is split again,
+so cells hold about the same number of vertices. Vertices without
+coordinates join the cell of the nearest vertex that has them.
+
+Flags for cell C come from one backward Dijkstra tree per boundary vertex b of
+C, a vertex in C with an incoming edge from outside. Every edge u -> v with
+d(u, b) = w(u, v) + d(v, b) is on a shortest path to b and gets the C flag,
+as does every edge inside C. A shortest path into C enters it for the last
+time at some boundary vertex, so all its edges are flagged. Cells are
+independent, so build_arc_flags spreads them over a process pool that shares
+the graph through parallel.SharedGraph.
+
+Preprocessing costs one full Dijkstra per boundary vertex, so it suits a graph
+that changes rarely and is cheap with coarse partitions. The flags are stored
+cell-major, one byte per edge per cell, so the search's test is a single
+lookup in the goal cell's row. Files written by ArcFlags.save pack them
+eight to a byte and carry a checksum of the graph's CSR arrays, so load
+refuses flags built for a different graph:
+
+    python arc_flags.py graph_v2.txt vertices_v1.txt oregon.flags --cells 8
+"""
+
+FLAGS_MAGIC = b"PFAF"
+FLAGS_FORMAT_VERSION = 1
+_FLAGS_HEADER = struct.Struct('<4sHxxqqqI4x')
+# Relative slack when testing whether an edge is on a shortest path, so
+# rounding in the summed distances never clears a flag that should be set.
+TIGHTNESS = 1e-9
+
+
+def partition_by_coordinates(graph: IGraph, cells: int) -> array:
+    """Split the vertices into cells by recursive median splits.
+        Args:
+            graph: The graph to partition.
+            cells: Number of cells (at least 1).
+        Returns:
+            array('i') with the cell of every vertex id.
+    """
+    if cells < 1:
+        raise ValueError("cells must be at least 1")
+    compact = get_query_context(graph).graph
+    latitudes, longitudes = compact.latitudes, compact.longitudes
+    cell_of = array('i', [-1]) * compact.vertex_count()
+    placed = [v for v in range(compact.vertex_count())
+              if not math.isnan(latitudes[v]) and not math.isnan(longitudes[v])]
+
+    stack = [(placed, 0, cells)]
+    while stack:
+        members, first_cell, count = stack.pop()
+        if count == 1 or len(members) <= 1:
+            for v in members:
+                cell_of[v] = first_cell
+            continue
+        lats = [latitudes[v] for v in members]
+        lons = [longitudes[v] for v in members]
+        scale = math.cos(math.radians((min(lats) + max(lats)) / 2))
+        if max(lats) - min(lats) >= (max(lons) - min(lons)) * scale:
+            members = sorted(members, key=latitudes.__getitem__)
+        else:
+            members = sorted(members, key=longitudes.__getitem__)
+        low = count // 2
+        split = len(members) * low // count
+        stack.append((members[:split], first_cell, low))
+        stack.append((members[split:], first_cell + low, count - low))
+
+    # Breadth-first from the placed vertices, in both edge directions, so
+    # each vertex without coordinates takes the cell of a nearby one.
+    reverse = compact.reversed()
+    frontier = placed
+    while frontier:
+        following = []
+        for u in frontier:
+            for csr in (compact, reverse):
+                for e in range(csr.offsets[u], csr.offsets[u + 1]):
+                    v = csr.targets[e]
+                    if cell_of[v] < 0:
+                        cell_of[v] = cell_of[u]
+                        following.append(v)
+        frontier = following
+    for v in range(len(cell_of)):
+        if cell_of[v] < 0:
+            cell_of[v] = 0
+    return cell_of
+
+
+def graph_checksum(graph: CompactGraph) -> int:
+    """CRC-32 of the graph's offsets, targets and weights."""
+    checksum = 0
+    for values, typecode in ((graph.offsets, 'q'), (graph.targets, 'q'), (graph.weights, 'd')):
+        checksum = zlib.crc32(array(typecode, values).tobytes(), checksum)
+    return checksum
+
+
+class ArcFlags:
+    """Class for a partition and the per-cell edge flags of one graph."""
+
+    def __init__(self, graph: CompactGraph, cell_of: array, rows: List[bytearray],
+                 build_time: float = 0.0) -> None:
+        """Constructor for the flags.
+            Args:
+                graph: The graph the flags were computed on.
+                cell_of: Cell of every vertex id.
+                rows: rows[c][e] is 1 if edge slot e is on a shortest path
+                into cell c.
+                build_time: Seconds spent partitioning and computing flags.
+            Returns:
+                None
+        """
+        self.graph = graph
+        self.cell_of = cell_of
+        self.rows = rows
+        self.build_time = build_time
+
+    @property
+    def cell_count(self) -> int:
+        return len(self.rows)
+
+    def flagged_fraction(self) -> float:
+        """Get the share of (edge, cell) flags that are set."""
+        total = len(self.rows) * self.graph.edge_count()
+        return sum(row.count(1) for row in self.rows) / total if total else 0.0
+
+    def save(self, path: str) -> None:
+        """Write the partition and flags to a binary file.
+
+        Layout (little-endian): a header with the magic bytes b"PFAF", the
+        format version, V, E, the cell count and the graph checksum; then the
+        cell of every vertex (int32[V]) and, per cell, the flags packed eight
+        edges to a byte, lowest edge slot in the lowest bit
+        (ceil(E / 8) bytes).
+            Args:
+                path: Destination file path.
+            Returns:
+                None
+        """
+        with open(path, 'wb') as file:
+            file.write(_FLAGS_HEADER.pack(FLAGS_MAGIC, FLAGS_FORMAT_VERSION, self.graph.vertex_count(),
+                                          self.graph.edge_count(), self.cell_count, graph_checksum(self.graph)))
+            cell_of = array('i', self.cell_of)
+            if sys.byteorder != 'little':
+                cell_of.byteswap()
+            cell_of.tofile(file)
+            for row in self.rows:
+                file.write(_pack_bits(row))
+
+    @classmethod
+    def load(cls, path: str, graph: IGraph) -> ArcFlags:
+        """Read flags written by save for the given graph.
+            Args:
+                path: The flags file.
+                graph: The graph the flags were built for.
+            Returns:
+                The loaded ArcFlags.
+        """
+        compact = get_query_context(graph).graph
+        with open(path, 'rb') as file:
+            magic, version, vertex_count, edge_count, cells, checksum = \
+                _FLAGS_HEADER.unpack(file.read(_FLAGS_HEADER.size))
+            if magic != FLAGS_MAGIC:
+                raise ValueError(f"{path} is not an arc flags file")
+            if version != FLAGS_FORMAT_VERSION:
+                raise ValueError(f"unsupported arc flags version {version}")
+            if vertex_count != compact.vertex_count() or edge_count != compact.edge_count() or \
+                    checksum != graph_checksum(compact):
+                raise ValueError(f"{path} was built for a different graph")
+            cell_of = array('i')
+            cell_of.fromfile(file, vertex_count)
+            if sys.byteorder != 'little':
+                cell_of.byteswap()
+            row_size = (edge_count + 7) // 8
+            rows = [_unpack_bits(file.read(row_size), edge_count) for _ in range(cells)]
+        return cls(compact, cell_of, rows)
+
+
+_TO_DIGITS = bytes.maketrans(b'\x00\x01', b'01')
+_FROM_DIGITS = bytes.maketrans(b'01', b'\x00\x01')
+
+def _pack_bits(row: bytearray) -> bytes:
+    # Bit e of the little-endian integer is row[e]; int() parses the
+    # reversed digit string in linear time for base 2.
+    if not row:
+        return b''
+    return int(row.translate(_TO_DIGITS)[::-1], 2).to_bytes((len(row) + 7) // 8, 'little')
+
+def _unpack_bits(data: bytes, count: int) -> bytearray:
+    if not count:
+        return bytearray()
+    digits = format(int.from_bytes(data, 'little'), f'0{count}b')
+    return bytearray(digits[::-1].encode('ascii').translate(_FROM_DIGITS))
+
+
+def _flags_for_cell(graph: CompactGraph, reverse: CompactGraph, cell_of: Sequence[int], cell: int,
+                    scratch: SearchScratch) -> bytearray:
+    offsets, targets, weights = graph.offsets, graph.targets, graph.weights
+    row = bytearray(len(targets))
+    boundary = []
+    for u in range(graph.vertex_count()):
+        if cell_of[u] == cell:
+            for e in range(offsets[u], offsets[u + 1]):
+                if cell_of[targets[e]] == cell:
+                    row[e] = 1
+        else:
+            for e in range(offsets[u], offsets[u + 1]):
+                if cell_of[targets[e]] == cell:
+                    boundary.append(targets[e])
+    for b in dict.fromkeys(boundary):
+        search_kernels.dijkstra(reverse.offsets, reverse.targets, reverse.weights, b, NO_GOAL, scratch)
+        dist = scratch.dist
+        for u in scratch.touched:
+            du = dist[u]
+            slack = TIGHTNESS * (du if du > 1.0 else 1.0)
+            for e in range(offsets[u], offsets[u + 1]):
+                if weights[e] + dist[targets[e]] - du <= slack:
+                    row[e] = 1
+    return row
+
+
+# Per-process worker state, set once by _init_worker.
+_worker_shm: Optional[shared_memory.SharedMemory] = None
+_worker_graph: Optional[CompactGraph] = None
+_worker_cell_of: Optional[array] = None
+
+def _init_worker(shm_name: str, cell_of: array) -> None:
+    global _worker_shm, _worker_graph, _worker_cell_of
+    _worker_shm = shared_memory.SharedMemory(name=shm_name)
+    _worker_graph = attach_shared_graph(_worker_shm)
+    _worker_cell_of = cell_of
+
+def _worker_flags(cell: int) -> bytes:
+    graph = _worker_graph
+    row = _flags_for_cell(graph, graph.reversed(), _worker_cell_of, cell, SearchScratch(graph.vertex_count()))
+    return _pack_bits(row)
+
+
+def build_arc_flags(graph: IGraph, cells: int = 16, workers: Optional[int] = None,
+                    cell_of: Optional[Sequence[int]] = None) -> ArcFlags:
+    """Partition the graph and compute the arc flags of every cell.
+        Args:
+            graph: The graph to preprocess.
+            cells: Number of cells when cell_of is not given.
+            workers: Worker processes (default: os.cpu_count()); 1 computes
+            every cell in this process.
+            cell_of: Optional partition to use instead of
+            partition_by_coordinates, the cell (0 .. cells - 1) of every
+            vertex id.
+        Returns:
+            The ArcFlags.
+    """
+    start_time = time.time()
+    context = get_query_context(graph)
+    compact = context.graph
+    if cell_of is None:
+        cell_of = partition_by_coordinates(compact, cells)
+    else:
+        cell_of = array('i', cell_of)
+        if len(cell_of) != compact.vertex_count():
+            raise ValueError("cell_of needs one cell per vertex")
+        cells = max(cell_of, default=-1) + 1
+    workers = min(workers or os.cpu_count() or 1, cells)
+
+    if workers <= 1:
+        reverse = compact.reversed()
+        scratch = context.acquire_scratch()
+        try:
+            rows = [_flags_for_cell(compact, reverse, cell_of, cell, scratch) for cell in range(cells)]
+        finally:
+            context.release_scratch(scratch)
+    else:
+        shared = SharedGraph(compact)
+        try:
+            with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                     initargs=(shared.name, cell_of)) as pool:
+                edge_count = compact.edge_count()
+                rows = [_unpack_bits(packed, edge_count) for packed in pool.map(_worker_flags, range(cells))]
+        finally:
+            shared.close()
+    return ArcFlags(compact, cell_of, rows, time.time() - start_time)
+
+
+def flagged_search(offsets: Sequence[int], targets: Sequence[int], weights: Sequence[float],
+                   start: int, goal: int, allowed: bytearray, h: Optional[Callable[[int], float]],
+                   scratch: SearchScratch) -> SearchOutcome:
+    """Dijkstra (h=None) or A* from start to goal over the edges whose flag
+    for the goal's cell is set.
+        Args:
+            offsets: CSR offsets array.
+            targets: CSR edge target array.
+            weights: CSR edge weight array.
+            start: Start vertex id.
+            goal: Goal vertex id.
+            allowed: The goal cell's flag row, allowed[e] for every edge slot.
+            h: Optional admissible heuristic towards goal; it need not be
+            consistent, as closed vertices reached by a shorter path are
+            reopened.
+            scratch: State arrays sized for the graph; reset before use.
+        Returns:
+            SearchOutcome with the goal distance and search counters.
+    """
+    scratch.reset()
+    dist, parent, closed, touched = scratch.dist, scratch.parent, scratch.closed, scratch.touched
+    heappush, heappop = heapq.heappush, heapq.heappop
+    dist[start] = 0.0
+    touched.append(start)
+    frontier = [(h(start) if h else 0.0, 0, start)]
+    sequence = 1
+    vertices_explored = 0
+    edges_evaluated = 0
+
+    while frontier:
+        _, _, u = heappop(frontier)
+        if closed[u]:
+            continue
+        closed[u] = 1
+        vertices_explored += 1
+        d = dist[u]
+        if u == goal:
+            return SearchOutcome(True, d, vertices_explored, edges_evaluated)
+        first, last = offsets[u], offsets[u + 1]
+        edges_evaluated += last - first
+        for e in range(first, last):
+            if not allowed[e]:
+                continue
+            v = targets[e]
+            nd = d + weights[e]
+            if nd < dist[v]:
+                if dist[v] == INF:
+                    touched.append(v)
+                closed[v] = 0
+                dist[v] = nd
+                parent[v] = u
+                heappush(frontier, (nd + h(v) if h else nd, sequence, v))
+                sequence += 1
+
+    return SearchOutcome(False, INF, vertices_explored, edges_evaluated)
+
+
+class ArcFlagsAlgorithm(IAlgorithm):
+    """Dijkstra or A* that skips edges not flagged for the goal's cell."""
+
+    def __init__(self, flags: Optional[ArcFlags] = None, cells: int = 16, workers: int = 1,
+                 use_heuristic: bool = True) -> None:
+        """Constructor for the algorithm.
+            Args:
+                flags: Optional prebuilt (or loaded) flags. Flags are
+                (re)built automatically whenever the searched graph changes
+                version.
+                cells: Cells to partition into when flags are built.
+                workers: Worker processes used when find_path builds the
+                flags (default 1, serial). find_path may itself run in a
+                thread or process pool, so pass prebuilt flags from
+                build_arc_flags to use every core.
+                use_heuristic: Run A* with the haversine heuristic instead of
+                Dijkstra.
+            Returns:
+                None
+        """
+        self.flags = flags
+        self.cells = cells
+        self.workers = workers
+        self.use_heuristic = use_heuristic
+
+    @probe_queries
+    def find_path(self, graph: IGraph, start_vertex_name: str, destination_vertex_name: str) -> AlgorithmResult:
+        """
+        Runs the flag-pruned search towards the destination's cell.
+
+        Args:
+            graph: The graph to search.
+            start_vertex_name: The name of the starting vertex.
+            destination_vertex_name: The name of the destination vertex.
+        Returns:
+            AlgorithmResult containing path details and performance metrics.
+        """
+        start_time = time.time()
+        context = get_query_context(graph)
+        compact = context.graph
+        start = compact.vertex_id(start_vertex_name)
+        goal = compact.vertex_id(destination_vertex_name)
+        if start is None or goal is None:
+            return AlgorithmResult(
+                textual_directions="Start/destination vertex not found.",
+                total_distance=0.0,
+                vertices_explored=0,
+                edges_evaluated=0,
+                execution_time=time.time() - start_time,
+                path_found=False
+            )
+        if self.flags is None or self.flags.graph is not compact:
+            self.flags = build_arc_flags(compact, self.cells, self.workers)
+
+        h = context.heuristic(goal) if self.use_heuristic else None
+        allowed = self.flags.rows[self.flags.cell_of[goal]]
+        scratch = context.acquire_scratch()
+        try:
+            outcome = flagged_search(compact.offsets, compact.targets, compact.weights,
+                                     start, goal, allowed, h, scratch)
+            if not outcome.found:
+                return AlgorithmResult(
+                    textual_directions="No path found.",
+                    total_distance=0.0,
+                    vertices_explored=outcome.vertices_explored,
+                    edges_evaluated=outcome.edges_evaluated,
+                    execution_time=time.time() - start_time,
+                    path_found=False
+                )
+            return AlgorithmResult(
+                textual_directions=" -> ".join(compact.names[v] for v in scratch.path_to(goal)),
+                total_distance=outcome.distance,
+                vertices_explored=outcome.vertices_explored,
+                edges_evaluated=outcome.edges_evaluated,
+                execution_time=time.time() - start_time,
+                path_found=True
+            )
+        finally:
+            context.release_scratch(scratch)
+
+    def get_name(self) -> str:
+        return "Arc Flags A*" if self.use_heuristic else "Arc Flags Dijkstra"
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Partition a graph and precompute its arc flags.")
+    parser.add_argument("graph_file")
+    parser.add_argument("vertices_file")
+    parser.add_argument("output_file")
+    parser.add_argument("--cells", type=int, default=16)
+    parser.add_argument("--workers", type=int, default=None)
+    args = parser.parse_args()
+
+    graph = CompactGraph.from_files(args.graph_file, args.vertices_file)
+    flags = build_arc_flags(graph, args.cells, args.workers)
+    flags.save(args.output_file)
+    print(f"Flagged {graph.edge_count()} edges for {flags.cell_count} cells in {flags.build_time:.3f} seconds "
+          f"({flags.flagged_fraction():.1%} of flags set).")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,382 @@
+from __future__ import annotations
+from collections import deque
+from datetime import datetime, timezone
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+import argparse
+import gc
+import hashlib
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import time
+import tracemalloc
+
+from graph_interfaces import IAlgorithm
+from compact_graph import CompactGraph
+from algorithms import ALGORITHMS, DijkstraAlgorithm
+from arc_flags import ArcFlagsAlgorithm, build_arc_flags
+from contraction_hierarchies import ContractionHierarchyAlgorithm, build_hierarchy
+from graph_generators import GENERATORS, write_graph_files
+from hub_labels import HubLabelAlgorithm, HubLabels
+from ingest import ingest_graph
+from landmarks import ALTAlgorithm, LandmarkTable
+from path_cache import CachedAlgorithm
+
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
+
+"""
+Reproducible benchmark suite.
+
+A run loads one graph (the Oregon files, any files in the same format, or a
+synthetic graph from graph_generators, written to --data-dir once and reused),
+draws a fixed random query set from it, and runs every algorithm in
+algorithms.ALGORITHMS over the same queries. With --preprocessed the
+algorithms that need a preprocessing step (PREPROCESSED_ALGORITHMS:
+contraction hierarchies, ALT landmarks, the Dijkstra result cache, arc flags
+and hub labels) run as well; each is built first and its build time is
+reported as build_seconds, apart from the query timings:
+
+    python benchmark.py run --generator grid --vertices 100000 --output before.json
+    ... change something ...
+    python benchmark.py run --generator grid --vertices 100000 --output after.json
+    python benchmark.py compare before.json after.json
+
+Queries are drawn with a seeded RNG from the largest connected component, so
+every query has an answer and two runs with the same graph, query count and
+seed search exactly the same pairs (the report carries a digest of the query
+set to check that). Each query is timed with time.perf_counter around
+find_path. The first query of each algorithm is reported separately as
+cold_ms, since it also builds the graph's shared query context, and is left
+out of the statistics.
+
+Per algorithm the report gives p50/p95/p99/max latency, queries per second,
+the mean vertices explored and edges evaluated per query, and peak memory: the
+largest extra memory any single query allocated (tracemalloc, measured in a
+separate pass over the first --memory-queries queries because tracing slows
+searches down) and the process's peak resident set size.
+
+compare lists the change of every metric between two reports and exits with
+status 1 when a latency, build time or throughput metric regressed by more
+than --threshold (a fraction) or the amount of search work per query grew at
+all on the same query set.
+"""
+
+LATENCY_METRICS = ("p50_ms", "p95_ms", "p99_ms")
+WORK_METRICS = ("vertices_explored_mean", "edges_evaluated_mean")
+
+# Algorithms built from the graph before they are timed, by key. The builder
+# does all the preprocessing up front so that none of it lands in cold_ms.
+PREPROCESSED_ALGORITHMS: Dict[str, Callable[[CompactGraph], IAlgorithm]] = {
+    "ch": lambda graph: ContractionHierarchyAlgorithm(build_hierarchy(graph)),
+    "alt": lambda graph: ALTAlgorithm(table=LandmarkTable.build(graph)),
+    "cached_dijkstra": lambda graph: CachedAlgorithm(DijkstraAlgorithm()),
+    "arc_flags": lambda graph: ArcFlagsAlgorithm(build_arc_flags(graph)),
+    "hub_labels": lambda graph: HubLabelAlgorithm(HubLabels.build(graph, with_paths=True)),
+}
+
+Query = Tuple[str, str]
+
+
+def load_graph(args: argparse.Namespace) -> Tuple[CompactGraph, dict]:
+    """Load the graph a run asks for, generating its files first if needed.
+        Args:
+            args: Parsed command line (generator, vertices, seed, data_dir,
+            graph and vertex_file).
+        Returns:
+            The graph and a description of it for the report.
+    """
+    if args.generator:
+        os.makedirs(args.data_dir, exist_ok=True)
+        stem = os.path.join(args.data_dir, f"{args.generator}_{args.vertices}_{args.graph_seed}")
+        graph_file, vertex_file = f"{stem}_graph.txt", f"{stem}_vertices.txt"
+        if not (os.path.exists(graph_file) and os.path.exists(vertex_file)):
+            generated = GENERATORS[args.generator](args.vertices, args.graph_seed)
+            write_graph_files(generated, graph_file, vertex_file)
+        source = {"generator": args.generator, "requested_vertices": args.vertices, "graph_seed": args.graph_seed}
+    else:
+        graph_file, vertex_file = args.graph, args.vertex_file
+        source = {"graph_file": os.path.basename(graph_file), "vertices_file": os.path.basename(vertex_file)}
+    graph, stats = ingest_graph(graph_file, vertex_file)
+    source.update(vertices=graph.vertex_count(), edges=graph.edge_count(), load_seconds=stats.seconds)
+    return graph, source
+
+
+def largest_component(graph: CompactGraph) -> List[int]:
+    """Get the vertex ids of the largest weakly connected component.
+        Args:
+            graph: The graph to search.
+        Returns:
+            The component's vertex ids in increasing order.
+    """
+    vertex_count = graph.vertex_count()
+    offsets, targets = graph.offsets, graph.targets
+    neighbours: List[List[int]] = [[] for _ in range(vertex_count)]
+    for u in range(vertex_count):
+        for slot in range(offsets[u], offsets[u + 1]):
+            neighbours[u].append(targets[slot])
+            neighbours[targets[slot]].append(u)
+    component = [-1] * vertex_count
+    best, best_size = -1, 0
+    for root in range(vertex_count):
+        if component[root] != -1:
+            continue
+        component[root] = root
+        queue, size = deque([root]), 0
+        while queue:
+            u = queue.popleft()
+            size += 1
+            for v in neighbours[u]:
+                if component[v] == -1:
+                    component[v] = root
+                    queue.append(v)
+        if size > best_size:
+            best, best_size = root, size
+    return [v for v in range(vertex_count) if component[v] == best]
+
+
+def make_queries(graph: CompactGraph, count: int, seed: int) -> List[Query]:
+    """Draw a reproducible query set from the largest component.
+        Args:
+            graph: The graph to query.
+            count: Number of (start, destination) pairs.
+            seed: Random seed.
+        Returns:
+            The query pairs, by vertex name.
+    """
+    rng = random.Random(seed)
+    vertices = largest_component(graph)
+    return [(graph.names[rng.choice(vertices)], graph.names[rng.choice(vertices)]) for _ in range(count)]
+
+
+def query_digest(queries: Sequence[Query]) -> str:
+    """Get a short digest identifying a query set."""
+    digest = hashlib.sha256()
+    for start, destination in queries:
+        digest.update(f"{start}\0{destination}\n".encode('utf-8'))
+    return digest.hexdigest()[:16]
+
+
+def benchmark_algorithm(graph: CompactGraph, algorithm: IAlgorithm, queries: Sequence[Query],
+                        memory_queries: int = 20) -> dict:
+    """Run one algorithm over a query set and summarise it.
+        Args:
+            graph: The graph to search.
+            algorithm: The algorithm to time.
+            queries: The query pairs; the first is the cold query.
+            memory_queries: Queries to repeat under tracemalloc for peak
+            memory (0 to skip).
+        Returns:
+            The algorithm's metrics (see the module notes).
+    """
+    perf_counter = time.perf_counter
+    start, destination = queries[0]
+    began = perf_counter()
+    algorithm.find_path(graph, start, destination)
+    cold = perf_counter() - began
+
+    latencies: List[float] = []
+    vertices_explored = edges_evaluated = found = 0
+    gc.collect()
+    total_began = perf_counter()
+    for start, destination in queries[1:]:
+        began = perf_counter()
+        result = algorithm.find_path(graph, start, destination)
+        latencies.append(perf_counter() - began)
+        vertices_explored += result.vertices_explored
+        edges_evaluated += result.edges_evaluated
+        found += result.path_found
+    total = perf_counter() - total_began
+
+    peak_query_bytes = None
+    if memory_queries > 0:
+        peak_query_bytes = 0
+        tracemalloc.start()
+        try:
+            for start, destination in queries[1:memory_queries + 1]:
+                baseline = tracemalloc.get_traced_memory()[0]
+                tracemalloc.reset_peak()
+                algorithm.find_path(graph, start, destination)
+                peak_query_bytes = max(peak_query_bytes, tracemalloc.get_traced_memory()[1] - baseline)
+        finally:
+            tracemalloc.stop()
+
+    count = len(latencies)
+    latencies.sort()
+    return {
+        "name": algorithm.get_name(),
+        "queries": count,
+        "paths_found": found,
+        "cold_ms": 1000 * cold,
+        "p50_ms": 1000 * _percentile(latencies, 50),
+        "p95_ms": 1000 * _percentile(latencies, 95),
+        "p99_ms": 1000 * _percentile(latencies, 99),
+        "max_ms": 1000 * latencies[-1] if latencies else 0.0,
+        "mean_ms": 1000 * sum(latencies) / count if count else 0.0,
+        "queries_per_second": count / total if total else float('inf'),
+        "vertices_explored_mean": vertices_explored / count if count else 0.0,
+        "edges_evaluated_mean": edges_evaluated / count if count else 0.0,
+        "peak_query_kib": None if peak_query_bytes is None else peak_query_bytes / 1024,
+        "max_rss_mib": _max_rss_mib(),
+    }
+
+
+def run_suite(graph: CompactGraph, queries: Sequence[Query], algorithms: Optional[Dict[str, IAlgorithm]] = None,
+              memory_queries: int = 20,
+              preprocessed: Optional[Dict[str, Callable[[CompactGraph], IAlgorithm]]] = None) -> Dict[str, dict]:
+    """Benchmark every algorithm over the same queries.
+        Args:
+            graph: The graph to search.
+            queries: The query pairs (at least two).
+            algorithms: Algorithms by key (default: algorithms.ALGORITHMS).
+            memory_queries: See benchmark_algorithm.
+            preprocessed: Builders of further algorithms by key (see
+            PREPROCESSED_ALGORITHMS); their metrics add build_seconds.
+        Returns:
+            Metrics by algorithm key.
+    """
+    if len(queries) < 2:
+        raise ValueError("need at least two queries: one cold, one timed")
+    results = {key: benchmark_algorithm(graph, algorithm, queries, memory_queries)
+               for key, algorithm in (ALGORITHMS if algorithms is None else algorithms).items()}
+    for key, build in (preprocessed or {}).items():
+        gc.collect()
+        began = time.perf_counter()
+        algorithm = build(graph)
+        build_seconds = time.perf_counter() - began
+        results[key] = benchmark_algorithm(graph, algorithm, queries, memory_queries)
+        results[key]["build_seconds"] = build_seconds
+    return results
+
+
+def compare_reports(baseline: dict, current: dict, threshold: float = 0.1) -> Tuple[List[str], List[str]]:
+    """Compare two run reports algorithm by algorithm.
+        Args:
+            baseline: The earlier report.
+            current: The later report.
+            threshold: Relative slowdown (of latency, build time or
+            throughput) that counts as a regression.
+        Returns:
+            One line per algorithm and metric, and the lines that are
+            regressions.
+    """
+    lines: List[str] = []
+    regressions: List[str] = []
+    if baseline.get("query_digest") != current.get("query_digest"):
+        lines.append("warning: the reports ran different query sets; only timings are comparable")
+    for key in sorted(set(baseline["results"]) & set(current["results"])):
+        before, after = baseline["results"][key], current["results"][key]
+        metrics = LATENCY_METRICS + ("queries_per_second",) + WORK_METRICS
+        if "build_seconds" in before and "build_seconds" in after:
+            metrics += ("build_seconds",)
+        for metric in metrics:
+            old, new = before[metric], after[metric]
+            change = (new - old) / old if old else 0.0
+            regressed = (change < -threshold if metric == "queries_per_second"
+                         else new > old and baseline.get("query_digest") == current.get("query_digest")
+                         if metric in WORK_METRICS
+                         else change > threshold)
+            line = f"{key:24} {metric:24} {old:12.4f} -> {new:12.4f} ({change:+.1%})"
+            lines.append(line + ("  REGRESSION" if regressed else ""))
+            if regressed:
+                regressions.append(line)
+    return lines, regressions
+
+
+def _percentile(ordered: Sequence[float], q: float) -> float:
+    """Nearest-rank percentile of an ascending sequence."""
+    if not ordered:
+        return 0.0
+    rank = max(1, -(-len(ordered) * q // 100))
+    return ordered[int(rank) - 1]
+
+
+def _max_rss_mib() -> Optional[float]:
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in KiB on Linux and in bytes on macOS.
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Pathfinding benchmark suite.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    run = commands.add_parser("run", help="benchmark every algorithm on one graph")
+    run.add_argument("--graph", default="graph_v2.txt")
+    run.add_argument("--vertex-file", default="vertices_v1.txt")
+    run.add_argument("--generator", choices=sorted(GENERATORS), default=None,
+                     help="benchmark a synthetic graph instead of --graph")
+    run.add_argument("--vertices", type=int, default=10000, help="size of the synthetic graph")
+    run.add_argument("--graph-seed", type=int, default=0)
+    run.add_argument("--data-dir", default="bench_data", help="where synthetic graph files are kept")
+    run.add_argument("--queries", type=int, default=500)
+    run.add_argument("--seed", type=int, default=351, help="query set seed")
+    run.add_argument("--algorithms", nargs="+", choices=sorted(ALGORITHMS) + sorted(PREPROCESSED_ALGORITHMS),
+                     default=None, help="run only these (default: every algorithm in algorithms.ALGORITHMS)")
+    run.add_argument("--preprocessed", action="store_true",
+                     help="also run every algorithm in PREPROCESSED_ALGORITHMS")
+    run.add_argument("--memory-queries", type=int, default=20)
+    run.add_argument("--output", default=None, help="write the JSON report here instead of stdout")
+    compare = commands.add_parser("compare", help="compare two reports")
+    compare.add_argument("baseline")
+    compare.add_argument("current")
+    compare.add_argument("--threshold", type=float, default=0.1)
+    args = parser.parse_args()
+
+    if args.command == "compare":
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        with open(args.current) as f:
+            current = json.load(f)
+        lines, regressions = compare_reports(baseline, current, args.threshold)
+        print(f"{baseline.get('commit')} -> {current.get('commit')}")
+        print("\n".join(lines))
+        if regressions:
+            print(f"{len(regressions)} regression(s) above {args.threshold:.0%}")
+            sys.exit(1)
+        return
+
+    graph, source = load_graph(args)
+    queries = make_queries(graph, args.queries + 1, args.seed)
+    if args.algorithms:
+        algorithms = {key: ALGORITHMS[key] for key in args.algorithms if key in ALGORITHMS}
+        preprocessed = {key: PREPROCESSED_ALGORITHMS[key] for key in args.algorithms
+                        if key in PREPROCESSED_ALGORITHMS}
+    else:
+        algorithms = ALGORITHMS
+        preprocessed = {}
+    if args.preprocessed:
+        preprocessed = PREPROCESSED_ALGORITHMS
+    report = {
+        "commit": _git_commit(),
+        "timestamp": datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "graph": source,
+        "query_seed": args.seed,
+        "query_digest": query_digest(queries),
+        "results": run_suite(graph, queries, algorithms, args.memory_queries, preprocessed),
+    }
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+
+if __name__ == "__main__":
+    main()
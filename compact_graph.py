@@ -0,0 +1,318 @@
+from __future__ import annotations
+from array import array
+from typing import Dict, Iterator, List, Mapping, Optional, Sequence, Tuple
+import math
+
+from graph_interfaces import IEdge, IGraph, IVertex
+from graph_impl import haversine_distance
+
+"""
+Compressed-sparse-row (CSR) graph representation.
+
+Vertices are numbered 0..V-1 in the order they were first seen. The outgoing
+edges of vertex u are stored contiguously in positions offsets[u] up to (but
+not including) offsets[u + 1] of the targets and weights arrays, so walking a
+vertex's neighbours is a slice of three flat arrays instead of a dict of Edge
+objects. Coordinates are kept in two parallel float arrays, with NaN standing
+in for a vertex that has no latitude/longitude. The highway of every edge is
+an index into a small table of highway names (-1 when unknown).
+
+A CompactGraph is frozen: it still satisfies the IGraph protocol so it can be
+handed to any IAlgorithm, but every mutating method raises TypeError.
+"""
+
+FROZEN_MESSAGE = "CompactGraph is frozen; build a new one from a mutable Graph."
+
+
+class CompactGraph(IGraph):
+    """Class for a frozen graph stored as contiguous CSR arrays."""
+
+    def __init__(self, names: Sequence[str], offsets: Sequence[int], targets: Sequence[int],
+                 weights: Sequence[float], latitudes: Optional[Sequence[float]] = None,
+                 longitudes: Optional[Sequence[float]] = None, highways: Optional[Sequence[str]] = None,
+                 edge_highways: Optional[Sequence[int]] = None,
+                 index: Optional[Mapping[str, int]] = None) -> None:
+        """Constructor for the compact graph.
+            Args:
+                names: Vertex names, indexed by vertex id.
+                offsets: V + 1 edge offsets, offsets[u] is the first edge of u.
+                targets: Destination vertex id of every edge.
+                weights: Weight of every edge.
+                latitudes: Latitude per vertex id (NaN when unknown).
+                longitudes: Longitude per vertex id (NaN when unknown).
+                highways: Highway name table.
+                edge_highways: Index into highways per edge (-1 when unknown).
+                index: Name-to-id mapping; built from names when omitted.
+            Returns:
+                None
+        """
+        if len(offsets) != len(names) + 1:
+            raise ValueError("offsets must have exactly one entry more than names")
+        if len(targets) != len(weights) or offsets[-1] != len(targets):
+            raise ValueError("targets and weights must both hold offsets[-1] edges")
+        nan = float('nan')
+        self.names = names
+        self.index: Mapping[str, int] = index if index is not None else {name: i for i, name in enumerate(names)}
+        self.offsets = offsets
+        self.targets = targets
+        self.weights = weights
+        self.latitudes = latitudes if latitudes is not None else array('d', [nan]) * len(names)
+        self.longitudes = longitudes if longitudes is not None else array('d', [nan]) * len(names)
+        self.highways = highways if highways is not None else []
+        self.edge_highways = edge_highways if edge_highways is not None else array('i', [-1]) * len(targets)
+        # Set on graphs made by reversed(): forward_slots[e] is the edge slot in
+        # the original graph that reverse edge slot e was made from.
+        self.forward_slots: Optional[Sequence[int]] = None
+        self._reverse: Optional[CompactGraph] = None
+
+    @classmethod
+    def from_graph(cls, graph: IGraph) -> CompactGraph:
+        """Build a compact graph from any IGraph (normally a graph_impl.Graph).
+            Args:
+                graph: The graph to convert. Edges pointing at vertices that
+                are no longer part of the graph are dropped.
+            Returns:
+                The frozen CSR copy of the graph.
+        """
+        vertices = graph.get_vertices()
+        names = [vertex.get_name() for vertex in vertices]
+        index = {name: i for i, name in enumerate(names)}
+        offsets = array('q', [0])
+        targets = array('q')
+        weights = array('d')
+        latitudes = array('d')
+        longitudes = array('d')
+        highway_ids: Dict[str, int] = {}
+        edge_highways = array('i')
+        nan = float('nan')
+        for vertex in vertices:
+            for edge in vertex.get_edges():
+                target = index.get(edge.get_destination().get_name())
+                if target is not None:
+                    targets.append(target)
+                    weights.append(edge.get_weight())
+                    get_highway = getattr(edge, 'get_highway', None)
+                    highway = get_highway() if get_highway else None
+                    edge_highways.append(-1 if highway is None else highway_ids.setdefault(highway, len(highway_ids)))
+            offsets.append(len(targets))
+            get_coordinates = getattr(vertex, 'get_coordinates', None)
+            coordinates = get_coordinates() if get_coordinates else None
+            lat, lon = coordinates if coordinates else (nan, nan)
+            latitudes.append(lat)
+            longitudes.append(lon)
+        return cls(names, offsets, targets, weights, latitudes, longitudes, list(highway_ids), edge_highways)
+
+    @classmethod
+    def from_files(cls, graph_file_path: str, vertices_file_path: str = "vertices_v1.txt") -> CompactGraph:
+        """Build a compact graph straight from the CSV files read by
+        program.read_graph, without creating Vertex and Edge objects.
+        Vertex ids follow the same first-seen order read_graph uses, so the
+        result matches CompactGraph.from_graph(read_graph(...)). See ingest.py
+        for chunked parsing options and load statistics.
+            Args:
+                graph_file_path: Path to the edge CSV file (graph_v2.txt).
+                vertices_file_path: Path to the coordinate CSV file (vertices_v1.txt).
+            Returns:
+                The frozen CSR graph.
+        """
+        from ingest import ingest_graph
+        return ingest_graph(graph_file_path, vertices_file_path)[0]
+
+    def reversed(self) -> CompactGraph:
+        """Get the reverse graph, where every edge u->v becomes v->u with the
+        same weight. Vertex ids, names and coordinates are shared with this
+        graph. The result is built once and cached.
+            Args:
+                None
+            Returns:
+                The reversed CompactGraph, with forward_slots mapping each of
+                its edge slots back to the edge slot in this graph.
+        """
+        if self._reverse is None:
+            vertex_count = len(self.names)
+            offsets, targets, weights = self.offsets, self.targets, self.weights
+            counts = array('q', [0]) * (vertex_count + 1)
+            for target in targets:
+                counts[target + 1] += 1
+            for v in range(vertex_count):
+                counts[v + 1] += counts[v]
+            reverse_offsets = array('q', counts)
+            reverse_targets = array('q', [0]) * len(targets)
+            reverse_weights = array('d', [0.0]) * len(targets)
+            forward_slots = array('q', [0]) * len(targets)
+            next_slot = counts
+            for source in range(vertex_count):
+                for e in range(offsets[source], offsets[source + 1]):
+                    target = targets[e]
+                    slot = next_slot[target]
+                    next_slot[target] = slot + 1
+                    reverse_targets[slot] = source
+                    reverse_weights[slot] = weights[e]
+                    forward_slots[slot] = e
+            edge_highways = self.edge_highways
+            reverse = CompactGraph(self.names, reverse_offsets, reverse_targets, reverse_weights,
+                                   self.latitudes, self.longitudes, self.highways,
+                                   array('i', (edge_highways[e] for e in forward_slots)), self.index)
+            reverse.forward_slots = forward_slots
+            reverse._reverse = self
+            self._reverse = reverse
+        return self._reverse
+
+    def highway_name(self, edge_slot: int) -> Optional[str]:
+        """Get the highway of the edge in the given slot, or None if unknown."""
+        highway = self.edge_highways[edge_slot]
+        return self.highways[highway] if highway >= 0 else None
+
+    def vertex_count(self) -> int:
+        """Get the number of vertices in the graph."""
+        return len(self.names)
+
+    def edge_count(self) -> int:
+        """Get the number of edges in the graph."""
+        return len(self.targets)
+
+    def vertex_id(self, vertex_name: str) -> Optional[int]:
+        """Get the integer id of a vertex, or None if it is not in the graph."""
+        return self.index.get(vertex_name)
+
+    def vertex_name(self, vertex_id: int) -> str:
+        """Get the name of the vertex with the given id."""
+        return self.names[vertex_id]
+
+    def neighbors(self, vertex_id: int) -> Iterator[Tuple[int, float]]:
+        """Iterate over the (target id, weight) pairs of a vertex's outgoing edges."""
+        for e in range(self.offsets[vertex_id], self.offsets[vertex_id + 1]):
+            yield self.targets[e], self.weights[e]
+
+    def coordinates(self, vertex_id: int) -> Optional[tuple[float, float]]:
+        """Get the (latitude, longitude) of a vertex, or None if it has none."""
+        lat = self.latitudes[vertex_id]
+        lon = self.longitudes[vertex_id]
+        if math.isnan(lat) or math.isnan(lon):
+            return None
+        return (lat, lon)
+
+    def get_vertex(self, vertex_name: str) -> Optional[CompactVertex]:
+        """Get a read-only vertex view by name, or None if it is not in the graph."""
+        vertex_id = self.index.get(vertex_name)
+        return CompactVertex(self, vertex_id) if vertex_id is not None else None
+
+    def get_vertices(self) -> List[IVertex]:
+        """Get read-only views of all vertices in the graph.
+            Args:
+                None
+            Returns:
+                List of vertex views, ordered by vertex id.
+        """
+        return [CompactVertex(self, vertex_id) for vertex_id in range(len(self.names))]
+
+    def get_edges(self) -> List[IEdge]:
+        """Get read-only views of all edges in the graph.
+            Args:
+                None
+            Returns:
+                List of edge views, ordered by source vertex id.
+        """
+        return [CompactEdge(self, source, e)
+                for source in range(len(self.names))
+                for e in range(self.offsets[source], self.offsets[source + 1])]
+
+    def add_vertex(self, vertex: IVertex) -> None:
+        raise TypeError(FROZEN_MESSAGE)
+
+    def remove_vertex(self, vertex_name: str) -> None:
+        raise TypeError(FROZEN_MESSAGE)
+
+    def add_edge(self, edge: IEdge) -> None:
+        raise TypeError(FROZEN_MESSAGE)
+
+    def remove_edge(self, edge_name: str) -> None:
+        raise TypeError(FROZEN_MESSAGE)
+
+
+class CompactVertex(IVertex):
+    """Read-only IVertex view onto one vertex id of a CompactGraph."""
+
+    __slots__ = ('_graph', '_id')
+
+    def __init__(self, graph: CompactGraph, vertex_id: int) -> None:
+        self._graph = graph
+        self._id = vertex_id
+
+    def get_id(self) -> int:
+        """Get the integer id of the vertex."""
+        return self._id
+
+    def get_name(self) -> str:
+        return self._graph.names[self._id]
+
+    def set_name(self, name: str) -> None:
+        raise TypeError(FROZEN_MESSAGE)
+
+    def add_edge(self, edge: IEdge) -> None:
+        raise TypeError(FROZEN_MESSAGE)
+
+    def remove_edge(self, edge_name: str) -> None:
+        raise TypeError(FROZEN_MESSAGE)
+
+    def get_edges(self) -> List[IEdge]:
+        offsets = self._graph.offsets
+        return [CompactEdge(self._graph, self._id, e) for e in range(offsets[self._id], offsets[self._id + 1])]
+
+    def set_visited(self, visited: bool) -> None:
+        raise TypeError(FROZEN_MESSAGE)
+
+    def is_visited(self) -> bool:
+        return False
+
+    def get_coordinates(self) -> Optional[tuple[float, float]]:
+        return self._graph.coordinates(self._id)
+
+    def straight_line_distance(self, other: IVertex) -> Optional[float]:
+        """Calculates the Haversine distance to another vertex in miles,
+        or None if either vertex has no coordinates."""
+        mine = self.get_coordinates()
+        theirs = other.get_coordinates()
+        if mine and theirs:
+            return haversine_distance(mine[0], mine[1], theirs[0], theirs[1])
+        return None
+
+    def __eq__(self, other: object) -> bool:
+        return isinstance(other, CompactVertex) and other._graph is self._graph and other._id == self._id
+
+    def __hash__(self) -> int:
+        return hash((id(self._graph), self._id))
+
+
+class CompactEdge(IEdge):
+    """Read-only IEdge view onto one edge slot of a CompactGraph."""
+
+    __slots__ = ('_graph', '_source', '_slot')
+
+    def __init__(self, graph: CompactGraph, source: int, slot: int) -> None:
+        self._graph = graph
+        self._source = source
+        self._slot = slot
+
+    def get_name(self) -> str:
+        names = self._graph.names
+        return f"{names[self._source]}->{names[self._graph.targets[self._slot]]}"
+
+    def set_name(self, name: str) -> None:
+        raise TypeError(FROZEN_MESSAGE)
+
+    def get_source(self) -> IVertex:
+        return CompactVertex(self._graph, self._source)
+
+    def get_destination(self) -> IVertex:
+        return CompactVertex(self._graph, self._graph.targets[self._slot])
+
+    def get_weight(self) -> float:
+        return self._graph.weights[self._slot]
+
+    def get_highway(self) -> Optional[str]:
+        highway = self._graph.edge_highways[self._slot]
+        return self._graph.highways[highway] if highway >= 0 else None
+
+    def set_weight(self, weight: float) -> None:
+        raise TypeError(FROZEN_MESSAGE)
@@ -0,0 +1,320 @@
+from __future__ import annotations
+from array import array
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+import argparse
+import json
+import os
+import random
+import sys
+import threading
+import time
+
+from graph_interfaces import IAlgorithm, AlgorithmResult
+from graph_impl import Graph
+from compact_graph import CompactGraph
+from query_context import QueryContext, get_query_context
+from algorithms import DijkstraAlgorithm, greedyBestFirstAlgorithm, AStarAlgorithm
+from program import read_graph
+
+"""
+Concurrent query serving.
+
+graph_impl.Graph is a plain mutable object: a search running while another
+thread calls add_edge or remove_edge can see a half-updated graph. This module
+serves queries from many threads against immutable versions of the graph
+instead, published read-copy-update style:
+
+* GraphStore owns the mutable Graph. Writers change it through the store
+  (one writer at a time) and each completed change is published as a new
+  GraphSnapshot: a frozen CompactGraph plus its QueryContext.
+* Publishing is a single reference assignment. A reader calls snapshot()
+  once, which is an attribute read with no lock, and runs its whole query on
+  that version. Readers never wait for writers, and a writer never waits for
+  readers. An old version stays alive exactly as long as some query still
+  holds it and is then garbage collected (the RCU grace period).
+* Weight-only updates (set_weights) are copy-on-write on the weights array
+  alone: the new version shares offsets, targets, names and coordinates with
+  the previous one. Structural changes (write()) rebuild the CSR arrays, so
+  batch them.
+
+The searches themselves keep no state on vertices (Vertex.set_visited is
+never used); every query takes a private SearchScratch from the context's
+pool. list.append and list.pop are atomic on both GIL and free-threaded
+builds, so the pool needs no lock.
+
+ConcurrentQueryExecutor runs queries on a ThreadPoolExecutor. With the GIL
+the pure-Python kernels take turns on one core, so threads only help when
+queries wait on something else. On a free-threaded build (python3.13t and
+later) the same code runs searches truly in parallel. For CPU-bound batches
+on a GIL build, use parallel.ParallelQueryExecutor (processes) instead.
+
+    python concurrent_queries.py --queries 20000 --max-workers 8
+"""
+
+DEFAULT_ALGORITHMS: Dict[str, IAlgorithm] = {
+    "dijkstra": DijkstraAlgorithm(),
+    "greedy": greedyBestFirstAlgorithm(),
+    "astar": AStarAlgorithm(),
+}
+
+Query = Tuple[str, str]
+
+
+@dataclass(frozen=True)
+class GraphSnapshot:
+    version: int
+    graph: CompactGraph
+    context: QueryContext
+
+
+class GraphStore:
+    """Class that publishes immutable versions of a mutable graph."""
+
+    def __init__(self, graph: Graph) -> None:
+        """Constructor that publishes the graph's current state. The store
+        takes ownership of the graph: change it only through the store.
+            Args:
+                graph: The mutable graph to serve.
+            Returns:
+                None
+        """
+        self._graph = graph
+        self._write_lock = threading.Lock()
+        self._version = 0
+        self._current = self._publish(CompactGraph.from_graph(graph))
+
+    def snapshot(self) -> GraphSnapshot:
+        """Get the latest published version. Never blocks.
+            Args:
+                None
+            Returns:
+                The current GraphSnapshot.
+        """
+        return self._current
+
+    @contextmanager
+    def write(self) -> Iterator[Graph]:
+        """Change the graph and publish the result as one new version.
+
+            with store.write() as graph:
+                graph.remove_edge("Portland->Salem")
+                graph.add_edge(Edge("Portland->Salem", graph.vertices["Salem"], 52.0))
+
+        Other writers wait; readers keep using the previous version until the
+        block finishes. If the block raises, nothing is published, but the
+        mutable graph keeps whatever changes were already made.
+            Args:
+                None
+            Returns:
+                Context manager yielding the mutable Graph.
+        """
+        with self._write_lock:
+            yield self._graph
+            self._current = self._publish(CompactGraph.from_graph(self._graph))
+
+    def set_weights(self, updates: Iterable[Tuple[str, str, float]]) -> GraphSnapshot:
+        """Change edge weights and publish them as one new version, copying
+        only the weights array.
+            Args:
+                updates: (source name, destination name, weight) triples. Every
+                edge from source to destination gets the new weight.
+            Returns:
+                The published GraphSnapshot.
+        """
+        with self._write_lock:
+            previous = self._current.graph
+            weights = array('d', previous.weights)
+            changed: List[Tuple[str, str, float]] = []
+            for source, destination, weight in updates:
+                u, v = previous.vertex_id(source), previous.vertex_id(destination)
+                slots = [] if u is None or v is None else \
+                    [slot for slot in range(previous.offsets[u], previous.offsets[u + 1]) if previous.targets[slot] == v]
+                if not slots:
+                    raise KeyError(f"no edge {source}->{destination}")
+                for slot in slots:
+                    weights[slot] = weight
+                changed.append((source, destination, weight))
+            for source, destination, weight in changed:
+                for edge in self._graph.vertices[source].get_edges():
+                    if edge.get_destination().get_name() == destination:
+                        edge.set_weight(weight)
+            self._current = self._publish(CompactGraph(
+                previous.names, previous.offsets, previous.targets, weights, previous.latitudes,
+                previous.longitudes, previous.highways, previous.edge_highways, previous.index))
+            return self._current
+
+    def _publish(self, compact: CompactGraph) -> GraphSnapshot:
+        # Build the context on the writer's thread so readers find it cached.
+        self._version += 1
+        return GraphSnapshot(self._version, compact, get_query_context(compact))
+
+
+class ConcurrentQueryExecutor:
+    """Class for running path queries on a pool of threads."""
+
+    def __init__(self, store: GraphStore, workers: Optional[int] = None,
+                 algorithms: Optional[Dict[str, IAlgorithm]] = None) -> None:
+        """Constructor that starts the thread pool.
+            Args:
+                store: The store whose latest version queries run against.
+                workers: Number of threads (default: os.cpu_count()).
+                algorithms: Algorithms by key (default: "dijkstra", "greedy"
+                and "astar"). They are shared by all threads, so they must
+                not keep per-query state on themselves.
+            Returns:
+                None
+        """
+        self.store = store
+        self.workers = workers or os.cpu_count() or 1
+        self.algorithms = dict(algorithms or DEFAULT_ALGORITHMS)
+        self._pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="query")
+
+    def __enter__(self) -> ConcurrentQueryExecutor:
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def close(self) -> None:
+        """Wait for running queries and stop the threads.
+            Args:
+                None
+            Returns:
+                None
+        """
+        self._pool.shutdown(wait=True)
+
+    def submit(self, start: str, destination: str, algorithm: str = "dijkstra",
+               snapshot: Optional[GraphSnapshot] = None) -> Future:
+        """Queue one query.
+            Args:
+                start: Start vertex name.
+                destination: Destination vertex name.
+                algorithm: Key of the algorithm to run.
+                snapshot: Version to run against (default: the latest one
+                when the query starts).
+            Returns:
+                Future resolving to the AlgorithmResult.
+        """
+        runner = self._algorithm(algorithm)
+        return self._pool.submit(_run_query, self.store, snapshot, runner, start, destination)
+
+    def map(self, queries: Iterable[Query], algorithm: str = "dijkstra",
+            consistent: bool = True) -> Iterator[AlgorithmResult]:
+        """Run queries on the pool and yield results in input order. At most
+        4 * workers queries are queued at once.
+            Args:
+                queries: (start name, destination name) pairs.
+                algorithm: Key of the algorithm to run.
+                consistent: Run the whole batch on the version current when
+                map is called; otherwise every query uses the latest version.
+            Returns:
+                Iterator of AlgorithmResult, one per query.
+        """
+        snapshot = self.store.snapshot() if consistent else None
+        runner = self._algorithm(algorithm)
+        pending: deque[Future] = deque()
+        limit = 4 * self.workers
+        for start, destination in queries:
+            if len(pending) >= limit:
+                yield pending.popleft().result()
+            pending.append(self._pool.submit(_run_query, self.store, snapshot, runner, start, destination))
+        for future in pending:
+            yield future.result()
+
+    def _algorithm(self, key: str) -> IAlgorithm:
+        if key not in self.algorithms:
+            raise ValueError(f"Unknown algorithm: {key}")
+        return self.algorithms[key]
+
+
+def _run_query(store: GraphStore, snapshot: Optional[GraphSnapshot], algorithm: IAlgorithm,
+               start: str, destination: str) -> AlgorithmResult:
+    snapshot = snapshot or store.snapshot()
+    return algorithm.find_path(snapshot.graph, start, destination)
+
+
+def gil_enabled() -> bool:
+    """Check whether this interpreter runs with the GIL."""
+    is_gil_enabled = getattr(sys, '_is_gil_enabled', None)
+    return is_gil_enabled() if is_gil_enabled is not None else True
+
+
+def throughput_benchmark(store: GraphStore, queries: Sequence[Query], max_workers: Optional[int] = None,
+                         algorithm: str = "dijkstra", writes_per_second: float = 0.0) -> List[dict]:
+    """Time the same query batch with 1..max_workers threads, optionally with
+    a writer thread publishing weight changes at the same time.
+        Args:
+            store: The store to query.
+            queries: The (start, destination) pairs to run.
+            max_workers: Largest pool size to try (default: os.cpu_count()).
+            algorithm: Key of the algorithm to run.
+            writes_per_second: Weight updates the writer publishes per second
+            (0 for no writer).
+        Returns:
+            One dict per pool size with workers, seconds, queries_per_second,
+            speedup relative to one thread and versions published meanwhile.
+    """
+    max_workers = max_workers or os.cpu_count() or 1
+    edges = [(vertex.get_name(), edge.get_destination().get_name(), edge.get_weight())
+             for vertex in store.snapshot().graph.get_vertices() for edge in vertex.get_edges()]
+    rows = []
+    baseline = None
+    for workers in range(1, max_workers + 1):
+        stop = threading.Event()
+        writer = None
+        if writes_per_second > 0 and edges:
+            def write_loop() -> None:
+                rng = random.Random(workers)
+                while not stop.wait(1.0 / writes_per_second):
+                    source, destination, weight = rng.choice(edges)
+                    store.set_weights([(source, destination, weight * rng.uniform(0.9, 1.1))])
+            writer = threading.Thread(target=write_loop, name="writer", daemon=True)
+        with ConcurrentQueryExecutor(store, workers) as executor:
+            list(executor.map(queries[:workers * 4], algorithm))
+            first_version = store.snapshot().version
+            if writer is not None:
+                writer.start()
+            start = time.perf_counter()
+            count = sum(1 for _ in executor.map(queries, algorithm, consistent=False))
+            seconds = time.perf_counter() - start
+            stop.set()
+            if writer is not None:
+                writer.join()
+        baseline = baseline or seconds
+        rows.append({
+            "workers": workers,
+            "queries": count,
+            "seconds": seconds,
+            "queries_per_second": count / seconds if seconds else float('inf'),
+            "speedup": baseline / seconds if seconds else float('inf'),
+            "versions_published": store.snapshot().version - first_version,
+            "gil_enabled": gil_enabled(),
+        })
+    return rows
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Threaded query throughput benchmark.")
+    parser.add_argument("--graph", default="graph_v2.txt")
+    parser.add_argument("--vertices", default="vertices_v1.txt")
+    parser.add_argument("--queries", type=int, default=20000)
+    parser.add_argument("--max-workers", type=int, default=None)
+    parser.add_argument("--algorithm", default="dijkstra", choices=sorted(DEFAULT_ALGORITHMS))
+    parser.add_argument("--writes-per-second", type=float, default=0.0)
+    parser.add_argument("--seed", type=int, default=351)
+    args = parser.parse_args()
+
+    store = GraphStore(read_graph(args.graph, args.vertices))
+    names = list(store.snapshot().graph.names)
+    rng = random.Random(args.seed)
+    queries = [(rng.choice(names), rng.choice(names)) for _ in range(args.queries)]
+    for row in throughput_benchmark(store, queries, args.max_workers, args.algorithm, args.writes_per_second):
+        print(json.dumps(row))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,448 @@
+from __future__ import annotations
+from array import array
+from dataclasses import dataclass
+from typing import Dict, List, Sequence, Tuple
+import heapq
+import math
+import struct
+import sys
+import time
+
+from graph_interfaces import IAlgorithm, IGraph, AlgorithmResult
+from compact_graph import CompactGraph
+from query_context import get_query_context
+from instrumentation import probe_queries
+
+"""
+Contraction Hierarchies (CH).
+
+Preprocessing (build_hierarchy) contracts the vertices one at a time in order
+of importance. Contracting v removes it from the remaining graph and, for every
+pair of remaining neighbours u -> v -> x whose shortest connection really goes
+through v, adds a shortcut edge u -> x whose "middle" is v. Whether a shortcut
+is needed is decided by a bounded local Dijkstra (the witness search); if it
+gives up early the shortcut is added anyway, which is always safe.
+
+The order comes from a lazily updated priority queue keyed by
+
+    edge difference (shortcuts added - edges removed) + contracted neighbours
+
+so cheap, unimportant vertices are contracted first and highways end up on top.
+
+Every edge that is still present when a vertex v is contracted leads to a
+vertex of higher rank. Those edges are kept in two CSR structures:
+
+    up       v -> x for outgoing edges (searched forward from the start)
+    down     v -> u for incoming edges u -> v (searched backward from the goal)
+
+A query is a bidirectional Dijkstra where both sides only ever move upwards in
+rank; the shortest path is the best meeting vertex. Shortcuts found on the way
+are expanded back into the original city-by-city path through their middle
+vertices.
+
+Hierarchies can be saved to and loaded from a small binary file (see
+ContractionHierarchy.save) so preprocessing can run offline:
+
+    python contraction_hierarchies.py graph_v2.txt vertices_v1.txt oregon.ch
+"""
+
+CH_MAGIC = b"CHPF"
+CH_FORMAT_VERSION = 1
+_CH_HEADER = struct.Struct('<4sBBxxqq')
+NO_MIDDLE = -1
+
+
+@dataclass
+class HierarchyEdges:
+    offsets: array
+    targets: array
+    weights: array
+    middles: array
+
+
+class ContractionHierarchy:
+    """Class for a preprocessed contraction hierarchy and its query."""
+
+    def __init__(self, names: List[str], rank: array, up: HierarchyEdges, down: HierarchyEdges,
+                 build_time: float = 0.0) -> None:
+        """Constructor for the hierarchy.
+            Args:
+                names: Vertex names, indexed by vertex id.
+                rank: Contraction order of every vertex (0 = contracted first).
+                up: Upward edges searched from the start.
+                down: Reversed upward edges searched from the goal.
+                build_time: Seconds spent preprocessing, for reporting.
+            Returns:
+                None
+        """
+        self.names = names
+        self.index: Dict[str, int] = {name: i for i, name in enumerate(names)}
+        self.rank = rank
+        self.up = up
+        self.down = down
+        self.build_time = build_time
+
+    def shortcut_count(self) -> int:
+        """Get the number of shortcut edges added during preprocessing."""
+        return sum(1 for m in self.up.middles if m != NO_MIDDLE) + \
+            sum(1 for m in self.down.middles if m != NO_MIDDLE)
+
+    def query(self, start: int, goal: int) -> Tuple[float, List[int], int, int]:
+        """Find the shortest path between two vertex ids.
+            Args:
+                start: Start vertex id.
+                goal: Goal vertex id.
+            Returns:
+                (distance, vertex ids of the unpacked path, vertices explored,
+                edges evaluated); distance is inf and the path empty when the
+                goal is unreachable.
+        """
+        up, down = self.up, self.down
+        heappush, heappop = heapq.heappush, heapq.heappop
+        # parent maps: vertex -> (previous vertex, middle of the edge used)
+        f_dist: Dict[int, float] = {start: 0.0}
+        b_dist: Dict[int, float] = {goal: 0.0}
+        f_parent: Dict[int, Tuple[int, int]] = {}
+        b_parent: Dict[int, Tuple[int, int]] = {}
+        f_frontier = [(0.0, start)]
+        b_frontier = [(0.0, goal)]
+        best = 0.0 if start == goal else math.inf
+        meeting = start if start == goal else -1
+        vertices_explored = 0
+        edges_evaluated = 0
+
+        while f_frontier or b_frontier:
+            f_top = f_frontier[0][0] if f_frontier else math.inf
+            b_top = b_frontier[0][0] if b_frontier else math.inf
+            if min(f_top, b_top) >= best:
+                break
+            if f_top <= b_top:
+                frontier, dist, other, parent, edges = f_frontier, f_dist, b_dist, f_parent, up
+            else:
+                frontier, dist, other, parent, edges = b_frontier, b_dist, f_dist, b_parent, down
+            d, u = heappop(frontier)
+            if d > dist[u]:
+                continue
+            vertices_explored += 1
+            if u in other and d + other[u] < best:
+                best = d + other[u]
+                meeting = u
+            first, last = edges.offsets[u], edges.offsets[u + 1]
+            edges_evaluated += last - first
+            for e in range(first, last):
+                v = edges.targets[e]
+                nd = d + edges.weights[e]
+                if nd < dist.get(v, math.inf):
+                    dist[v] = nd
+                    parent[v] = (u, edges.middles[e])
+                    heappush(frontier, (nd, v))
+
+        if meeting == -1:
+            return math.inf, [], vertices_explored, edges_evaluated
+
+        # Walk both trees back to the meeting vertex, unpacking every edge.
+        path = [start]
+        forward_hops = []
+        vertex = meeting
+        while vertex != start:
+            previous, middle = f_parent[vertex]
+            forward_hops.append((previous, vertex, middle))
+            vertex = previous
+        for previous, vertex, middle in reversed(forward_hops):
+            path.extend(self._unpack(previous, vertex, middle))
+        vertex = meeting
+        while vertex != goal:
+            following, middle = b_parent[vertex]
+            path.extend(self._unpack(vertex, following, middle))
+            vertex = following
+        return best, path, vertices_explored, edges_evaluated
+
+    def _unpack(self, source: int, target: int, middle: int) -> List[int]:
+        """Expand the edge source -> target into the original vertices after
+        source, ending with target."""
+        result = []
+        stack = [(source, target, middle)]
+        while stack:
+            u, x, m = stack.pop()
+            if m == NO_MIDDLE:
+                result.append(x)
+                continue
+            # u -> m was stored at m (m ranks below u) among m's downward
+            # edges, m -> x among m's upward edges.
+            stack.append((m, x, self._middle_of(self.up, m, x)))
+            stack.append((u, m, self._middle_of(self.down, m, u)))
+        return result
+
+    @staticmethod
+    def _middle_of(edges: HierarchyEdges, vertex: int, neighbor: int) -> int:
+        for e in range(edges.offsets[vertex], edges.offsets[vertex + 1]):
+            if edges.targets[e] == neighbor:
+                return edges.middles[e]
+        raise ValueError("corrupt hierarchy: shortcut half is missing")
+
+    def save(self, path: str) -> None:
+        """Write the hierarchy to a binary file.
+
+        Layout (little-endian): a header with the magic bytes b"CHPF", the
+        format version, the vertex count and the name byte count; then the
+        name byte offsets (int64[V + 1]), the UTF-8 names, the rank array
+        (int64[V]), and for the up and down edge sets the edge count (int64)
+        followed by offsets (int64[V + 1]), targets (int64[E]), weights
+        (float64[E]) and middles (int64[E]).
+            Args:
+                path: Destination file path.
+            Returns:
+                None
+        """
+        encoded = [name.encode('utf-8') for name in self.names]
+        name_offsets = array('q', [0])
+        for name in encoded:
+            name_offsets.append(name_offsets[-1] + len(name))
+        blob = b''.join(encoded)
+        with open(path, 'wb') as file:
+            file.write(_CH_HEADER.pack(CH_MAGIC, CH_FORMAT_VERSION, 0, len(self.names), len(blob)))
+            _write_array(file, name_offsets)
+            file.write(blob)
+            _write_array(file, array('q', self.rank))
+            for edges in (self.up, self.down):
+                file.write(struct.pack('<q', len(edges.targets)))
+                for section in (edges.offsets, edges.targets, edges.weights, edges.middles):
+                    _write_array(file, section)
+
+    @classmethod
+    def load(cls, path: str) -> ContractionHierarchy:
+        """Read a hierarchy written by save.
+            Args:
+                path: The hierarchy file.
+            Returns:
+                The loaded ContractionHierarchy.
+        """
+        with open(path, 'rb') as file:
+            magic, version, _, vertex_count, blob_size = _CH_HEADER.unpack(file.read(_CH_HEADER.size))
+            if magic != CH_MAGIC:
+                raise ValueError(f"{path} is not a contraction hierarchy file")
+            if version != CH_FORMAT_VERSION:
+                raise ValueError(f"unsupported contraction hierarchy version {version}")
+            name_offsets = _read_array(file, 'q', vertex_count + 1)
+            blob = file.read(blob_size)
+            names = [blob[name_offsets[i]:name_offsets[i + 1]].decode('utf-8') for i in range(vertex_count)]
+            rank = _read_array(file, 'q', vertex_count)
+            edge_sets = []
+            for _ in range(2):
+                (edge_count,) = struct.unpack('<q', file.read(8))
+                edge_sets.append(HierarchyEdges(
+                    offsets=_read_array(file, 'q', vertex_count + 1),
+                    targets=_read_array(file, 'q', edge_count),
+                    weights=_read_array(file, 'd', edge_count),
+                    middles=_read_array(file, 'q', edge_count),
+                ))
+        return cls(names, rank, edge_sets[0], edge_sets[1])
+
+
+def _write_array(file, values: array) -> None:
+    if sys.byteorder != 'little':
+        values = array(values.typecode, values)
+        values.byteswap()
+    values.tofile(file)
+
+def _read_array(file, typecode: str, count: int) -> array:
+    values = array(typecode)
+    values.fromfile(file, count)
+    if sys.byteorder != 'little':
+        values.byteswap()
+    return values
+
+
+def build_hierarchy(graph: IGraph, witness_settle_limit: int = 64) -> ContractionHierarchy:
+    """Contract every vertex of graph and build the query structures.
+        Args:
+            graph: The graph to preprocess.
+            witness_settle_limit: Maximum vertices a witness search may settle
+            before giving up and keeping the shortcut.
+        Returns:
+            The ContractionHierarchy for the graph.
+    """
+    build_start = time.time()
+    compact = get_query_context(graph).graph
+    vertex_count = compact.vertex_count()
+    # Remaining graph: out_edges[u][x] = in_edges[x][u] = (weight, middle)
+    out_edges: List[Dict[int, Tuple[float, int]]] = [{} for _ in range(vertex_count)]
+    in_edges: List[Dict[int, Tuple[float, int]]] = [{} for _ in range(vertex_count)]
+    for u in range(vertex_count):
+        for e in range(compact.offsets[u], compact.offsets[u + 1]):
+            x = compact.targets[e]
+            w = compact.weights[e]
+            if x != u and w < out_edges[u].get(x, (math.inf,))[0]:
+                out_edges[u][x] = in_edges[x][u] = (w, NO_MIDDLE)
+
+    contracted_neighbors = [0] * vertex_count
+    def priority(v: int) -> int:
+        shortcuts = _shortcuts_for(v, out_edges, in_edges, witness_settle_limit)
+        return len(shortcuts) - len(out_edges[v]) - len(in_edges[v]) + contracted_neighbors[v]
+
+    queue = [(priority(v), v) for v in range(vertex_count)]
+    heapq.heapify(queue)
+    rank = array('q', [0]) * vertex_count
+    up_lists: List[List[Tuple[int, float, int]]] = [[] for _ in range(vertex_count)]
+    down_lists: List[List[Tuple[int, float, int]]] = [[] for _ in range(vertex_count)]
+    order = 0
+    while queue:
+        _, v = heapq.heappop(queue)
+        # Lazy update: re-evaluate and put back if v is no longer the cheapest.
+        current = priority(v)
+        if queue and current > queue[0][0]:
+            heapq.heappush(queue, (current, v))
+            continue
+
+        rank[v] = order
+        order += 1
+        up_lists[v] = [(x, w, m) for x, (w, m) in out_edges[v].items()]
+        down_lists[v] = [(u, w, m) for u, (w, m) in in_edges[v].items()]
+        for u, x, weight in _shortcuts_for(v, out_edges, in_edges, witness_settle_limit):
+            if weight < out_edges[u].get(x, (math.inf,))[0]:
+                out_edges[u][x] = in_edges[x][u] = (weight, v)
+        for x in out_edges[v]:
+            del in_edges[x][v]
+            contracted_neighbors[x] += 1
+        for u in in_edges[v]:
+            del out_edges[u][v]
+            contracted_neighbors[u] += 1
+        out_edges[v] = {}
+        in_edges[v] = {}
+
+    return ContractionHierarchy(compact.names, rank, _to_csr(up_lists), _to_csr(down_lists),
+                                time.time() - build_start)
+
+
+def _shortcuts_for(v: int, out_edges: List[Dict[int, Tuple[float, int]]],
+                   in_edges: List[Dict[int, Tuple[float, int]]],
+                   settle_limit: int) -> List[Tuple[int, int, float]]:
+    """List the (source, target, weight) shortcuts contracting v would need."""
+    shortcuts = []
+    for u, (w_in, _) in in_edges[v].items():
+        via = {x: w_in + w_out for x, (w_out, _) in out_edges[v].items() if x != u}
+        if not via:
+            continue
+        witness = _witness_search(u, v, via, out_edges, settle_limit)
+        for x, weight in via.items():
+            if witness.get(x, math.inf) > weight:
+                shortcuts.append((u, x, weight))
+    return shortcuts
+
+
+def _witness_search(source: int, skipped: int, via: Dict[int, float],
+                    out_edges: List[Dict[int, Tuple[float, int]]], settle_limit: int) -> Dict[int, float]:
+    """Bounded Dijkstra from source that avoids skipped; returns the distances
+    it found. It stops once all via targets are settled, the search passes the
+    longest path through skipped, or settle_limit vertices are settled."""
+    max_distance = max(via.values())
+    remaining = len(via)
+    dist = {source: 0.0}
+    frontier = [(0.0, source)]
+    settled = 0
+    while frontier:
+        d, u = heapq.heappop(frontier)
+        if d > dist[u]:
+            continue
+        if d > max_distance or settled >= settle_limit:
+            break
+        settled += 1
+        if u in via:
+            remaining -= 1
+            if remaining == 0:
+                break
+        for x, (w, _) in out_edges[u].items():
+            if x == skipped:
+                continue
+            nd = d + w
+            if nd < dist.get(x, math.inf):
+                dist[x] = nd
+                heapq.heappush(frontier, (nd, x))
+    return dist
+
+
+def _to_csr(lists: Sequence[List[Tuple[int, float, int]]]) -> HierarchyEdges:
+    edges = HierarchyEdges(array('q', [0]), array('q'), array('d'), array('q'))
+    for entries in lists:
+        for target, weight, middle in entries:
+            edges.targets.append(target)
+            edges.weights.append(weight)
+            edges.middles.append(middle)
+        edges.offsets.append(len(edges.targets))
+    return edges
+
+
+class ContractionHierarchyAlgorithm(IAlgorithm):
+    """IAlgorithm that answers queries from a prebuilt ContractionHierarchy."""
+
+    def __init__(self, hierarchy: ContractionHierarchy) -> None:
+        """Constructor for the algorithm.
+            Args:
+                hierarchy: The hierarchy built (or loaded) for the graph that
+                will be queried. It is not rebuilt when that graph changes.
+            Returns:
+                None
+        """
+        self.hierarchy = hierarchy
+
+    @probe_queries
+    def find_path(self, graph: IGraph, start_vertex_name: str, destination_vertex_name: str) -> AlgorithmResult:
+        """
+        Answers the query with the upward bidirectional search of the
+        hierarchy and unpacks its shortcuts into the city-by-city route.
+
+        Args:
+            graph: The graph the hierarchy was built from.
+            start_vertex_name: The name of the starting vertex.
+            destination_vertex_name: The name of the destination vertex.
+        Returns:
+            AlgorithmResult containing path details and performance metrics.
+        """
+        start_time = time.time()
+        start = self.hierarchy.index.get(start_vertex_name)
+        goal = self.hierarchy.index.get(destination_vertex_name)
+        if start is None or goal is None:
+            return AlgorithmResult(
+                textual_directions="Start/destination vertex not found.",
+                total_distance=0.0,
+                vertices_explored=0,
+                edges_evaluated=0,
+                execution_time=time.time() - start_time,
+                path_found=False
+            )
+        distance, path, vertices_explored, edges_evaluated = self.hierarchy.query(start, goal)
+        if not path:
+            return AlgorithmResult(
+                textual_directions="No path found.",
+                total_distance=0.0,
+                vertices_explored=vertices_explored,
+                edges_evaluated=edges_evaluated,
+                execution_time=time.time() - start_time,
+                path_found=False
+            )
+        names = self.hierarchy.names
+        return AlgorithmResult(
+            textual_directions=" -> ".join(names[v] for v in path),
+            total_distance=distance,
+            vertices_explored=vertices_explored,
+            edges_evaluated=edges_evaluated,
+            execution_time=time.time() - start_time,
+            path_found=True
+        )
+
+    def get_name(self) -> str:
+        return "Contraction Hierarchies"
+
+
+def main() -> None:
+    if len(sys.argv) != 4:
+        print("usage: python contraction_hierarchies.py GRAPH_CSV VERTICES_CSV OUTPUT_FILE")
+        sys.exit(2)
+    graph = CompactGraph.from_files(sys.argv[1], sys.argv[2])
+    hierarchy = build_hierarchy(graph)
+    hierarchy.save(sys.argv[3])
+    print(f"Contracted {graph.vertex_count()} vertices in {hierarchy.build_time:.3f} seconds, "
+          f"added {hierarchy.shortcut_count()} shortcut edges.")
+
+if __name__ == "__main__":
+    main()
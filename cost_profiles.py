@@ -0,0 +1,148 @@
+from __future__ import annotations
+from array import array
+from dataclasses import dataclass, field
+from fnmatch import fnmatchcase
+from typing import FrozenSet, List, Mapping, Optional, Sequence
+from types import MappingProxyType
+import math
+import weakref
+
+from compact_graph import CompactGraph
+
+"""
+Routing cost profiles.
+
+A CostProfile says how much each road class costs relative to its length and
+which road classes may be used at all:
+
+    CostProfile("no US-20", deny={"US-20*"})
+    CostProfile("interstates only", allow={"I-*"})
+    CostProfile("scenic", multipliers={"US-101*": 0.8, "I-*": 1.5})
+
+Highway names are matched with shell-style patterns (fnmatch), so "US-20*"
+covers both US-20E and US-20W. An exact multiplier key wins over a pattern;
+otherwise the first matching pattern in insertion order applies. Edges whose
+highway is unknown can only be used when there is no allow set, and cost
+default_multiplier.
+
+compile(graph) turns a profile into one cost per edge slot of a CompactGraph:
+the edge's length times its multiplier, or infinity for a road the profile
+forbids. The search kernels take that array in place of graph.weights, so the
+profile is applied inside the relaxation loop without copying the graph, and
+a forbidden edge simply never improves a distance. The array is computed once
+per graph (in O(E), with one pattern match per distinct highway) and cached on
+the profile, so switching profiles between queries costs nothing. A profile
+that changes nothing hands back graph.weights itself.
+
+Multipliers below 1 would let a route cost less than its straight-line
+length, so CompiledProfile.heuristic_scale gives the factor A* must scale its
+haversine heuristic by to stay admissible.
+"""
+
+
+@dataclass(frozen=True, eq=False)
+class CostProfile:
+    """An immutable set of per-highway cost rules."""
+    name: str
+    multipliers: Mapping[str, float] = field(default_factory=dict)
+    allow: Optional[FrozenSet[str]] = None
+    deny: FrozenSet[str] = frozenset()
+    default_multiplier: float = 1.0
+    _compiled: weakref.WeakKeyDictionary = field(default_factory=weakref.WeakKeyDictionary, init=False,
+                                                 repr=False)
+
+    def __post_init__(self) -> None:
+        object.__setattr__(self, 'multipliers', MappingProxyType(dict(self.multipliers)))
+        object.__setattr__(self, 'deny', frozenset(self.deny))
+        if self.allow is not None:
+            object.__setattr__(self, 'allow', frozenset(self.allow))
+        for multiplier in (self.default_multiplier, *self.multipliers.values()):
+            if not multiplier >= 0:
+                raise ValueError("cost multipliers must be non-negative")
+
+    def __reduce__(self):
+        # The compiled-cost cache holds weak references and is not pickled.
+        return (CostProfile, (self.name, dict(self.multipliers), self.allow, self.deny, self.default_multiplier))
+
+    def multiplier(self, highway: Optional[str]) -> float:
+        """Get the cost multiplier of a highway under this profile.
+            Args:
+                highway: The highway name, or None if unknown.
+            Returns:
+                The multiplier, or math.inf if the highway may not be used.
+        """
+        if highway is None:
+            return self.default_multiplier if self.allow is None else math.inf
+        if any(fnmatchcase(highway, pattern) for pattern in self.deny):
+            return math.inf
+        if self.allow is not None and not any(fnmatchcase(highway, pattern) for pattern in self.allow):
+            return math.inf
+        exact = self.multipliers.get(highway)
+        if exact is not None:
+            return exact
+        for pattern, multiplier in self.multipliers.items():
+            if fnmatchcase(highway, pattern):
+                return multiplier
+        return self.default_multiplier
+
+    def compile(self, graph: CompactGraph) -> CompiledProfile:
+        """Get the per-edge costs of this profile on a graph, computing and
+        caching them on first use.
+            Args:
+                graph: The graph whose edge slots the costs are indexed by.
+            Returns:
+                The CompiledProfile for graph.
+        """
+        compiled = self._compiled.get(graph)
+        if compiled is None:
+            compiled = CompiledProfile.build(self, graph)
+            self._compiled[graph] = compiled
+        return compiled
+
+
+@dataclass
+class CompiledProfile:
+    profile: CostProfile
+    graph: CompactGraph
+    weights: Sequence[float]
+    heuristic_scale: float
+
+    @property
+    def is_identity(self) -> bool:
+        """True when the costs are the graph's own weights."""
+        return self.weights is self.graph.weights
+
+    @classmethod
+    def build(cls, profile: CostProfile, graph: CompactGraph) -> CompiledProfile:
+        table = [profile.multiplier(highway) for highway in graph.highways]
+        unknown = profile.multiplier(None)
+        edge_highways = graph.edge_highways
+        used = {edge_highways[slot] for slot in range(graph.edge_count())}
+        multipliers = [table[h] if h >= 0 else unknown for h in used]
+        allowed = [m for m in multipliers if m != math.inf]
+        heuristic_scale = min(1.0, min(allowed, default=1.0))
+        if all(m == 1.0 for m in multipliers):
+            return cls(profile, graph, graph.weights, heuristic_scale)
+
+        inf = math.inf
+        weights = array('d', [
+            inf if m == inf else w * m
+            for w, m in zip(graph.weights, (table[h] if h >= 0 else unknown for h in edge_highways))
+        ])
+        return cls(profile, graph, weights, heuristic_scale)
+
+    def path_length(self, path: List[int]) -> float:
+        """Get the length in miles of a path of vertex ids found under this
+        profile, following the cheapest edge between consecutive vertices."""
+        graph = self.graph
+        offsets, targets, weights, costs = graph.offsets, graph.targets, graph.weights, self.weights
+        total = 0.0
+        for u, v in zip(path, path[1:]):
+            slots = [slot for slot in range(offsets[u], offsets[u + 1]) if targets[slot] == v]
+            total += weights[min(slots, key=costs.__getitem__)]
+        return total
+
+
+SHORTEST = CostProfile("shortest")
+INTERSTATES_ONLY = CostProfile("interstates only", allow=frozenset({"I-*"}))
+PREFER_INTERSTATES = CostProfile("prefer interstates", multipliers={"I-*": 1.0}, default_multiplier=1.25)
@@ -0,0 +1,150 @@
+from __future__ import annotations
+from array import array
+from dataclasses import dataclass
+from typing import List, Optional, Sequence, Tuple
+import time
+
+from graph_interfaces import IGraph
+from compact_graph import CompactGraph
+from query_context import get_query_context
+import search_kernels
+
+"""
+Batch distance queries.
+
+distance_matrix() answers every origin x destination pair with one Dijkstra
+tree per origin instead of one find_path call per pair. Each tree stops
+growing as soon as all requested destinations are settled, and its distances
+are copied straight into a dense row-major matrix.
+
+The matrix is an array('d') of len(origins) * len(destinations) floats, so it
+exposes the buffer protocol and can be wrapped without copying, e.g.
+
+    numpy.frombuffer(result.distances, dtype=numpy.float64).reshape(result.shape)
+
+Unreachable pairs hold float('inf').
+"""
+
+@dataclass
+class DistanceMatrix:
+    origins: List[str]
+    destinations: List[str]
+    distances: array
+    predecessors: Optional[List[array]]
+    vertices_explored: int
+    edges_evaluated: int
+    execution_time: float
+    graph: CompactGraph
+
+    @property
+    def shape(self) -> Tuple[int, int]:
+        """Get the (rows, columns) shape of the matrix."""
+        return (len(self.origins), len(self.destinations))
+
+    def row(self, origin_index: int) -> memoryview:
+        """Get the distances from one origin as a zero-copy view.
+            Args:
+                origin_index: Position of the origin in self.origins.
+            Returns:
+                memoryview of len(self.destinations) floats.
+        """
+        width = len(self.destinations)
+        return memoryview(self.distances)[origin_index * width:(origin_index + 1) * width]
+
+    def distance(self, origin_index: int, destination_index: int) -> float:
+        """Get the shortest distance for one origin/destination pair.
+            Args:
+                origin_index: Position of the origin in self.origins.
+                destination_index: Position of the destination in self.destinations.
+            Returns:
+                The distance, or inf if the destination is unreachable.
+        """
+        return self.distances[origin_index * len(self.destinations) + destination_index]
+
+    def path(self, origin_index: int, destination_index: int) -> List[str]:
+        """Get the city-by-city route for one pair from the stored predecessor
+        trees. Requires the matrix to have been built with predecessors.
+            Args:
+                origin_index: Position of the origin in self.origins.
+                destination_index: Position of the destination in self.destinations.
+            Returns:
+                List of vertex names, origin first; empty if unreachable.
+        """
+        if self.predecessors is None:
+            raise ValueError("distance matrix was built without predecessor trees")
+        if self.distance(origin_index, destination_index) == search_kernels.INF:
+            return []
+        parent = self.predecessors[origin_index]
+        vertex = self.graph.index[self.destinations[destination_index]]
+        path = []
+        while vertex != -1:
+            path.append(self.graph.names[vertex])
+            vertex = parent[vertex]
+        path.reverse()
+        return path
+
+
+def distance_matrix(graph: IGraph, origins: Sequence[str], destinations: Optional[Sequence[str]] = None,
+                    with_predecessors: bool = False) -> DistanceMatrix:
+    """Compute shortest distances from every origin to every destination.
+        Args:
+            graph: The graph to search.
+            origins: Names of the origin vertices (matrix rows).
+            destinations: Names of the destination vertices (matrix columns);
+            defaults to every vertex in the graph.
+            with_predecessors: Also keep each origin's predecessor tree so
+            routes can be recovered with DistanceMatrix.path.
+        Returns:
+            DistanceMatrix with the dense distance buffer and search totals.
+    """
+    start_time = time.time()
+    context = get_query_context(graph)
+    compact = context.graph
+    if destinations is None:
+        destinations = compact.names
+    origin_ids = _vertex_ids(compact, origins)
+    destination_ids = _vertex_ids(compact, destinations)
+
+    is_target = bytearray(compact.vertex_count())
+    for vertex_id in destination_ids:
+        is_target[vertex_id] = 1
+    target_count = sum(is_target)
+
+    distances = array('d')
+    predecessors: Optional[List[array]] = [] if with_predecessors else None
+    vertices_explored = 0
+    edges_evaluated = 0
+    scratch = context.acquire_scratch()
+    try:
+        for origin in origin_ids:
+            outcome = search_kernels.dijkstra_to_targets(compact.offsets, compact.targets, compact.weights,
+                                                         origin, is_target, target_count, scratch)
+            vertices_explored += outcome.vertices_explored
+            edges_evaluated += outcome.edges_evaluated
+            dist = scratch.dist
+            distances.extend([dist[vertex_id] for vertex_id in destination_ids])
+            if predecessors is not None:
+                predecessors.append(array('q', scratch.parent))
+    finally:
+        context.release_scratch(scratch)
+
+    return DistanceMatrix(
+        origins=list(origins),
+        destinations=list(destinations),
+        distances=distances,
+        predecessors=predecessors,
+        vertices_explored=vertices_explored,
+        edges_evaluated=edges_evaluated,
+        execution_time=time.time() - start_time,
+        graph=compact
+    )
+
+
+def _vertex_ids(graph: CompactGraph, names: Sequence[str]) -> List[int]:
+    ids = []
+    for name in names:
+        vertex_id = graph.vertex_id(name)
+        if vertex_id is None:
+            raise ValueError(f"Vertex not found: {name}")
+        ids.append(vertex_id)
+    return ids
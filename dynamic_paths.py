@@ -0,0 +1,437 @@
+from __future__ import annotations
+from collections import OrderedDict
+from dataclasses import dataclass, field, replace
+from typing import Dict, List, Optional, Set, Tuple
+import heapq
+import math
+import threading
+import time
+
+from graph_interfaces import IAlgorithm, IEdge, IGraph, AlgorithmResult
+from graph_impl import Graph, GraphChange
+from algorithms import DijkstraAlgorithm
+from instrumentation import probe_queries
+
+"""
+Dynamic shortest paths for hot origins.
+
+Travel-time updates (Edge.set_weight) and road closures (Graph.remove_edge)
+bump the graph version, so every cached structure keyed by version starts
+over. DynamicShortestPaths instead keeps a complete shortest-path tree for
+each registered origin and repairs it in place when the graph changes. It
+listens to the graph (Graph.add_listener) and keeps its own adjacency mirror
+with both outgoing and incoming edges, keyed by the Edge objects themselves.
+
+Repairs follow Ramalingam & Reps' dynamic SWSF-FP algorithm:
+
+* Decrease (a weight drops or an edge u->v appears): if dist[u] + w beats
+  dist[v], v takes the new edge as its parent and the improvement spreads
+  with a Dijkstra that starts at v and stops as soon as nothing improves.
+* Increase (a weight rises or an edge u->v goes away): nothing changes unless
+  the edge is v's tree edge. Then only the subtree below v can get longer.
+  Every vertex in that subtree is re-seeded with its best incoming edge from
+  outside the subtree, and a Dijkstra restricted to the subtree settles the
+  new distances. Vertices left without a path drop out of the tree.
+
+Both repairs touch only the vertices whose distance actually changes (plus
+their edges), not the whole graph. Reading a distance is a dict lookup and
+reading a path walks parent pointers, so it is O(path length).
+
+Adding a vertex is free. Removing one drops its incoming edges first and then
+forgets it. Renaming a vertex changes the keys everything is stored under, so
+it rebuilds the trees from scratch. Coordinate changes do not affect
+distances and are ignored.
+
+When several shortest paths tie, a repaired tree may keep a different one
+than a fresh DijkstraAlgorithm run would report; distances always agree.
+"""
+
+
+@dataclass
+class _Tree:
+    origin: str
+    dist: Dict[str, float] = field(default_factory=dict)
+    parent: Dict[str, str] = field(default_factory=dict)
+    parent_edge: Dict[str, IEdge] = field(default_factory=dict)
+
+
+@dataclass
+class DynamicStats:
+    # vertices_repaired counts vertices whose distance a repair re-derived.
+    trees: int = 0
+    builds: int = 0
+    repairs: int = 0
+    vertices_repaired: int = 0
+    rebuilds: int = 0
+
+
+class DynamicShortestPaths:
+    """Class that keeps shortest-path trees from hot origins up to date."""
+
+    def __init__(self, graph: Graph, max_origins: int = 32) -> None:
+        """Constructor that mirrors the graph and starts listening to it.
+            Args:
+                graph: The mutable graph to follow.
+                max_origins: Maximum number of trees kept; registering one
+                more drops the least recently read tree.
+            Returns:
+                None
+        """
+        self.graph = graph
+        self.max_origins = max_origins
+        self._trees: OrderedDict[str, _Tree] = OrderedDict()
+        self._lock = threading.RLock()
+        self._stats = DynamicStats()
+        self._mirror()
+        graph.add_listener(self._on_change)
+
+    def close(self) -> None:
+        """Stop following the graph and drop every tree.
+            Args:
+                None
+            Returns:
+                None
+        """
+        with self._lock:
+            self.graph.remove_listener(self._on_change)
+            self._trees.clear()
+
+    def register(self, origin: str) -> None:
+        """Build and keep the shortest-path tree of an origin.
+            Args:
+                origin: Name of the origin vertex.
+            Returns:
+                None
+        """
+        with self._lock:
+            if origin not in self._out:
+                raise KeyError(origin)
+            if origin in self._trees:
+                self._trees.move_to_end(origin)
+                return
+            self._trees[origin] = self._build(origin)
+            while len(self._trees) > self.max_origins:
+                self._trees.popitem(last=False)
+
+    def unregister(self, origin: str) -> None:
+        """Stop maintaining an origin's tree.
+            Args:
+                origin: Name of the origin vertex.
+            Returns:
+                None
+        """
+        with self._lock:
+            self._trees.pop(origin, None)
+
+    def is_registered(self, origin: str) -> bool:
+        with self._lock:
+            return origin in self._trees
+
+    def distance(self, origin: str, destination: str) -> float:
+        """Get the shortest distance from a registered origin.
+            Args:
+                origin: Name of a registered origin.
+                destination: Name of the destination vertex.
+            Returns:
+                The distance, or math.inf if destination is unreachable.
+        """
+        with self._lock:
+            return self._tree(origin).dist.get(destination, math.inf)
+
+    def path(self, origin: str, destination: str) -> Optional[List[str]]:
+        """Get a shortest path from a registered origin by walking the tree.
+            Args:
+                origin: Name of a registered origin.
+                destination: Name of the destination vertex.
+            Returns:
+                The vertex names from origin to destination, or None if
+                destination is unreachable.
+        """
+        return self.route(origin, destination)[1]
+
+    def route(self, origin: str, destination: str) -> Tuple[float, Optional[List[str]]]:
+        """Get the distance and path from a registered origin in one read.
+            Args:
+                origin: Name of a registered origin.
+                destination: Name of the destination vertex.
+            Returns:
+                (distance, path) as returned by distance and path.
+        """
+        with self._lock:
+            tree = self._tree(origin)
+            distance = tree.dist.get(destination)
+            if distance is None:
+                return math.inf, None
+            path = [destination]
+            parent = tree.parent
+            while path[-1] != origin:
+                path.append(parent[path[-1]])
+            path.reverse()
+            return distance, path
+
+    def stats(self) -> DynamicStats:
+        """Get a snapshot of the build and repair counters.
+            Args:
+                None
+            Returns:
+                DynamicStats with the current number of trees.
+        """
+        with self._lock:
+            return replace(self._stats, trees=len(self._trees))
+
+    def _tree(self, origin: str) -> _Tree:
+        tree = self._trees.get(origin)
+        if tree is None:
+            raise KeyError(f"{origin} is not a registered origin")
+        self._trees.move_to_end(origin)
+        return tree
+
+    def _mirror(self) -> None:
+        """(Re)build the adjacency mirror from the graph."""
+        self._out: Dict[str, Dict[IEdge, Tuple[str, float]]] = {name: {} for name in self.graph.vertices}
+        self._in: Dict[str, Dict[IEdge, Tuple[str, float]]] = {name: {} for name in self.graph.vertices}
+        self._source: Dict[IEdge, str] = {}
+        for name, vertex in self.graph.vertices.items():
+            for edge in vertex.get_edges():
+                self._link(name, edge)
+
+    def _link(self, source: str, edge: IEdge) -> Optional[str]:
+        """Add an edge to the mirror; returns its destination, or None if
+        either end is not in the graph."""
+        destination = edge.get_destination().get_name()
+        if source not in self._out or destination not in self._in:
+            return None
+        weight = edge.get_weight()
+        self._out[source][edge] = (destination, weight)
+        self._in[destination][edge] = (source, weight)
+        self._source[edge] = source
+        return destination
+
+    def _unlink(self, edge: IEdge) -> Optional[Tuple[str, str]]:
+        source = self._source.pop(edge, None)
+        if source is None:
+            return None
+        destination, _ = self._out[source].pop(edge)
+        del self._in[destination][edge]
+        return source, destination
+
+    def _build(self, origin: str) -> _Tree:
+        tree = _Tree(origin)
+        tree.dist[origin] = 0.0
+        self._propagate(tree, [(0.0, 0, origin)])
+        self._stats.builds += 1
+        return tree
+
+    def _propagate(self, tree: _Tree, frontier: List[Tuple[float, int, str]],
+                   within: Optional[Set[str]] = None) -> int:
+        """Dijkstra from the seeded frontier, only ever lowering distances.
+        With within set, only vertices in that set are relaxed. Returns the
+        number of vertices settled."""
+        dist, parent, parent_edge, out = tree.dist, tree.parent, tree.parent_edge, self._out
+        inf = math.inf
+        sequence = len(frontier)
+        settled = 0
+        heapq.heapify(frontier)
+        while frontier:
+            d, _, u = heapq.heappop(frontier)
+            if d > dist.get(u, inf):
+                continue
+            settled += 1
+            for edge, (v, weight) in out[u].items():
+                if within is not None and v not in within:
+                    continue
+                nd = d + weight
+                if nd < dist.get(v, inf):
+                    dist[v] = nd
+                    parent[v] = u
+                    parent_edge[v] = edge
+                    heapq.heappush(frontier, (nd, sequence, v))
+                    sequence += 1
+        return settled
+
+    def _decrease(self, tree: _Tree, source: str, destination: str, edge: IEdge, weight: float) -> None:
+        if source not in tree.dist:
+            return
+        nd = tree.dist[source] + weight
+        if nd < tree.dist.get(destination, math.inf):
+            tree.dist[destination] = nd
+            tree.parent[destination] = source
+            tree.parent_edge[destination] = edge
+            self._stats.repairs += 1
+            self._stats.vertices_repaired += self._propagate(tree, [(nd, 0, destination)])
+
+    def _increase(self, tree: _Tree, root: str) -> None:
+        """Re-derive the distances of root's subtree after root's tree edge
+        got longer or disappeared."""
+        dist, parent, parent_edge = tree.dist, tree.parent, tree.parent_edge
+        subtree = {root}
+        stack = [root]
+        while stack:
+            u = stack.pop()
+            for edge, (v, _) in self._out[u].items():
+                if parent_edge.get(v) is edge and v not in subtree:
+                    subtree.add(v)
+                    stack.append(v)
+        for v in subtree:
+            del dist[v]
+            del parent[v]
+            del parent_edge[v]
+
+        frontier = []
+        inf = math.inf
+        for sequence, v in enumerate(subtree):
+            best, best_parent, best_edge = inf, None, None
+            for edge, (u, weight) in self._in[v].items():
+                candidate = dist.get(u, inf) + weight
+                if candidate < best:
+                    best, best_parent, best_edge = candidate, u, edge
+            if best < inf:
+                dist[v] = best
+                parent[v] = best_parent
+                parent_edge[v] = best_edge
+                frontier.append((best, sequence, v))
+        self._stats.repairs += 1
+        self._stats.vertices_repaired += len(subtree)
+        self._propagate(tree, frontier, subtree)
+
+    def _on_change(self, graph: Graph, change: GraphChange) -> None:
+        with self._lock:
+            kind = change.kind
+            if kind in ("add_edge", "remove_edge", "set_weight"):
+                self._edge_changed(change)
+            elif kind == "add_vertex":
+                name = change.vertex.get_name()
+                if name in self._out:
+                    self._rebuild()
+                else:
+                    self._out[name] = {}
+                    self._in[name] = {}
+            elif kind == "remove_vertex":
+                self._vertex_removed(change.vertex.get_name())
+            elif kind == "rename_vertex":
+                self._rebuild()
+
+    def _edge_changed(self, change: GraphChange) -> None:
+        edge = change.edge
+        if change.kind == "add_edge":
+            if change.vertex is None:
+                return
+            destination = self._link(change.vertex.get_name(), edge)
+            if destination is not None:
+                for tree in self._trees.values():
+                    self._decrease(tree, change.vertex.get_name(), destination, edge, edge.get_weight())
+            return
+
+        if change.kind == "remove_edge":
+            ends = self._unlink(edge)
+            if ends is not None:
+                for tree in self._trees.values():
+                    if tree.parent_edge.get(ends[1]) is edge:
+                        self._increase(tree, ends[1])
+            return
+
+        source = self._source.get(edge)
+        if source is None:
+            return
+        destination = self._link(source, edge)
+        weight = edge.get_weight()
+        for tree in self._trees.values():
+            if weight < change.old_weight:
+                self._decrease(tree, source, destination, edge, weight)
+            elif weight > change.old_weight and tree.parent_edge.get(destination) is edge:
+                self._increase(tree, destination)
+
+    def _vertex_removed(self, name: str) -> None:
+        if name not in self._in:
+            return
+        # Outgoing edges were already removed by Graph.remove_vertex; edges
+        # from other vertices still point here and are dropped now.
+        for edge in list(self._in[name]):
+            self._unlink(edge)
+            for tree in self._trees.values():
+                if tree.parent_edge.get(name) is edge:
+                    self._increase(tree, name)
+        for edge in list(self._out[name]):
+            self._unlink(edge)
+        del self._out[name]
+        del self._in[name]
+        self._trees.pop(name, None)
+
+    def _rebuild(self) -> None:
+        self._mirror()
+        for origin in list(self._trees):
+            if origin in self._out:
+                self._trees[origin] = self._build(origin)
+            else:
+                del self._trees[origin]
+        self._stats.rebuilds += 1
+
+
+class DynamicDijkstraAlgorithm(IAlgorithm):
+    """IAlgorithm that answers queries from DynamicShortestPaths trees."""
+
+    def __init__(self, paths: DynamicShortestPaths, register_after: Optional[int] = None) -> None:
+        """Constructor for the algorithm.
+            Args:
+                paths: The dynamic trees to read from.
+                register_after: Register an origin automatically once it has
+                been queried this many times (None: only explicit registers).
+            Returns:
+                None
+        """
+        self.paths = paths
+        self.register_after = register_after
+        self._fallback = DijkstraAlgorithm()
+        self._query_counts: Dict[str, int] = {}
+
+    @probe_queries
+    def find_path(self, graph: IGraph, start_vertex_name: str, destination_vertex_name: str) -> AlgorithmResult:
+        """
+        Reads the path off the start's tree when the start is a registered
+        origin of graph, otherwise runs DijkstraAlgorithm. Tree reads report
+        the path's vertices as explored and its edges as evaluated, which is
+        the work the read does.
+
+        Args:
+            graph: The graph to search.
+            start_vertex_name: The name of the starting vertex.
+            destination_vertex_name: The name of the destination vertex.
+        Returns:
+            AlgorithmResult containing path details and performance metrics.
+        """
+        start_time = time.time()
+        paths = self.paths
+        if graph is paths.graph and self.register_after is not None and not paths.is_registered(start_vertex_name):
+            count = self._query_counts.get(start_vertex_name, 0) + 1
+            self._query_counts[start_vertex_name] = count
+            if count >= self.register_after and start_vertex_name in graph.vertices:
+                paths.register(start_vertex_name)
+        if graph is not paths.graph or not paths.is_registered(start_vertex_name) \
+                or destination_vertex_name not in graph.vertices:
+            return self._fallback.find_path(graph, start_vertex_name, destination_vertex_name)
+
+        try:
+            distance, path = paths.route(start_vertex_name, destination_vertex_name)
+        except KeyError:
+            # The origin was dropped between the check and the read.
+            return self._fallback.find_path(graph, start_vertex_name, destination_vertex_name)
+        if path is None:
+            return AlgorithmResult(
+                textual_directions="No path found.",
+                total_distance=0.0,
+                vertices_explored=0,
+                edges_evaluated=0,
+                execution_time=time.time() - start_time,
+                path_found=False
+            )
+        return AlgorithmResult(
+            textual_directions=" -> ".join(path),
+            total_distance=distance,
+            vertices_explored=len(path),
+            edges_evaluated=len(path) - 1,
+            execution_time=time.time() - start_time,
+            path_found=True
+        )
+
+    def get_name(self) -> str:
+        return "Dynamic Dijkstra (incremental shortest-path trees)"
@@ -0,0 +1,267 @@
+from __future__ import annotations
+from array import array
+from typing import Callable, Dict, List, Tuple
+import argparse
+import math
+import random
+import time
+
+from compact_graph import CompactGraph
+from graph_impl import haversine_distance
+
+"""
+Synthetic road-like graphs for benchmarking.
+
+Every generator returns a CompactGraph with coordinates and highway names, and
+is deterministic for a given size and seed. All edges come in both directions
+(like the Oregon graph) and every edge is at least as long as the great-circle
+distance between its ends, so the haversine heuristic stays admissible:
+
+* grid_graph: a rows x cols street lattice about spacing miles apart with a
+  fraction of the streets missing. Every eighth row and column is a fast
+  highway ("I-n" and "US-n"); the other streets are slower, twistier roads.
+* random_geometric_graph: points scattered uniformly over a square, each joined
+  to every other point within the radius that gives the requested mean
+  degree. Above a mean degree of about 4.5 nearly all vertices form one
+  component.
+* scale_free_graph: Barabasi-Albert preferential attachment (each new vertex
+  links to `links` existing ones, chosen in proportion to their degree) over
+  random coordinates, so a few hubs carry most of the edges.
+
+Points are laid out on a plane at a fixed density (about one vertex per
+spacing^2 square miles) and mapped to latitude/longitude around (40, -120), so
+a million-vertex graph spans roughly 1000 x 1000 miles. Edge lengths are the
+haversine distance times a detour factor, rounded up to 1/10000 mile.
+
+write_graph_files saves any CompactGraph in the graph_v2.txt/vertices_v1.txt
+formats, streaming rows so millions of edges never sit in memory as strings:
+
+    python graph_generators.py grid 1000000 grid_1m_graph.txt grid_1m_vertices.txt
+"""
+
+ORIGIN_LATITUDE = 40.0
+ORIGIN_LONGITUDE = -120.0
+MILES_PER_DEGREE = 69.0
+
+
+class _Builder:
+    """Collects undirected edges and turns them into CSR arrays."""
+
+    def __init__(self, latitudes: array, longitudes: array, rng: random.Random) -> None:
+        self.latitudes = latitudes
+        self.longitudes = longitudes
+        self.rng = rng
+        self.sources = array('q')
+        self.targets = array('q')
+        self.weights = array('d')
+        self.edge_highways = array('i')
+        self.highways: List[str] = []
+        self._highway_ids: Dict[str, int] = {}
+
+    def connect(self, u: int, v: int, highway: str, detour: Tuple[float, float]) -> None:
+        """Add the road u<->v with a random detour factor in detour."""
+        highway_id = self._highway_ids.get(highway)
+        if highway_id is None:
+            highway_id = self._highway_ids[highway] = len(self.highways)
+            self.highways.append(highway)
+        lat, lon = self.latitudes, self.longitudes
+        distance = haversine_distance(lat[u], lon[u], lat[v], lon[v]) * self.rng.uniform(*detour)
+        weight = math.ceil(distance * 10000) / 10000
+        self.sources.extend((u, v))
+        self.targets.extend((v, u))
+        self.weights.extend((weight, weight))
+        self.edge_highways.extend((highway_id, highway_id))
+
+    def build(self) -> CompactGraph:
+        """Counting-sort the edges by source into a CompactGraph."""
+        vertex_count = len(self.latitudes)
+        offsets = array('q', [0]) * (vertex_count + 1)
+        for u in self.sources:
+            offsets[u + 1] += 1
+        for u in range(vertex_count):
+            offsets[u + 1] += offsets[u]
+        cursor = array('q', offsets)
+        edge_count = len(self.sources)
+        targets = array('q', [0]) * edge_count
+        weights = array('d', [0.0]) * edge_count
+        edge_highways = array('i', [0]) * edge_count
+        for row, u in enumerate(self.sources):
+            slot = cursor[u]
+            cursor[u] = slot + 1
+            targets[slot] = self.targets[row]
+            weights[slot] = self.weights[row]
+            edge_highways[slot] = self.edge_highways[row]
+        names = [f"V{i}" for i in range(vertex_count)]
+        return CompactGraph(names, offsets, targets, weights, self.latitudes, self.longitudes,
+                            self.highways, edge_highways)
+
+
+def _place(xs: List[float], ys: List[float]) -> Tuple[array, array]:
+    """Map plane coordinates in miles to latitude/longitude around the origin."""
+    lon_scale = MILES_PER_DEGREE * math.cos(math.radians(ORIGIN_LATITUDE))
+    latitudes = array('d', (ORIGIN_LATITUDE + y / MILES_PER_DEGREE for y in ys))
+    longitudes = array('d', (ORIGIN_LONGITUDE + x / lon_scale for x in xs))
+    return latitudes, longitudes
+
+
+def grid_graph(rows: int, cols: int, seed: int = 0, spacing: float = 1.0, missing: float = 0.1) -> CompactGraph:
+    """Build a street lattice with a highway every eighth row and column.
+        Args:
+            rows: Number of rows of intersections.
+            cols: Number of columns of intersections.
+            seed: Random seed.
+            spacing: Miles between neighbouring intersections.
+            missing: Fraction of local streets left out (highways are complete).
+        Returns:
+            The generated graph, vertex id r * cols + c for row r, column c.
+    """
+    rng = random.Random(seed)
+    xs = [c * spacing + rng.uniform(-0.2, 0.2) * spacing for _ in range(rows) for c in range(cols)]
+    ys = [r * spacing + rng.uniform(-0.2, 0.2) * spacing for r in range(rows) for _ in range(cols)]
+    builder = _Builder(*_place(xs, ys), rng)
+    for r in range(rows):
+        for c in range(cols):
+            u = r * cols + c
+            if c + 1 < cols:
+                if r % 8 == 0:
+                    builder.connect(u, u + 1, f"I-{r // 8}", (1.01, 1.05))
+                elif rng.random() >= missing:
+                    builder.connect(u, u + 1, f"R-{r}", (1.05, 1.4))
+            if r + 1 < rows:
+                if c % 8 == 0:
+                    builder.connect(u, u + cols, f"US-{c // 8}", (1.01, 1.05))
+                elif rng.random() >= missing:
+                    builder.connect(u, u + cols, f"C-{c}", (1.05, 1.4))
+    return builder.build()
+
+
+def random_geometric_graph(vertex_count: int, seed: int = 0, mean_degree: float = 8.0,
+                           spacing: float = 1.0) -> CompactGraph:
+    """Build a random geometric graph over uniformly scattered points.
+        Args:
+            vertex_count: Number of vertices.
+            seed: Random seed.
+            mean_degree: Expected number of neighbours per vertex.
+            spacing: Points are scattered at one per spacing^2 square miles.
+        Returns:
+            The generated graph.
+    """
+    rng = random.Random(seed)
+    side = spacing * math.sqrt(vertex_count)
+    xs = [rng.uniform(0, side) for _ in range(vertex_count)]
+    ys = [rng.uniform(0, side) for _ in range(vertex_count)]
+    radius = spacing * math.sqrt(mean_degree / math.pi)
+    # Hash points into radius-sized cells; neighbours are in the 3x3 block.
+    cells: Dict[Tuple[int, int], List[int]] = {}
+    for v in range(vertex_count):
+        cells.setdefault((int(xs[v] // radius), int(ys[v] // radius)), []).append(v)
+    builder = _Builder(*_place(xs, ys), rng)
+    radius_squared = radius * radius
+    for (cx, cy), members in cells.items():
+        nearby = [w for dx in (-1, 0, 1) for dy in (-1, 0, 1) for w in cells.get((cx + dx, cy + dy), ())]
+        for u in members:
+            x, y = xs[u], ys[u]
+            for v in nearby:
+                if v > u and (xs[v] - x) ** 2 + (ys[v] - y) ** 2 <= radius_squared:
+                    builder.connect(u, v, "RG", (1.02, 1.3))
+    return builder.build()
+
+
+def scale_free_graph(vertex_count: int, seed: int = 0, links: int = 2, spacing: float = 1.0) -> CompactGraph:
+    """Build a Barabasi-Albert preferential-attachment graph.
+        Args:
+            vertex_count: Number of vertices.
+            seed: Random seed.
+            links: Edges from each new vertex to existing vertices.
+            spacing: Points are scattered at one per spacing^2 square miles.
+        Returns:
+            The generated graph.
+    """
+    rng = random.Random(seed)
+    side = spacing * math.sqrt(vertex_count)
+    xs = [rng.uniform(0, side) for _ in range(vertex_count)]
+    ys = [rng.uniform(0, side) for _ in range(vertex_count)]
+    builder = _Builder(*_place(xs, ys), rng)
+    # Every edge end is appended here, so a uniform pick from it chooses a
+    # vertex with probability proportional to its degree.
+    ends = array('q')
+    seed_count = min(links + 1, vertex_count)
+    for u in range(seed_count):
+        for v in range(u + 1, seed_count):
+            builder.connect(u, v, "SF", (1.02, 1.3))
+            ends.extend((u, v))
+    for u in range(seed_count, vertex_count):
+        chosen = set()
+        while len(chosen) < min(links, u):
+            chosen.add(ends[rng.randrange(len(ends))] if ends else rng.randrange(u))
+        for v in chosen:
+            builder.connect(u, v, "SF", (1.02, 1.3))
+            ends.extend((u, v))
+    return builder.build()
+
+
+def _grid_of(vertex_count: int, seed: int) -> CompactGraph:
+    side = max(1, math.isqrt(vertex_count))
+    return grid_graph(side, max(1, vertex_count // side), seed)
+
+
+# Generators by name, each taking (vertex_count, seed).
+GENERATORS: Dict[str, Callable[[int, int], CompactGraph]] = {
+    "grid": _grid_of,
+    "geometric": random_geometric_graph,
+    "scale-free": scale_free_graph,
+}
+
+
+def write_graph_files(graph: CompactGraph, graph_file_path: str, vertices_file_path: str,
+                      batch: int = 65536) -> None:
+    """Save a graph in the graph_v2.txt and vertices_v1.txt CSV formats.
+        Args:
+            graph: The graph to save.
+            graph_file_path: Path of the edge file to write.
+            vertices_file_path: Path of the vertex coordinate file to write.
+            batch: Rows formatted per write.
+        Returns:
+            None
+    """
+    names, highways = graph.names, graph.highways
+    with open(vertices_file_path, 'w', newline='') as vfile:
+        vfile.write("vertex,latitude,longitude\n")
+        for first in range(0, len(names), batch):
+            vfile.write(''.join(
+                f"{names[v]},{graph.latitudes[v]!r},{graph.longitudes[v]!r}\n"
+                for v in range(first, min(first + batch, len(names)))
+                if not math.isnan(graph.latitudes[v])))
+    offsets, targets, weights, edge_highways = graph.offsets, graph.targets, graph.weights, graph.edge_highways
+    with open(graph_file_path, 'w', newline='') as gfile:
+        gfile.write("source,destination,highway,distance\n")
+        rows: List[str] = []
+        for u in range(len(names)):
+            source = names[u]
+            for slot in range(offsets[u], offsets[u + 1]):
+                highway = highways[edge_highways[slot]] if edge_highways[slot] >= 0 else ""
+                rows.append(f"{source},{names[targets[slot]]},{highway},{weights[slot]!r}\n")
+            if len(rows) >= batch:
+                gfile.write(''.join(rows))
+                rows.clear()
+        gfile.write(''.join(rows))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Write a synthetic road-like graph.")
+    parser.add_argument("generator", choices=sorted(GENERATORS))
+    parser.add_argument("vertices", type=int, help="approximate number of vertices")
+    parser.add_argument("graph_file")
+    parser.add_argument("vertices_file")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    graph = GENERATORS[args.generator](args.vertices, args.seed)
+    built = time.perf_counter()
+    write_graph_files(graph, args.graph_file, args.vertices_file)
+    print(f"{args.generator}: {graph.vertex_count()} vertices, {graph.edge_count()} edges "
+          f"(generated in {built - start:.1f}s, written in {time.perf_counter() - built:.1f}s)")
+
+if __name__ == "__main__":
+    main()
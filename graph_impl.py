@@ -1,10 +1,27 @@
 from graph_interfaces import IEdge, IGraph, IVertex
-from typing import List, Tuple, TypeVar, Optional
+from typing import Callable, Dict, List, NamedTuple, Tuple, TypeVar, Optional
 import math
+import sys
+import threading
 
 # Implementation definitions
 # You should implement the bodies of the methods required by the interface protocols.
 
+class GraphChange(NamedTuple):
+    """A change reported to graph listeners.
+
+    kind is one of "add_vertex", "remove_vertex", "add_edge", "remove_edge",
+    "set_weight", "set_coordinates", "rename_vertex" or "rename_edge". vertex
+    is the vertex concerned, or the source vertex for "add_edge" and
+    "remove_edge" (None if the graph does not know it). old_weight is set for
+    "set_weight" only.
+    """
+    kind: str
+    vertex: Optional[IVertex] = None
+    edge: Optional[IEdge] = None
+    old_weight: Optional[float] = None
+
+
 class Graph(IGraph):
     """Class for Graph implementation using adjacency list representation."""
 
@@ -17,6 +34,45 @@ class Graph(IGraph):
         """
         self.vertices: dict[str, IVertex] = {}
         self.edges: dict[str, IEdge] = {}
+        self._version: int = 0
+        self._listeners: List[Callable[['Graph', GraphChange], None]] = []
+
+    def get_version(self) -> int:
+        """Get the graph version, a counter that increases on every change
+        to the graph's vertices, edges, weights or coordinates.
+            Args:
+                None
+            Returns:
+                The current version number.
+        """
+        return self._version
+
+    def add_listener(self, listener: Callable[['Graph', GraphChange], None]) -> None:
+        """Register a function called with (graph, change) after every change.
+            Args:
+                listener: The function to call.
+            Returns:
+                None
+        """
+        self._listeners.append(listener)
+
+    def remove_listener(self, listener: Callable[['Graph', GraphChange], None]) -> None:
+        """Unregister a listener added with add_listener.
+            Args:
+                listener: The function to remove.
+            Returns:
+                None
+        """
+        if listener in self._listeners:
+            self._listeners.remove(listener)
+
+    def _touch(self, change: Optional[GraphChange] = None) -> None:
+        """Record that the graph changed, invalidating anything cached for
+        the previous version, and tell the listeners what changed."""
+        self._version += 1
+        if change is not None and self._listeners:
+            for listener in list(self._listeners):
+                listener(self, change)
 
     def get_vertices(self) -> List[IVertex]:
         """Get all vertices in the graph.
@@ -44,6 +100,9 @@ class Graph(IGraph):
                 None
         """
         self.vertices[vertex.get_name()] = vertex
+        if isinstance(vertex, Vertex):
+            vertex._graph = self
+        self._touch(GraphChange("add_vertex", vertex))
 
     def remove_vertex(self, vertex_name: str) -> None:
         """Remove a vertex from the graph.
@@ -56,7 +115,14 @@ class Graph(IGraph):
             vertex = self.vertices[vertex_name]
             for edge in list(vertex.get_edges()):
                 self.remove_edge(edge.get_name())
+            if isinstance(vertex, Vertex) and vertex._incoming:
+                for edge in list(vertex._incoming):
+                    if self.edges.get(edge.get_name()) is edge:
+                        self.remove_edge(edge.get_name())
             del self.vertices[vertex_name]
+            if isinstance(vertex, Vertex) and vertex._graph is self:
+                vertex._graph = None
+            self._touch(GraphChange("remove_vertex", vertex))
 
     def add_edge(self, edge: IEdge) -> None:
         """Add an edge to the graph.
@@ -65,10 +131,20 @@ class Graph(IGraph):
             Returns:
                 None
         """
-        self.edges[edge.get_name()] = edge
-        start_vertex = self.vertices.get(edge.get_name().split('->')[0])
+        name = edge.get_name()
+        previous = self.edges.get(name)
+        self.edges[name] = edge
+        start_vertex = self._source_of(edge)
         if start_vertex:
             start_vertex.add_edge(edge)
+        if isinstance(edge, Edge):
+            edge._graph = self
+        if previous is not None and previous is not edge:
+            # The new edge replaces the one with the same name.
+            if isinstance(previous, Edge) and previous._graph is self:
+                previous._graph = None
+            self._touch(GraphChange("remove_edge", start_vertex, previous))
+        self._touch(GraphChange("add_edge", start_vertex, edge))
 
     def remove_edge(self, edge_name: str) -> None:
         """Remove an edge from the graph.
@@ -79,43 +155,106 @@ class Graph(IGraph):
         """
         if edge_name in self.edges:
             edge = self.edges[edge_name]
-            start_vertex_name = edge.get_name().split('->')[0]
-            start_vertex = self.vertices.get(start_vertex_name)
+            start_vertex = self._source_of(edge)
             if start_vertex:
                 start_vertex.remove_edge(edge_name)
             del self.edges[edge_name]
+            if isinstance(edge, Edge) and edge._graph is self:
+                edge._graph = None
+            self._touch(GraphChange("remove_edge", start_vertex, edge))
+
+    def _source_of(self, edge: IEdge) -> Optional[IVertex]:
+        """Find the vertex of this graph an edge leaves from: its source
+        reference when it has one, otherwise the vertex whose name followed
+        by "->" starts the edge name (the naming read_graph used before edges
+        knew their source)."""
+        get_source = getattr(edge, 'get_source', None)
+        source = get_source() if get_source else None
+        if source is not None:
+            return self.vertices.get(source.get_name())
+        name = edge.get_name()
+        position = name.find('->')
+        while position != -1:
+            vertex = self.vertices.get(name[:position])
+            if vertex is not None:
+                return vertex
+            position = name.find('->', position + 1)
+        return None
 
 V = TypeVar('V')
 
+EARTH_RADIUS_MILES = 3959
+
 def haversine_distance(lat1, lon1, lat2, lon2) -> float:
     """Calculate the great-circle distance between two points on the Earth."""
-    radius = 3959  # Earth's radius in miles
-    lat1, lon1, lat2, lon2 = map(math.radians, [lat1, lon1, lat2, lon2])
+    radius = EARTH_RADIUS_MILES
+    lat1, lon1, lat2, lon2 = math.radians(lat1), math.radians(lon1), math.radians(lat2), math.radians(lon2)
     delta_lat = lat2 - lat1
     delta_lon = lon2 - lon1
     a = math.sin(delta_lat / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin(delta_lon / 2) ** 2
     c = 2 * math.asin(math.sqrt(a))
     return radius * c
 
-class Vertex(IVertex):
+# Highway names are shared by many edges, so edges store a small id into this
+# process-wide table instead of a string each.
+_highway_names: List[str] = []
+_highway_ids: Dict[str, int] = {}
+_highway_lock = threading.Lock()
+
+def highway_id(highway: Optional[str]) -> int:
+    """Get the id of a highway name, registering it on first use.
+        Args:
+            highway: The highway name, or None.
+        Returns:
+            The highway's id, or -1 for None.
+    """
+    if highway is None:
+        return -1
+    found = _highway_ids.get(highway)
+    if found is None:
+        with _highway_lock:
+            found = _highway_ids.get(highway)
+            if found is None:
+                found = _highway_ids[highway] = len(_highway_names)
+                _highway_names.append(_intern(highway))
+    return found
+
+def highway_name(highway_id: int) -> Optional[str]:
+    """Get the highway name registered under an id (None for -1)."""
+    return _highway_names[highway_id] if highway_id >= 0 else None
+
+def _intern(name):
+    # sys.intern only takes exact str instances.
+    return sys.intern(name) if type(name) is str else name
+
+# Vertex and Edge implement IVertex and IEdge structurally instead of
+# subclassing them: the protocols declare no __slots__, so subclasses would
+# give every instance a __dict__ again.
+
+class Vertex:
     """Class for Vertex implementation for the larger Graph Implementation with coordinates."""
 
+    __slots__ = ('_name', '_edges', '_incoming', '_visited', '_data', '_latitude', '_longitude', '_graph')
+
     def __init__(self, name: str, latitude: float = None, longitude: float = None) -> None:
         """
         Constructor for the vertex.
             Args:
-                name: The name of the vertex.
+                name: The name of the vertex (interned).
                 latitude: Latitude of the vertex.
                 longitude: Longitude of the vertex.
             Returns:
                 None
         """
-        self._name = name
+        self._name = _intern(name)
         self._edges: dict[str, IEdge] = {}
+        # Edges pointing at this vertex; None until the first one arrives.
+        self._incoming: Optional[List[IEdge]] = None
         self._visited: bool = False
         self._data: Optional[V] = None
         self._latitude = latitude
         self._longitude = longitude
+        self._graph: Optional[Graph] = None
 
     def get_name(self) -> str:
         """Get the name of the vertex.
@@ -133,16 +272,33 @@ class Vertex(IVertex):
             Returns:
                 None
         """
-        self._name = name
+        self._name = _intern(name)
+        if self._graph is not None:
+            self._graph._touch(GraphChange("rename_vertex", self))
 
     def add_edge(self, edge: IEdge) -> None:
-        """Add an edge to the vertex.
+        """Add an edge to the vertex. An Edge without a source gets this
+        vertex as its source.
             Args:
                 edge: The edge to add.
             Returns:
                 None
         """
-        self._edges[edge.get_name()] = edge
+        if isinstance(edge, Edge) and edge._source is None:
+            edge._source = self
+        name = edge.get_name()
+        previous = self._edges.get(name)
+        if previous is edge:
+            return
+        if previous is not None:
+            _unlink_incoming(previous)
+        self._edges[name] = edge
+        destination = edge.get_destination()
+        if isinstance(destination, Vertex):
+            if destination._incoming is None:
+                destination._incoming = [edge]
+            else:
+                destination._incoming.append(edge)
 
     def remove_edge(self, edge_name: str) -> None:
         """Remove an edge from the vertex.
@@ -151,8 +307,9 @@ class Vertex(IVertex):
             Returns:
                 None
         """
-        if edge_name in self._edges:
-            del self._edges[edge_name]
+        edge = self._edges.pop(edge_name, None)
+        if edge is not None:
+            _unlink_incoming(edge)
 
     def get_edges(self) -> List[IEdge]:
         """Get all edges connected to the vertex.
@@ -163,6 +320,15 @@ class Vertex(IVertex):
         """
         return list(self._edges.values())
 
+    def get_incoming_edges(self) -> List[IEdge]:
+        """Get the edges that point at the vertex.
+            Args:
+                None
+            Returns:
+                List of edges whose destination is this vertex.
+        """
+        return list(self._incoming) if self._incoming else []
+
     def set_visited(self, visited: bool) -> None:
         """Set the visited status of the vertex.
             Args:
@@ -191,6 +357,8 @@ class Vertex(IVertex):
         """
         self._latitude = latitude
         self._longitude = longitude
+        if self._graph is not None:
+            self._graph._touch(GraphChange("set_coordinates", self))
 
     def get_coordinates(self) -> Optional[tuple[float, float]]:
         """Get the coordinates of the vertex.
@@ -215,29 +383,49 @@ class Vertex(IVertex):
             The Haversine distance to the other vertex if both vertices
             have coordinates, otherwise None.
         """
-        if self.get_coordinates() and other.get_coordinates():
-            lat1, lon1 = self.get_coordinates()
-            lat2, lon2 = other.get_coordinates()
-            return haversine_distance(lat1, lon1, lat2, lon2)
+        mine = self.get_coordinates()
+        theirs = other.get_coordinates()
+        if mine and theirs:
+            return haversine_distance(mine[0], mine[1], theirs[0], theirs[1])
         return None
     
 
-class Edge(IEdge):
+class Edge:
 
     """Class for Edge implementation for the larger Graph Implementation."""
 
-    def __init__(self, name: str, destination: IVertex, weight: float = 1.0) -> None:
+    __slots__ = ('_name', '_source', '_destination', '_weight', '_highway_id', '_graph')
+
+    def __init__(self, name: Optional[str], destination: IVertex, weight: float = 1.0,
+                 highway: Optional[str] = None, source: Optional[IVertex] = None) -> None:
         """Constructor for the edge.
             Args:
-                name: The name of the edge.
+                name: The name of the edge, or None for "source->destination",
+                which is then built from the vertex names on first use.
                 destination: The destination vertex of the edge.
                 weight: The weight of the edge (default is 1.0).
+                highway: The highway the edge follows, e.g. "I-5S" (optional).
+                source: The vertex the edge leaves from (optional; set when
+                the edge is added to a vertex).
             Returns:
                 None
         """
+        if name is None and source is None:
+            raise ValueError("an edge without a name needs a source")
         self._name = name
+        self._source = source
         self._destination = destination
         self._weight = weight
+        self._highway_id = highway_id(highway)
+        self._graph: Optional[Graph] = None
+
+    def __getstate__(self):
+        # Highway ids are per process, so pickles carry the name.
+        return (self._name, self._source, self._destination, self._weight, self.get_highway(), self._graph)
+
+    def __setstate__(self, state) -> None:
+        self._name, self._source, self._destination, self._weight, highway, self._graph = state
+        self._highway_id = highway_id(highway)
 
     def get_name(self) -> str:
         """Get the name of the edge.
@@ -246,7 +434,10 @@ class Edge(IEdge):
             Returns:
                 The name of the edge.
         """
-        return self._name
+        name = self._name
+        if name is None:
+            name = self._name = f"{self._source.get_name()}->{self._destination.get_name()}"
+        return name
 
     def set_name(self, name: str) -> None:
         """Set the name of the edge.
@@ -256,6 +447,18 @@ class Edge(IEdge):
                 None
         """
         self._name = name
+        if self._graph is not None:
+            self._graph._touch(GraphChange("rename_edge", edge=self))
+
+    def get_source(self) -> Optional[IVertex]:
+        """Get the vertex the edge leaves from.
+            Args:
+                None
+            Returns:
+                The source vertex, or None if the edge has not been added to
+                one yet.
+        """
+        return self._source
 
     def get_destination(self) -> IVertex:
         """Get the destination vertex of the edge.
@@ -266,6 +469,24 @@ class Edge(IEdge):
         """
         return self._destination
 
+    def get_highway(self) -> Optional[str]:
+        """Get the highway the edge follows.
+            Args:
+                None
+            Returns:
+                The highway name, or None if it is not known.
+        """
+        return highway_name(self._highway_id)
+
+    def get_highway_id(self) -> int:
+        """Get the id of the highway the edge follows (see highway_id).
+            Args:
+                None
+            Returns:
+                The highway id, or -1 if it is not known.
+        """
+        return self._highway_id
+
     def get_weight(self) -> float:
         """Get the weight of the edge.
             Args:
@@ -282,4 +503,20 @@ class Edge(IEdge):
             Returns:
                 None
         """
-        self._weight = weight
\ No newline at end of file
+        old_weight = self._weight
+        self._weight = weight
+        if self._graph is not None:
+            self._graph._touch(GraphChange("set_weight", edge=self, old_weight=old_weight))
+
+
+def _unlink_incoming(edge: IEdge) -> None:
+    """Drop an edge from its destination's incoming edges."""
+    destination = edge.get_destination()
+    if isinstance(destination, Vertex) and destination._incoming:
+        incoming = destination._incoming
+        for position, candidate in enumerate(incoming):
+            if candidate is edge:
+                del incoming[position]
+                break
+        if not incoming:
+            destination._incoming = None
@@ -0,0 +1,336 @@
+from __future__ import annotations
+from array import array
+from dataclasses import dataclass
+from typing import Callable, Dict, Generator, Iterator, List, Optional, Tuple
+import argparse
+import csv
+import queue
+import threading
+import time
+
+from compact_graph import CompactGraph
+from snapshot import save_snapshot
+
+"""
+Bulk CSV ingestion.
+
+program.read_graph turns every row of the edge file into a dict, a Vertex
+lookup, an Edge object and an "a->b" name that add_edge splits again. That is
+fine for the Oregon files but dominates start-up on large networks. This module
+builds a CompactGraph from the same CSV files in two phases:
+
+1. Parse. The file is read in large blocks (chunk_bytes characters) cut at the
+   last newline, and each block goes through csv.reader in one call. City and
+   highway names are interned to small integer ids as they are first seen, so
+   every row leaves behind four numbers in column arrays instead of objects.
+2. Build. One counting sort groups the edge columns by source into CSR order
+   and a single pass drops repeated source/destination pairs (the last row
+   wins, exactly like Graph.add_edge overwriting an edge of the same name).
+
+With threaded=True the parse phase runs on a background thread that hands
+finished blocks over a small bounded queue while the caller appends them to
+the column arrays, so reading the file overlaps with assembling the graph.
+
+Vertex ids follow the first-seen order read_graph uses, so the result equals
+CompactGraph.from_graph(read_graph(...)). Records are assumed to fit on one
+line (no quoted newlines), which holds for every file this project reads.
+
+    python ingest.py graph_v2.txt vertices_v1.txt --snapshot oregon.snap
+"""
+
+DEFAULT_CHUNK_BYTES = 8 * 1024 * 1024
+EDGE_COLUMNS = ('source', 'destination', 'highway', 'distance')
+VERTEX_COLUMNS = ('vertex', 'latitude', 'longitude')
+
+
+@dataclass
+class IngestStats:
+    rows: int = 0
+    characters: int = 0
+    chunks: int = 0
+    vertices: int = 0
+    edges: int = 0
+    parse_seconds: float = 0.0
+    build_seconds: float = 0.0
+
+    @property
+    def seconds(self) -> float:
+        return self.parse_seconds + self.build_seconds
+
+    @property
+    def rows_per_second(self) -> float:
+        """Get the edge rows ingested per second of total time."""
+        return self.rows / self.seconds if self.seconds else 0.0
+
+
+@dataclass
+class _EdgeChunk:
+    sources: array
+    destinations: array
+    highways: array
+    distances: array
+    characters: int
+
+
+def read_chunks(path: str, chunk_bytes: int = DEFAULT_CHUNK_BYTES) -> Iterator[Tuple[List[str], List[List[str]], int]]:
+    """Read a CSV file in blocks of whole lines.
+        Args:
+            path: The CSV file.
+            chunk_bytes: Approximate number of characters per block.
+        Returns:
+            Iterator of (header, rows, characters read) for every block.
+    """
+    with open(path, newline='') as file:
+        header = next(csv.reader([file.readline()]), [])
+        carry = ''
+        while True:
+            block = file.read(chunk_bytes)
+            if not block:
+                break
+            block = carry + block
+            cut = block.rfind('\n') + 1
+            if cut == 0:
+                carry = block
+                continue
+            carry = block[cut:]
+            yield header, [row for row in csv.reader(block[:cut].splitlines()) if row], cut
+        if carry.strip():
+            yield header, [row for row in csv.reader(carry.splitlines()) if row], len(carry)
+
+
+def _column_indexes(path: str, header: List[str], columns: Tuple[str, ...]) -> List[int]:
+    try:
+        return [header.index(column) for column in columns]
+    except ValueError:
+        raise ValueError(f"{path} must have the columns {', '.join(columns)}") from None
+
+
+class _EdgeParser:
+    """Turns edge CSV blocks into column arrays, interning names on the way."""
+
+    def __init__(self, path: str, chunk_bytes: int) -> None:
+        self.path = path
+        self.chunk_bytes = chunk_bytes
+        self.index: Dict[str, int] = {}
+        self.names: List[str] = []
+        self.highway_ids: Dict[str, int] = {}
+
+    def chunks(self) -> Iterator[_EdgeChunk]:
+        index = self.index
+        names = self.names
+        highway_ids = self.highway_ids
+        for header, rows, characters in read_chunks(self.path, self.chunk_bytes):
+            source_column, destination_column, highway_column, distance_column = \
+                _column_indexes(self.path, header, EDGE_COLUMNS)
+            sources = array('q')
+            destinations = array('q')
+            highways = array('i')
+            distances = array('d')
+            for row in rows:
+                source = row[source_column]
+                source_id = index.get(source)
+                if source_id is None:
+                    source_id = index[source] = len(names)
+                    names.append(source)
+                destination = row[destination_column]
+                destination_id = index.get(destination)
+                if destination_id is None:
+                    destination_id = index[destination] = len(names)
+                    names.append(destination)
+                highway = row[highway_column]
+                highway_id = highway_ids.get(highway)
+                if highway_id is None:
+                    highway_id = highway_ids[highway] = len(highway_ids)
+                sources.append(source_id)
+                destinations.append(destination_id)
+                highways.append(highway_id)
+                distances.append(float(row[distance_column]))
+            yield _EdgeChunk(sources, destinations, highways, distances, characters)
+
+
+def _threaded(chunks: Generator[_EdgeChunk, None, None], depth: int = 4) -> Iterator[_EdgeChunk]:
+    """Run a chunk iterator on a background thread, buffering at most depth
+    chunks. Exceptions raised while parsing are re-raised in the caller. If
+    the caller stops early (an error while building, or closing the
+    generator), the thread is told to stop, the buffer is drained and the
+    thread is joined before the generator finishes."""
+    handoff: queue.Queue = queue.Queue(maxsize=depth)
+    stop = threading.Event()
+    done = object()
+
+    def offer(item) -> bool:
+        # Wait for room in short steps so a stop request is never missed.
+        while not stop.is_set():
+            try:
+                handoff.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def produce() -> None:
+        try:
+            for chunk in chunks:
+                if not offer(chunk):
+                    return
+        except BaseException as error:
+            offer(error)
+        else:
+            offer(done)
+        finally:
+            chunks.close()
+
+    worker = threading.Thread(target=produce, name="edge-parser", daemon=True)
+    worker.start()
+    try:
+        while True:
+            item = handoff.get()
+            if item is done:
+                break
+            if isinstance(item, BaseException):
+                raise item
+            yield item
+    finally:
+        stop.set()
+        while True:
+            try:
+                handoff.get_nowait()
+            except queue.Empty:
+                break
+        worker.join()
+
+
+def read_coordinates(path: str, chunk_bytes: int = DEFAULT_CHUNK_BYTES) -> Dict[str, Tuple[float, float]]:
+    """Read the vertex coordinate CSV file.
+        Args:
+            path: Path to the coordinate CSV file (vertices_v1.txt).
+            chunk_bytes: Approximate number of characters per block.
+        Returns:
+            Dict from vertex name to (latitude, longitude).
+    """
+    coords: Dict[str, Tuple[float, float]] = {}
+    for header, rows, _ in read_chunks(path, chunk_bytes):
+        name_column, latitude_column, longitude_column = _column_indexes(path, header, VERTEX_COLUMNS)
+        for row in rows:
+            coords[row[name_column]] = (float(row[latitude_column]), float(row[longitude_column]))
+    return coords
+
+
+def ingest_graph(graph_file_path: str, vertices_file_path: str = "vertices_v1.txt",
+                 chunk_bytes: int = DEFAULT_CHUNK_BYTES, threaded: bool = False,
+                 progress: Optional[Callable[[IngestStats], None]] = None) -> Tuple[CompactGraph, IngestStats]:
+    """Build a CompactGraph from the edge and coordinate CSV files.
+        Args:
+            graph_file_path: Path to the edge CSV file (graph_v2.txt).
+            vertices_file_path: Path to the coordinate CSV file (vertices_v1.txt).
+            chunk_bytes: Approximate number of characters parsed per block.
+            threaded: Parse on a background thread while the columns are
+            assembled.
+            progress: Called with the running IngestStats after every block.
+        Returns:
+            The frozen CSR graph and the ingestion statistics.
+    """
+    stats = IngestStats()
+    start = time.perf_counter()
+    coords = read_coordinates(vertices_file_path, chunk_bytes)
+
+    parser = _EdgeParser(graph_file_path, chunk_bytes)
+    chunks = parser.chunks()
+    if threaded:
+        chunks = _threaded(chunks)
+    sources = array('q')
+    destinations = array('q')
+    highways = array('i')
+    distances = array('d')
+    for chunk in chunks:
+        sources.extend(chunk.sources)
+        destinations.extend(chunk.destinations)
+        highways.extend(chunk.highways)
+        distances.extend(chunk.distances)
+        stats.rows += len(chunk.sources)
+        stats.characters += chunk.characters
+        stats.chunks += 1
+        if progress is not None:
+            stats.parse_seconds = time.perf_counter() - start
+            progress(stats)
+    parsed = time.perf_counter()
+    stats.parse_seconds = parsed - start
+
+    names = parser.names
+    offsets, targets, weights, edge_highways = _build_csr(len(names), sources, destinations, distances, highways)
+    nan = float('nan')
+    latitudes = array('d', (coords.get(name, (nan, nan))[0] for name in names))
+    longitudes = array('d', (coords.get(name, (nan, nan))[1] for name in names))
+    graph = CompactGraph(names, offsets, targets, weights, latitudes, longitudes,
+                         list(parser.highway_ids), edge_highways, parser.index)
+    stats.build_seconds = time.perf_counter() - parsed
+    stats.vertices = graph.vertex_count()
+    stats.edges = graph.edge_count()
+    return graph, stats
+
+
+def _build_csr(vertex_count: int, sources: array, destinations: array, distances: array,
+               highways: array) -> Tuple[array, array, array, array]:
+    """Group edge columns by source (stable) and drop repeated pairs, keeping
+    the first pair's position and the last pair's weight and highway."""
+    edge_count = len(sources)
+    counts = array('q', [0]) * (vertex_count + 1)
+    for source in sources:
+        counts[source + 1] += 1
+    for u in range(vertex_count):
+        counts[u + 1] += counts[u]
+    cursor = array('q', counts)
+    targets = array('q', [0]) * edge_count
+    weights = array('d', [0.0]) * edge_count
+    edge_highways = array('i', [0]) * edge_count
+    for row in range(edge_count):
+        slot = cursor[sources[row]]
+        cursor[sources[row]] = slot + 1
+        targets[slot] = destinations[row]
+        weights[slot] = distances[row]
+        edge_highways[slot] = highways[row]
+
+    # Compact in place. position[v] is where the current source last wrote an
+    # edge to v; anything before the source's first slot belongs to an earlier
+    # source and is ignored.
+    offsets = array('q', [0]) * (vertex_count + 1)
+    position = array('q', [-1]) * vertex_count
+    write = 0
+    for u in range(vertex_count):
+        first = write
+        for slot in range(counts[u], counts[u + 1]):
+            target = targets[slot]
+            previous = position[target]
+            if previous >= first:
+                weights[previous] = weights[slot]
+                edge_highways[previous] = edge_highways[slot]
+                continue
+            position[target] = write
+            targets[write] = target
+            weights[write] = weights[slot]
+            edge_highways[write] = edge_highways[slot]
+            write += 1
+        offsets[u + 1] = write
+    del targets[write:], weights[write:], edge_highways[write:]
+    return offsets, targets, weights, edge_highways
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Bulk-load the graph CSV files into a CompactGraph.")
+    parser.add_argument("graph")
+    parser.add_argument("vertices", nargs="?", default="vertices_v1.txt")
+    parser.add_argument("--chunk-bytes", type=int, default=DEFAULT_CHUNK_BYTES)
+    parser.add_argument("--threaded", action="store_true", help="parse on a background thread")
+    parser.add_argument("--snapshot", help="also write a binary snapshot to this path")
+    args = parser.parse_args()
+
+    graph, stats = ingest_graph(args.graph, args.vertices, args.chunk_bytes, args.threaded)
+    print(f"Ingested {stats.rows} rows ({stats.vertices} vertices, {stats.edges} edges) in "
+          f"{stats.seconds:.3f} seconds: {stats.rows_per_second:,.0f} rows/sec "
+          f"(parse {stats.parse_seconds:.3f}s, build {stats.build_seconds:.3f}s).")
+    if args.snapshot:
+        save_snapshot(graph, args.snapshot)
+        print(f"Wrote snapshot to {args.snapshot}.")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,465 @@
+from __future__ import annotations
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import asdict, dataclass
+from typing import Callable, Dict, IO, Iterator, List, Optional, Protocol, Sequence, Tuple, Union
+import bisect
+import functools
+import json
+import math
+import random
+import threading
+import time
+
+import search_kernels
+from search_kernels import BidirectionalOutcome, SearchOutcome, SearchScratch
+from query_context import get_query_context
+
+"""
+Search instrumentation.
+
+AlgorithmResult only reports vertices explored, edges evaluated and the
+total time. With instrumentation enabled, every find_path call also produces
+a SearchRecord with what the search loop did:
+
+    heap_pushes / heap_pops    frontier operations
+    stale_skips                popped entries for vertices already settled
+                               (the price of lazy deletion)
+    heuristic_evaluations      calls of h(v) (A*, greedy, ALT) or of the
+                               bidirectional A* potential
+    max_frontier               largest frontier size (both heaps together
+                               for bidirectional searches)
+    setup_seconds              time before the search loop starts: building
+                               the query context on a new graph version,
+                               compiling cost profiles, landmark tables
+    search_seconds             time inside the search loop
+    trace                      for a sampled fraction of queries, the first
+                               trace_limit expanded vertices in order, as
+                               [vertex name, distance, frontier size, side]
+                               (side 1 for the backward half of a
+                               bidirectional search)
+
+Records go to pluggable sinks: CounterSink (running totals per algorithm),
+HistogramSink (setup/search/total latency histograms per algorithm) and
+JsonlSink (one JSON object per line, for offline hot-path analysis), or any
+object with a record(SearchRecord) method.
+
+    instrumentation.enable(CounterSink(), JsonlSink("searches.jsonl"), trace_sample_rate=0.01)
+
+Disabled (the default), instrumentation costs almost nothing. find_path
+methods are wrapped by probe_queries, which checks one module global per
+query and otherwise calls straight through, and algorithms get their kernels
+from active_kernels(): the plain search_kernels module, or, while a query is
+being recorded, that query's SearchProbe. The probe runs the same
+search_kernels functions, passing itself as their probe argument, and times
+them and counts heuristic calls around them.
+
+Algorithms that do not run one of these kernels (contraction hierarchies,
+arc flags, hub labels, time-dependent and dynamic searches, cache hits)
+still produce records with the timings and the counters from their
+AlgorithmResult, but with measured False and the kernel counters None. A
+probed find_path that calls another one (CachedAlgorithm running its wrapped
+algorithm) is recorded once, under the outer algorithm.
+"""
+
+# Latency histogram bucket upper bounds in seconds: 4 buckets per doubling
+# from 10us to about 170s.
+_BUCKET_BOUNDS = [10e-6 * 2 ** (i / 4) for i in range(97)]
+
+
+class LatencyHistogram:
+    """Class for a histogram of latencies with logarithmic buckets."""
+
+    def __init__(self) -> None:
+        self.counts = [0] * (len(_BUCKET_BOUNDS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def record(self, seconds: float) -> None:
+        """Add one latency.
+            Args:
+                seconds: The latency in seconds.
+            Returns:
+                None
+        """
+        self.counts[bisect.bisect_left(_BUCKET_BOUNDS, seconds)] += 1
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+
+    def percentile(self, q: float) -> float:
+        """Get an upper bound on a latency percentile.
+            Args:
+                q: The percentile, between 0 and 100.
+            Returns:
+                The upper bound of the bucket holding the percentile, in
+                seconds (0 if nothing was recorded).
+        """
+        if not self.count:
+            return 0.0
+        rank = max(1, math.ceil(self.count * q / 100))
+        seen = 0
+        for bucket, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank:
+                return min(_BUCKET_BOUNDS[bucket], self.max) if bucket < len(_BUCKET_BOUNDS) else self.max
+        return self.max
+
+    def summary(self) -> dict:
+        """Get the count, mean, percentiles and non-empty buckets in
+        milliseconds, ready for JSON."""
+        return {
+            "count": self.count,
+            "mean_ms": 1000 * self.total / self.count if self.count else 0.0,
+            "p50_ms": 1000 * self.percentile(50),
+            "p90_ms": 1000 * self.percentile(90),
+            "p99_ms": 1000 * self.percentile(99),
+            "max_ms": 1000 * self.max,
+            "buckets": [[1000 * _BUCKET_BOUNDS[i] if i < len(_BUCKET_BOUNDS) else None, count]
+                        for i, count in enumerate(self.counts) if count],
+        }
+
+
+@dataclass
+class SearchRecord:
+    algorithm: str
+    start: str
+    destination: str
+    path_found: bool
+    total_distance: float
+    vertices_explored: int
+    edges_evaluated: int
+    # measured is False when the query ran no search_kernels kernel; the
+    # five counters after it are then None.
+    measured: bool
+    heap_pushes: Optional[int]
+    heap_pops: Optional[int]
+    stale_skips: Optional[int]
+    heuristic_evaluations: Optional[int]
+    max_frontier: Optional[int]
+    kernel_calls: int
+    setup_seconds: float
+    search_seconds: float
+    total_seconds: float
+    trace: Optional[List[list]] = None
+
+    def to_dict(self) -> dict:
+        """Get the record as a JSON-ready dict."""
+        return asdict(self)
+
+
+class SearchSink(Protocol):
+    def record(self, record: SearchRecord) -> None: ...
+
+
+class CounterSink:
+    """Class for running totals of the search counters per algorithm. The
+    kernel counters only add up measured records."""
+
+    FIELDS = ("vertices_explored", "edges_evaluated", "setup_seconds", "search_seconds", "total_seconds")
+    KERNEL_FIELDS = ("heap_pushes", "heap_pops", "stale_skips", "heuristic_evaluations")
+
+    def __init__(self) -> None:
+        self._totals: Dict[str, Dict[str, float]] = {}
+        self._lock = threading.Lock()
+
+    def record(self, record: SearchRecord) -> None:
+        with self._lock:
+            totals = self._totals.get(record.algorithm)
+            if totals is None:
+                totals = self._totals[record.algorithm] = dict.fromkeys(
+                    ("queries", "measured_queries", "paths_found", "max_frontier")
+                    + self.FIELDS + self.KERNEL_FIELDS, 0)
+            totals["queries"] += 1
+            totals["paths_found"] += record.path_found
+            for name in self.FIELDS:
+                totals[name] += getattr(record, name)
+            if record.measured:
+                totals["measured_queries"] += 1
+                totals["max_frontier"] = max(totals["max_frontier"], record.max_frontier)
+                for name in self.KERNEL_FIELDS:
+                    totals[name] += getattr(record, name)
+
+    def snapshot(self) -> Dict[str, Dict[str, float]]:
+        """Get the totals per algorithm, plus the mean of every counter per
+        query (as mean_<counter>) and the share of pops that were stale.
+        Kernel counter means are per measured query, and None (like
+        max_frontier and stale_pop_ratio) when no query was measured."""
+        with self._lock:
+            totals = {algorithm: dict(values) for algorithm, values in self._totals.items()}
+        for values in totals.values():
+            queries = values["queries"]
+            measured = values["measured_queries"]
+            for name in self.FIELDS:
+                values[f"mean_{name}"] = values[name] / queries
+            for name in self.KERNEL_FIELDS:
+                values[f"mean_{name}"] = values[name] / measured if measured else None
+            if not measured:
+                values["max_frontier"] = None
+                values["stale_pop_ratio"] = None
+            else:
+                values["stale_pop_ratio"] = values["stale_skips"] / values["heap_pops"] if values["heap_pops"] else 0.0
+        return totals
+
+
+class HistogramSink:
+    """Class for setup, search and total latency histograms per algorithm."""
+
+    def __init__(self) -> None:
+        self._histograms: Dict[str, Dict[str, LatencyHistogram]] = {}
+        self._lock = threading.Lock()
+
+    def record(self, record: SearchRecord) -> None:
+        with self._lock:
+            histograms = self._histograms.get(record.algorithm)
+            if histograms is None:
+                histograms = self._histograms[record.algorithm] = {
+                    "setup": LatencyHistogram(), "search": LatencyHistogram(), "total": LatencyHistogram()}
+            histograms["setup"].record(record.setup_seconds)
+            histograms["search"].record(record.search_seconds)
+            histograms["total"].record(record.total_seconds)
+
+    def snapshot(self) -> Dict[str, Dict[str, dict]]:
+        """Get the histogram summaries per algorithm and phase."""
+        with self._lock:
+            return {algorithm: {phase: histogram.summary() for phase, histogram in histograms.items()}
+                    for algorithm, histograms in self._histograms.items()}
+
+
+class JsonlSink:
+    """Class that appends every record to a JSON-lines file."""
+
+    def __init__(self, target: Union[str, IO[str]], include_trace: bool = True) -> None:
+        """Constructor for the sink.
+            Args:
+                target: Path to append to, or an open text file.
+                include_trace: Write sampled traces (they can be large).
+            Returns:
+                None
+        """
+        self._owns_file = isinstance(target, str)
+        self._file = open(target, 'a') if isinstance(target, str) else target
+        self.include_trace = include_trace
+        self._lock = threading.Lock()
+
+    def record(self, record: SearchRecord) -> None:
+        data = record.to_dict()
+        if not self.include_trace or data["trace"] is None:
+            del data["trace"]
+        line = json.dumps(data) + "\n"
+        with self._lock:
+            self._file.write(line)
+
+    def close(self) -> None:
+        """Flush, and close the file if the sink opened it."""
+        with self._lock:
+            self._file.flush()
+            if self._owns_file:
+                self._file.close()
+
+
+@dataclass(frozen=True)
+class _Config:
+    sinks: Tuple[SearchSink, ...]
+    trace_sample_rate: float
+    trace_limit: int
+    rng: random.Random
+
+
+_config: Optional[_Config] = None
+_current: ContextVar[Optional[SearchProbe]] = ContextVar('current_search_probe', default=None)
+
+
+def enable(*sinks: SearchSink, trace_sample_rate: float = 0.0, trace_limit: int = 1000,
+           seed: Optional[int] = None) -> None:
+    """Start recording every probed find_path call, in all threads.
+        Args:
+            sinks: Where records are sent.
+            trace_sample_rate: Fraction of queries whose expanded vertices
+            are traced.
+            trace_limit: Most vertices kept per trace.
+            seed: Seed for the trace sampling.
+        Returns:
+            None
+    """
+    global _config
+    if not 0.0 <= trace_sample_rate <= 1.0:
+        raise ValueError("trace_sample_rate must be between 0 and 1")
+    _config = _Config(tuple(sinks), trace_sample_rate, trace_limit, random.Random(seed))
+
+
+def disable() -> None:
+    """Stop recording."""
+    global _config
+    _config = None
+
+
+def is_enabled() -> bool:
+    """Check whether searches are being recorded."""
+    return _config is not None
+
+
+@contextmanager
+def capture(*sinks: SearchSink, trace_sample_rate: float = 0.0, trace_limit: int = 1000,
+            seed: Optional[int] = None) -> Iterator[None]:
+    """Record searches for the duration of a with block, then restore the
+    previous setting. Arguments are those of enable."""
+    global _config
+    previous = _config
+    enable(*sinks, trace_sample_rate=trace_sample_rate, trace_limit=trace_limit, seed=seed)
+    try:
+        yield
+    finally:
+        _config = previous
+
+
+def active_kernels():
+    """Get the kernels the current query should run: the search_kernels
+    module, or the SearchProbe of the query being recorded."""
+    return _current.get() or search_kernels
+
+
+def probe_queries(find_path: Callable) -> Callable:
+    """Decorator for IAlgorithm.find_path methods (and find_path_at-style
+    variants with extra arguments) that records each call while
+    instrumentation is enabled."""
+    @functools.wraps(find_path)
+    def wrapper(self, graph, start_vertex_name: str, destination_vertex_name: str, *args, **kwargs):
+        config = _config
+        if config is None or _current.get() is not None:
+            return find_path(self, graph, start_vertex_name, destination_vertex_name, *args, **kwargs)
+        probe = SearchProbe(config.trace_limit if config.rng.random() < config.trace_sample_rate else 0)
+        token = _current.set(probe)
+        try:
+            result = find_path(self, graph, start_vertex_name, destination_vertex_name, *args, **kwargs)
+        finally:
+            _current.reset(token)
+        record = probe.finish(self.get_name(), graph, start_vertex_name, destination_vertex_name, result)
+        for sink in config.sinks:
+            sink.record(record)
+        return result
+    return wrapper
+
+
+class SearchProbe:
+    """Counters and timings of one query. Has the same kernel functions as
+    search_kernels, which run the originals with the probe attached."""
+
+    def __init__(self, trace_limit: int = 0) -> None:
+        """Constructor that starts the query clock.
+            Args:
+                trace_limit: Expanded vertices to trace (0 for no trace).
+            Returns:
+                None
+        """
+        self.started = time.perf_counter()
+        self.search_started: Optional[float] = None
+        self.search_finished: Optional[float] = None
+        self.search_seconds = 0.0
+        self.kernel_calls = 0
+        self.heap_pushes = 0
+        self.heap_pops = 0
+        self.stale_skips = 0
+        self.heuristic_evaluations = 0
+        self.max_frontier = 0
+        self.trace_limit = trace_limit
+        self.trace: Optional[List[Tuple[int, float, int, int]]] = [] if trace_limit > 0 else None
+
+    def dijkstra(self, offsets: Sequence[int], targets: Sequence[int], weights: Sequence[float],
+                 start: int, goal: int, scratch: SearchScratch,
+                 settle_order: Optional[List[int]] = None) -> SearchOutcome:
+        return self._timed(search_kernels.dijkstra, offsets, targets, weights, start, goal, scratch,
+                           settle_order)
+
+    def astar(self, offsets: Sequence[int], targets: Sequence[int], weights: Sequence[float],
+              start: int, goal: int, h: Callable[[int], float], scratch: SearchScratch) -> SearchOutcome:
+        return self._timed(search_kernels.astar, offsets, targets, weights, start, goal, self._counted(h), scratch)
+
+    def greedy(self, offsets: Sequence[int], targets: Sequence[int], weights: Sequence[float],
+               start: int, goal: int, h: Callable[[int], float], scratch: SearchScratch) -> SearchOutcome:
+        return self._timed(search_kernels.greedy, offsets, targets, weights, start, goal, self._counted(h), scratch)
+
+    def bidirectional(self, forward: Tuple[Sequence[int], Sequence[int], Sequence[float]],
+                      backward: Tuple[Sequence[int], Sequence[int], Sequence[float]],
+                      start: int, goal: int, forward_scratch: SearchScratch, backward_scratch: SearchScratch,
+                      potential: Optional[Callable[[int], float]] = None) -> BidirectionalOutcome:
+        return self._timed(search_kernels.bidirectional, forward, backward, start, goal, forward_scratch,
+                           backward_scratch, None if potential is None else self._counted(potential))
+
+    def finish(self, algorithm: str, graph, start: str, destination: str, result) -> SearchRecord:
+        """Stop the query clock and build its record.
+            Args:
+                algorithm: The algorithm's name.
+                graph: The graph searched (to name traced vertices).
+                start: Start vertex name.
+                destination: Destination vertex name.
+                result: The AlgorithmResult returned.
+            Returns:
+                The SearchRecord.
+        """
+        finished = time.perf_counter()
+        setup = (self.search_started if self.search_started is not None else finished) - self.started
+        measured = self.kernel_calls > 0
+        trace = None
+        if self.trace is not None and measured:
+            names = get_query_context(graph).graph.names
+            trace = [[names[vertex], distance, frontier, side] for vertex, distance, frontier, side in self.trace]
+        return SearchRecord(
+            algorithm=algorithm,
+            start=start,
+            destination=destination,
+            path_found=result.path_found,
+            total_distance=result.total_distance,
+            vertices_explored=result.vertices_explored,
+            edges_evaluated=result.edges_evaluated,
+            measured=measured,
+            heap_pushes=self.heap_pushes if measured else None,
+            heap_pops=self.heap_pops if measured else None,
+            stale_skips=self.stale_skips if measured else None,
+            heuristic_evaluations=self.heuristic_evaluations if measured else None,
+            max_frontier=self.max_frontier if measured else None,
+            kernel_calls=self.kernel_calls,
+            setup_seconds=setup,
+            search_seconds=self.search_seconds,
+            total_seconds=finished - self.started,
+            trace=trace,
+        )
+
+    def _timed(self, kernel: Callable, *args):
+        began = time.perf_counter()
+        if self.search_started is None:
+            self.search_started = began
+        try:
+            return kernel(*args, probe=self)
+        finally:
+            self.kernel_calls += 1
+            self.search_seconds += time.perf_counter() - began
+
+    def _counted(self, h: Callable[[int], float]) -> Callable[[int], float]:
+        def counted(v: int) -> float:
+            self.heuristic_evaluations += 1
+            return h(v)
+        return counted
+
+    def settled(self, vertex: int, distance: float, frontier_size: int, side: int) -> None:
+        """Called by a kernel for every vertex it settles, with the frontier
+        size after the pop (see search_kernels.KernelProbe)."""
+        self.skipped(frontier_size)
+        trace = self.trace
+        if trace is not None and len(trace) < self.trace_limit:
+            trace.append((vertex, distance, frontier_size, side))
+
+    def skipped(self, frontier_size: int) -> None:
+        """Called by a kernel for every stale entry it pops."""
+        # The frontier held one more entry before the pop. Its largest size
+        # is seen by the next pop, or by kernel_done if nothing follows.
+        if frontier_size + 1 > self.max_frontier:
+            self.max_frontier = frontier_size + 1
+
+    def kernel_done(self, pushes: int, pops: int, vertices_explored: int) -> None:
+        """Called by a kernel when it returns, with its heap totals."""
+        self.heap_pushes += pushes
+        self.heap_pops += pops
+        self.stale_skips += pops - vertices_explored
+        self.max_frontier = max(self.max_frontier, pushes - pops)
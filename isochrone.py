@@ -0,0 +1,130 @@
+from __future__ import annotations
+from array import array
+from dataclasses import dataclass
+from typing import List, Optional, Sequence, Union
+import argparse
+import time
+
+from graph_interfaces import IGraph
+from compact_graph import CompactGraph
+from query_context import get_query_context
+import search_kernels
+
+"""
+Range queries.
+
+reachable_within() answers "which vertices are within 150 miles of Eugene"
+with one Dijkstra search that stops at the distance bound, instead of one
+find_path call per candidate destination. Several sources can be given at
+once; each vertex is then measured from its nearest source (the service area
+of a set of depots). With nearest=N the search also stops after the N closest
+vertices, so a top-N query on a large graph touches little more than N
+vertices.
+
+The answer is two parallel arrays in order of distance, vertex ids as
+array('q') and distances as array('d'), which expose the buffer protocol
+and can be wrapped without copying:
+
+    area = reachable_within(graph, "Eugene", 150.0)
+    for name, miles in zip(area.names(), area.distances): ...
+
+Searches take their scratch space from the graph's QueryContext pool, so
+repeated queries on the same graph version allocate no per-vertex state. With
+reverse=True the search runs over the reversed graph and measures distances
+towards the sources instead (which cities can reach Eugene within 150 miles).
+"""
+
+
+@dataclass
+class RangeResult:
+    vertex_ids: array
+    distances: array
+    truncated: bool
+    vertices_explored: int
+    edges_evaluated: int
+    execution_time: float
+    graph: CompactGraph
+
+    def __len__(self) -> int:
+        return len(self.vertex_ids)
+
+    def names(self) -> List[str]:
+        """Get the names of the reached vertices, nearest first."""
+        names = self.graph.names
+        return [names[v] for v in self.vertex_ids]
+
+
+def reachable_within(graph: IGraph, sources: Union[str, Sequence[str]], max_distance: float,
+                     nearest: Optional[int] = None, reverse: bool = False) -> RangeResult:
+    """Find every vertex within max_distance of the nearest source.
+        Args:
+            graph: The graph to search.
+            sources: Name of the source vertex, or a sequence of names.
+            max_distance: Largest distance to include (inclusive); may be
+            float('inf') for everything reachable.
+            nearest: If given, only the nearest this many vertices (the
+            sources included) are returned.
+            reverse: Measure distances from each vertex to the sources
+            instead of from the sources.
+        Returns:
+            RangeResult with vertex ids and distances in order of distance;
+            truncated is True when nearest cut the result short.
+    """
+    start_time = time.time()
+    if max_distance < 0:
+        raise ValueError("max_distance must not be negative")
+    if nearest is not None and nearest < 0:
+        raise ValueError("nearest must not be negative")
+    context = get_query_context(graph)
+    compact = context.graph
+    if isinstance(sources, str):
+        sources = [sources]
+    source_ids = []
+    for name in sources:
+        vertex_id = compact.vertex_id(name)
+        if vertex_id is None:
+            raise ValueError(f"Vertex not found: {name}")
+        source_ids.append(vertex_id)
+
+    searched = compact.reversed() if reverse else compact
+    vertex_ids = array('q')
+    distances = array('d')
+    scratch = context.acquire_scratch()
+    try:
+        outcome = search_kernels.dijkstra_within(
+            searched.offsets, searched.targets, searched.weights, source_ids, max_distance,
+            compact.vertex_count() if nearest is None else nearest, scratch, vertex_ids, distances)
+    finally:
+        context.release_scratch(scratch)
+
+    return RangeResult(
+        vertex_ids=vertex_ids,
+        distances=distances,
+        truncated=outcome.found,
+        vertices_explored=outcome.vertices_explored,
+        edges_evaluated=outcome.edges_evaluated,
+        execution_time=time.time() - start_time,
+        graph=compact
+    )
+
+
+def main() -> None:
+    from program import read_graph
+    parser = argparse.ArgumentParser(description="List the cities within a distance of one or more cities.")
+    parser.add_argument("sources", nargs="+")
+    parser.add_argument("--miles", type=float, required=True)
+    parser.add_argument("--nearest", type=int, default=None)
+    parser.add_argument("--reverse", action="store_true", help="distances towards the sources")
+    parser.add_argument("--graph", default="graph_v2.txt")
+    parser.add_argument("--vertices", default="vertices_v1.txt")
+    args = parser.parse_args()
+
+    graph = read_graph(args.graph, args.vertices)
+    result = reachable_within(graph, args.sources, args.miles, args.nearest, args.reverse)
+    for name, distance in zip(result.names(), result.distances):
+        print(f"{distance:8.1f}  {name}")
+    print(f"{len(result)} vertices in {result.execution_time * 1000:.2f} ms"
+          f"{' (truncated)' if result.truncated else ''}")
+
+if __name__ == "__main__":
+    main()
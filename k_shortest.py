@@ -0,0 +1,436 @@
+from __future__ import annotations
+from array import array
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Sequence, Set, Tuple
+import argparse
+import heapq
+import time
+
+from graph_interfaces import IGraph, AlgorithmResult
+from compact_graph import CompactGraph
+from query_context import QueryContext, get_query_context
+from search_kernels import INF, SearchOutcome, SearchScratch
+
+"""
+Top-k routes between two vertices.
+
+k_shortest_paths() returns the k shortest loopless paths in order of length
+(Yen's algorithm). alternative_routes() returns up to k routes that are each
+reasonably short and reasonably different from one another (the penalty
+method). Both return one AlgorithmResult per route, shortest first.
+
+Both start with one backward Dijkstra tree grown from the destination over the
+reversed graph, which gives to_goal[v], the exact distance from v to the
+destination, and next[v], the first step of that shortest path. Every later
+search reuses the tree:
+
+* to_goal is a consistent A* potential for any search towards the
+  destination on the same graph with some vertices or edges removed, or with
+  some weights increased, since both only make distances longer. The spur
+  searches of Yen's algorithm and the penalised searches follow it almost
+  straight to the destination and expand few vertices off the route.
+* A Yen spur search whose tree path (spur vertex, next[spur], ...) avoids
+  every banned edge and root vertex needs no search at all: the tree path is
+  the answer.
+* With max_stretch, only routes up to max_stretch times the shortest distance
+  are wanted, so the tree stops growing at that distance. Vertices beyond it
+  get the stretch limit as their potential, which is still a lower bound.
+
+Yen's algorithm spurs only from the point where each path left its parent
+(Lawler's rule), and the paths already found are kept in a trie so the edges
+to ban at each spur vertex are read off in one walk down the previous path.
+The work per route is therefore a handful of short guided searches, and the
+total grows about linearly in k.
+
+alternative_routes penalises the edges of every route it finds (weight times
+1 + penalty) and searches again. A route is kept if its true length is within
+max_stretch of the shortest and at most max_overlap of its length runs over
+roads the kept routes already use.
+
+Each result's vertices_explored, edges_evaluated and execution_time count the
+work since the previous route was returned; the first route includes building
+the tree. Parallel edges are not told apart: a path is its vertex sequence and
+each hop takes the cheapest edge between its two vertices.
+
+    routes = k_shortest_paths(graph, "Portland", "Medford", 4)
+    routes = alternative_routes(graph, "Portland", "Medford", 3, max_stretch=1.3)
+"""
+
+
+@dataclass
+class _Tree:
+    """Backward shortest-path tree towards the destination."""
+    scratch: SearchScratch
+    limit: float
+
+    def to_goal(self, vertex: int) -> float:
+        """Get the exact distance to the destination, or the tree's limit if
+        vertex is beyond it (INF if the tree is complete)."""
+        scratch = self.scratch
+        return scratch.dist[vertex] if scratch.closed[vertex] else self.limit
+
+
+def _grow_tree(reverse: CompactGraph, goal: int, start: int, max_stretch: Optional[float],
+               tree: _Tree) -> SearchOutcome:
+    # Dijkstra from goal over the reversed graph. Once start is settled the
+    # tree keeps growing only up to max_stretch times its distance, which
+    # becomes tree.limit. scratch.parent[v] is the next vertex from v
+    # towards goal.
+    scratch = tree.scratch
+    scratch.reset()
+    offsets, targets, weights = reverse.offsets, reverse.targets, reverse.weights
+    dist, parent, closed, touched = scratch.dist, scratch.parent, scratch.closed, scratch.touched
+    heappush, heappop = heapq.heappush, heapq.heappop
+    dist[goal] = 0.0
+    touched.append(goal)
+    frontier = [(0.0, 0, goal)]
+    sequence = 1
+    limit = INF
+    vertices_explored = 0
+    edges_evaluated = 0
+
+    while frontier:
+        d, _, u = heappop(frontier)
+        if closed[u]:
+            continue
+        if d > limit:
+            break
+        closed[u] = 1
+        vertices_explored += 1
+        if u == start and max_stretch is not None:
+            limit = d * max_stretch
+        first, last = offsets[u], offsets[u + 1]
+        edges_evaluated += last - first
+        for e in range(first, last):
+            v = targets[e]
+            nd = d + weights[e]
+            if nd < dist[v] and not closed[v]:
+                if dist[v] == INF:
+                    touched.append(v)
+                dist[v] = nd
+                parent[v] = u
+                heappush(frontier, (nd, sequence, v))
+                sequence += 1
+
+    tree.limit = limit
+    return SearchOutcome(bool(closed[start]), dist[start], vertices_explored, edges_evaluated)
+
+
+def _guided_search(offsets: Sequence[int], targets: Sequence[int], weights: Sequence[float],
+                   start: int, goal: int, tree: _Tree, bound: float, blocked: bytearray,
+                   banned_next: Set[int], scratch: SearchScratch) -> SearchOutcome:
+    # A* from start to goal with the tree distances as potential. Vertices
+    # flagged in blocked are never entered, start's edges to banned_next are
+    # skipped, and paths longer than bound are pruned.
+    scratch.reset()
+    dist, parent, closed, touched = scratch.dist, scratch.parent, scratch.closed, scratch.touched
+    tree_dist, tree_closed, limit = tree.scratch.dist, tree.scratch.closed, tree.limit
+    heappush, heappop = heapq.heappush, heapq.heappop
+    dist[start] = 0.0
+    touched.append(start)
+    frontier = [(tree.to_goal(start), 0, start)]
+    sequence = 1
+    vertices_explored = 0
+    edges_evaluated = 0
+
+    while frontier:
+        f, _, u = heappop(frontier)
+        if closed[u]:
+            continue
+        if f > bound:
+            break
+        closed[u] = 1
+        vertices_explored += 1
+        d = dist[u]
+        if u == goal:
+            return SearchOutcome(True, d, vertices_explored, edges_evaluated)
+        first, last = offsets[u], offsets[u + 1]
+        edges_evaluated += last - first
+        for e in range(first, last):
+            v = targets[e]
+            if blocked[v] or (u == start and v in banned_next):
+                continue
+            nd = d + weights[e]
+            if nd < dist[v] and not closed[v]:
+                hv = tree_dist[v] if tree_closed[v] else limit
+                if hv == INF or nd + hv > bound:
+                    continue
+                if dist[v] == INF:
+                    touched.append(v)
+                dist[v] = nd
+                parent[v] = u
+                heappush(frontier, (nd + hv, sequence, v))
+                sequence += 1
+
+    return SearchOutcome(False, INF, vertices_explored, edges_evaluated)
+
+
+def _hop_slot(graph: CompactGraph, weights: Sequence[float], u: int, v: int) -> int:
+    # The cheapest edge slot from u to v.
+    targets = graph.targets
+    best = -1
+    for e in range(graph.offsets[u], graph.offsets[u + 1]):
+        if targets[e] == v and (best == -1 or weights[e] < weights[best]):
+            best = e
+    return best
+
+
+def _hop_costs(graph: CompactGraph, path: Sequence[int]) -> List[float]:
+    weights = graph.weights
+    return [weights[_hop_slot(graph, weights, path[i], path[i + 1])] for i in range(len(path) - 1)]
+
+
+def _tree_path(tree: _Tree, vertex: int) -> List[int]:
+    path = [vertex]
+    parent = tree.scratch.parent
+    while parent[vertex] != -1:
+        vertex = parent[vertex]
+        path.append(vertex)
+    return path
+
+
+class _Work:
+    """Search counters and clock since the last route was returned."""
+
+    def __init__(self) -> None:
+        self.vertices_explored = 0
+        self.edges_evaluated = 0
+        self.started = time.time()
+
+    def add(self, outcome: SearchOutcome) -> None:
+        self.vertices_explored += outcome.vertices_explored
+        self.edges_evaluated += outcome.edges_evaluated
+
+    def result(self, graph: CompactGraph, path: Sequence[int], distance: float) -> AlgorithmResult:
+        """Build the result for one route and restart the counters."""
+        result = AlgorithmResult(
+            textual_directions=" -> ".join(graph.names[v] for v in path),
+            total_distance=distance,
+            vertices_explored=self.vertices_explored,
+            edges_evaluated=self.edges_evaluated,
+            execution_time=time.time() - self.started,
+            path_found=True
+        )
+        self.__init__()
+        return result
+
+
+def _endpoints(context: QueryContext, start_vertex_name: str,
+               destination_vertex_name: str) -> Optional[Tuple[int, int]]:
+    # None when either vertex is unknown, which callers report like an
+    # unreachable destination (as find_path reports "not found").
+    start = context.graph.vertex_id(start_vertex_name)
+    goal = context.graph.vertex_id(destination_vertex_name)
+    if start is None or goal is None:
+        return None
+    return start, goal
+
+
+def _check_stretch(max_stretch: Optional[float]) -> None:
+    if max_stretch is not None and max_stretch < 1.0:
+        raise ValueError("max_stretch must be at least 1")
+
+
+def k_shortest_paths(graph: IGraph, start_vertex_name: str, destination_vertex_name: str, k: int,
+                     max_stretch: Optional[float] = None) -> List[AlgorithmResult]:
+    """Find the k shortest loopless paths with Yen's algorithm.
+        Args:
+            graph: The graph to search.
+            start_vertex_name: Name of the start vertex.
+            destination_vertex_name: Name of the destination vertex.
+            k: Number of paths wanted.
+            max_stretch: If given, only return paths at most this many times
+            as long as the shortest one (which also bounds the search).
+        Returns:
+            Up to k AlgorithmResults in order of length; empty if either
+            vertex is unknown or the destination cannot be reached.
+    """
+    context = get_query_context(graph)
+    compact = context.graph
+    endpoints = _endpoints(context, start_vertex_name, destination_vertex_name)
+    _check_stretch(max_stretch)
+    if endpoints is None or k <= 0:
+        return []
+    start, goal = endpoints
+    work = _Work()
+    tree_scratch = context.acquire_scratch()
+    scratch = context.acquire_scratch()
+    try:
+        tree = _Tree(tree_scratch, INF)
+        outcome = _grow_tree(compact.reversed(), goal, start, max_stretch, tree)
+        work.add(outcome)
+        if not outcome.found:
+            return []
+        limit = tree.limit
+
+        first = _tree_path(tree, start)
+        results = [work.result(compact, first, tree.to_goal(start))]
+        # Paths found so far as a trie of next-vertex dicts, and each path's
+        # vertices, hop costs and deviation index (where it left its parent).
+        trie: Dict[int, dict] = {first[0]: {}}
+        _trie_insert(trie, first)
+        previous, previous_costs, deviation = first, _hop_costs(compact, first), 0
+        seen = {tuple(first)}
+        candidates: List[Tuple[float, int, List[int], int]] = []
+        sequence = 0
+        blocked = bytearray(compact.vertex_count())
+        offsets, targets, weights = compact.offsets, compact.targets, compact.weights
+
+        while len(results) < k:
+            node = trie[previous[0]]
+            root_cost = 0.0
+            for i in range(deviation):
+                blocked[previous[i]] = 1
+                root_cost += previous_costs[i]
+                node = node[previous[i + 1]]
+            for i in range(deviation, len(previous) - 1):
+                spur = previous[i]
+                banned_next = set(node)
+                spur_path = _tree_path(tree, spur)
+                if len(spur_path) > 1 and spur_path[1] not in banned_next and \
+                        not any(blocked[v] for v in spur_path):
+                    spur_cost = tree.to_goal(spur)
+                else:
+                    blocked[spur] = 0
+                    outcome = _guided_search(offsets, targets, weights, spur, goal, tree,
+                                             limit - root_cost, blocked, banned_next, scratch)
+                    work.add(outcome)
+                    spur_path = scratch.path_to(goal) if outcome.found else []
+                    spur_cost = outcome.distance
+                if spur_path:
+                    path = previous[:i] + spur_path
+                    key = tuple(path)
+                    if key not in seen and root_cost + spur_cost <= limit:
+                        seen.add(key)
+                        heapq.heappush(candidates, (root_cost + spur_cost, sequence, path, i))
+                        sequence += 1
+                blocked[spur] = 1
+                root_cost += previous_costs[i]
+                node = node[previous[i + 1]]
+            for v in previous:
+                blocked[v] = 0
+
+            if not candidates:
+                break
+            distance, _, previous, deviation = heapq.heappop(candidates)
+            previous_costs = _hop_costs(compact, previous)
+            _trie_insert(trie, previous)
+            results.append(work.result(compact, previous, distance))
+        return results
+    finally:
+        context.release_scratch(scratch)
+        context.release_scratch(tree_scratch)
+
+
+def _trie_insert(trie: Dict[int, dict], path: Sequence[int]) -> None:
+    node = trie[path[0]]
+    for v in path[1:]:
+        node = node.setdefault(v, {})
+
+
+def alternative_routes(graph: IGraph, start_vertex_name: str, destination_vertex_name: str, k: int = 3,
+                       max_stretch: float = 1.3, max_overlap: float = 0.6, penalty: float = 0.4,
+                       max_attempts: Optional[int] = None) -> List[AlgorithmResult]:
+    """Find up to k short, mostly disjoint routes with the penalty method.
+        Args:
+            graph: The graph to search.
+            start_vertex_name: Name of the start vertex.
+            destination_vertex_name: Name of the destination vertex.
+            k: Number of routes wanted, including the shortest.
+            max_stretch: Longest route kept, as a multiple of the shortest.
+            max_overlap: Largest fraction of a route's length that may run
+            over edges of routes already kept.
+            penalty: Each time an edge is on a route found, its search weight
+            is multiplied by 1 + penalty.
+            max_attempts: Penalised searches to run before giving up
+            (default 4 * k).
+        Returns:
+            Up to k AlgorithmResults in order of length, the shortest route
+            first; empty if either vertex is unknown or the destination
+            cannot be reached.
+    """
+    context = get_query_context(graph)
+    compact = context.graph
+    endpoints = _endpoints(context, start_vertex_name, destination_vertex_name)
+    _check_stretch(max_stretch)
+    if endpoints is None or k <= 0:
+        return []
+    start, goal = endpoints
+    if max_attempts is None:
+        max_attempts = 4 * k
+    work = _Work()
+    tree_scratch = context.acquire_scratch()
+    scratch = context.acquire_scratch()
+    try:
+        tree = _Tree(tree_scratch, INF)
+        outcome = _grow_tree(compact.reversed(), goal, start, max_stretch, tree)
+        work.add(outcome)
+        if not outcome.found:
+            return []
+        limit = tree.limit
+
+        weights = compact.weights
+        penalised = array('d', weights)
+        factor = 1.0 + penalty
+        path = _tree_path(tree, start)
+        results = [work.result(compact, path, tree.to_goal(start))]
+        seen = {tuple(path)}
+        used: Set[int] = set()
+        slots = [_hop_slot(compact, weights, path[i], path[i + 1]) for i in range(len(path) - 1)]
+        blocked = bytearray(compact.vertex_count())
+        kept = [(results[0].total_distance, results[0])]
+
+        used.update(slots)
+        for _ in range(max_attempts):
+            if len(kept) >= k:
+                break
+            for e in slots:
+                penalised[e] *= factor
+            outcome = _guided_search(compact.offsets, compact.targets, penalised, start, goal, tree,
+                                     INF, blocked, set(), scratch)
+            work.add(outcome)
+            if not outcome.found:
+                break
+            path = scratch.path_to(goal)
+            slots = [_hop_slot(compact, penalised, path[i], path[i + 1]) for i in range(len(path) - 1)]
+            distance = sum(weights[e] for e in slots)
+            shared = sum(weights[e] for e in slots if e in used)
+            key = tuple(path)
+            if key in seen or distance > limit or shared > max_overlap * distance:
+                continue
+            seen.add(key)
+            used.update(slots)
+            kept.append((distance, work.result(compact, path, distance)))
+        kept.sort(key=lambda entry: entry[0])
+        return [result for _, result in kept]
+    finally:
+        context.release_scratch(scratch)
+        context.release_scratch(tree_scratch)
+
+
+def main() -> None:
+    from program import read_graph
+    parser = argparse.ArgumentParser(description="Print the k shortest or k alternative routes.")
+    parser.add_argument("start")
+    parser.add_argument("destination")
+    parser.add_argument("-k", type=int, default=3)
+    parser.add_argument("--graph", default="graph_v2.txt")
+    parser.add_argument("--vertices", default="vertices_v1.txt")
+    parser.add_argument("--alternatives", action="store_true",
+                        help="use the penalty method instead of Yen's k shortest paths")
+    parser.add_argument("--max-stretch", type=float, default=None)
+    args = parser.parse_args()
+
+    graph = read_graph(args.graph, args.vertices)
+    if args.alternatives:
+        routes = alternative_routes(graph, args.start, args.destination, args.k,
+                                    max_stretch=args.max_stretch or 1.3)
+    else:
+        routes = k_shortest_paths(graph, args.start, args.destination, args.k, args.max_stretch)
+    for rank, route in enumerate(routes, 1):
+        print(f"{rank}. {route.total_distance:.1f} miles: {route.textual_directions}")
+    if not routes:
+        print("No path found.")
+
+if __name__ == "__main__":
+    main()
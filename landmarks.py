@@ -0,0 +1,335 @@
+from __future__ import annotations
+from array import array
+from typing import Callable, List, Optional, Sequence
+import math
+import random
+import time
+
+from graph_interfaces import IAlgorithm, IGraph, AlgorithmResult
+from compact_graph import CompactGraph
+from query_context import QueryContext, get_query_context
+import search_kernels
+from instrumentation import active_kernels, probe_queries
+
+"""
+ALT: A* with Landmarks and the Triangle inequality.
+
+A handful of landmark vertices L are chosen and the exact distances to and from
+every landmark are precomputed with one forward and one backward Dijkstra each.
+For any vertex v and goal t the triangle inequality then gives two lower
+bounds on the remaining distance d(v, t):
+
+    d(v, L) - d(t, L)      (to-landmark table)
+    d(L, t) - d(L, v)      (from-landmark table)
+
+The ALT heuristic is the largest of these bounds over the landmarks, combined
+with the haversine bound when every vertex has coordinates. Unlike the plain
+haversine heuristic it stays useful on graphs with missing coordinates and on
+roads much longer than the great-circle distance.
+
+Landmark selection strategies:
+
+    farthest  repeatedly pick the vertex farthest from the landmarks chosen so far
+    avoid     Goldberg & Harrelson's "avoid": grow a shortest-path tree from a
+              random root, weight each vertex by how badly the current
+              landmarks bound its distance, and walk down to the heaviest leaf
+              of a subtree that contains no landmark yet
+
+Tables are stored vertex-major in flat array('d') buffers of V * K floats, so
+the K distances a heuristic evaluation needs for one vertex are adjacent.
+"""
+
+INF = math.inf
+MAX_ACTIVE_LANDMARKS = 4
+
+
+class LandmarkTable:
+    """Class for precomputed landmark distance tables of one graph."""
+
+    def __init__(self, graph: CompactGraph, landmarks: List[int], to_landmark: array,
+                 from_landmark: array, build_time: float = 0.0) -> None:
+        """Constructor for the table.
+            Args:
+                graph: The graph the distances were computed on.
+                landmarks: Landmark vertex ids.
+                to_landmark: to_landmark[v * K + i] = d(v, landmarks[i]).
+                from_landmark: from_landmark[v * K + i] = d(landmarks[i], v).
+                build_time: Seconds spent selecting landmarks and filling tables.
+            Returns:
+                None
+        """
+        self.graph = graph
+        self.landmarks = landmarks
+        self.to_landmark = to_landmark
+        self.from_landmark = from_landmark
+        self.build_time = build_time
+        self.has_all_coordinates = not any(math.isnan(lat) for lat in graph.latitudes) and \
+            not any(math.isnan(lon) for lon in graph.longitudes)
+
+    @classmethod
+    def build(cls, graph: IGraph, count: int = 8, strategy: str = "avoid", seed: int = 0) -> LandmarkTable:
+        """Select landmarks for graph and compute their distance tables.
+            Args:
+                graph: The graph to preprocess.
+                count: Number of landmarks (capped at the vertex count).
+                strategy: "farthest" or "avoid".
+                seed: Seed for the random starting vertex / tree roots.
+            Returns:
+                The LandmarkTable.
+        """
+        if strategy not in ("farthest", "avoid"):
+            raise ValueError(f"Unknown landmark strategy: {strategy}")
+        build_start = time.time()
+        context = get_query_context(graph)
+        compact = context.graph
+        vertex_count = compact.vertex_count()
+        count = min(count, vertex_count)
+        rng = random.Random(seed)
+        table = cls(compact, [], array('d'), array('d'))
+        for _ in range(count):
+            if strategy == "farthest":
+                landmark = _farthest_candidate(context, table, rng)
+            else:
+                landmark = _avoid_candidate(context, table, rng)
+            if landmark is None:
+                break
+            table._add_landmark(context, landmark)
+        table.build_time = time.time() - build_start
+        return table
+
+    def _add_landmark(self, context: QueryContext, landmark: int) -> None:
+        """Append a landmark and re-lay the vertex-major tables around it."""
+        to_row = _distances_from(context, landmark, reverse=True)
+        from_row = _distances_from(context, landmark, reverse=False)
+        k = len(self.landmarks)
+        to_landmark = array('d')
+        from_landmark = array('d')
+        for v in range(self.graph.vertex_count()):
+            to_landmark.extend(self.to_landmark[v * k:(v + 1) * k])
+            to_landmark.append(to_row[v])
+            from_landmark.extend(self.from_landmark[v * k:(v + 1) * k])
+            from_landmark.append(from_row[v])
+        self.landmarks.append(landmark)
+        self.to_landmark = to_landmark
+        self.from_landmark = from_landmark
+
+    def lower_bound(self, v: int, t: int, active: Optional[Sequence[int]] = None) -> float:
+        """Get the best landmark lower bound on d(v, t).
+            Args:
+                v: Vertex id.
+                t: Goal vertex id.
+                active: Landmark positions to use (default: all of them).
+            Returns:
+                The lower bound; inf when the tables prove t is unreachable from v.
+        """
+        k = len(self.landmarks)
+        to_landmark, from_landmark = self.to_landmark, self.from_landmark
+        best = 0.0
+        for i in (active if active is not None else range(k)):
+            v_to, t_to = to_landmark[v * k + i], to_landmark[t * k + i]
+            if t_to != INF:
+                bound = v_to - t_to
+                if bound > best:
+                    best = bound
+            l_to_t, l_to_v = from_landmark[t * k + i], from_landmark[v * k + i]
+            if l_to_v != INF:
+                bound = l_to_t - l_to_v
+                if bound > best:
+                    best = bound
+        return best
+
+    def heuristic(self, context: QueryContext, start: int, goal: int) -> Callable[[int], float]:
+        """Build the ALT heuristic for one query: the max of the landmark bounds
+        (using the MAX_ACTIVE_LANDMARKS landmarks that bound the start best) and,
+        when every vertex has coordinates, the haversine bound.
+            Args:
+                context: Query context of the graph the table was built on.
+                start: Start vertex id.
+                goal: Goal vertex id.
+            Returns:
+                Function giving a consistent lower bound on d(v, goal).
+        """
+        k = len(self.landmarks)
+        ranked = sorted(range(k), key=lambda i: -self.lower_bound(start, goal, (i,)))
+        active = ranked[:MAX_ACTIVE_LANDMARKS]
+        # Pre-read the goal's table entries; only v's entries vary per call.
+        goal_terms = [(i, self.to_landmark[goal * k + i], self.from_landmark[goal * k + i]) for i in active]
+        to_landmark, from_landmark = self.to_landmark, self.from_landmark
+        haversine = context.heuristic(goal) if self.has_all_coordinates else None
+
+        def h(v: int) -> float:
+            best = haversine(v) if haversine is not None else 0.0
+            base = v * k
+            for i, t_to, l_to_t in goal_terms:
+                if t_to != INF:
+                    bound = to_landmark[base + i] - t_to
+                    if bound > best:
+                        best = bound
+                l_to_v = from_landmark[base + i]
+                if l_to_v != INF:
+                    bound = l_to_t - l_to_v
+                    if bound > best:
+                        best = bound
+            return best
+        return h
+
+
+def _distances_from(context: QueryContext, source: int, reverse: bool) -> array:
+    """Full single-source Dijkstra distances, on the reversed graph if asked."""
+    graph = context.graph.reversed() if reverse else context.graph
+    scratch = context.acquire_scratch()
+    try:
+        search_kernels.dijkstra(graph.offsets, graph.targets, graph.weights,
+                                source, search_kernels.NO_GOAL, scratch)
+        return array('d', scratch.dist)
+    finally:
+        context.release_scratch(scratch)
+
+
+def _farthest_candidate(context: QueryContext, table: LandmarkTable, rng: random.Random) -> Optional[int]:
+    """The vertex whose distance from its nearest landmark (in either
+    direction) is largest; vertices no landmark reaches are taken first."""
+    vertex_count = context.graph.vertex_count()
+    k = len(table.landmarks)
+    if k == 0:
+        root = rng.randrange(vertex_count)
+        distances = _distances_from(context, root, reverse=False)
+        reachable = [v for v in range(vertex_count) if distances[v] != INF]
+        return max(reachable, key=lambda v: distances[v])
+    chosen = set(table.landmarks)
+    best_vertex, best_score = None, -1.0
+    for v in range(vertex_count):
+        if v in chosen:
+            continue
+        score = INF
+        for i in range(k):
+            a, b = table.from_landmark[v * k + i], table.to_landmark[v * k + i]
+            score = min(score, a + b if a != INF and b != INF else min(a, b))
+        if score > best_score:
+            best_vertex, best_score = v, score
+    return best_vertex
+
+
+def _avoid_candidate(context: QueryContext, table: LandmarkTable, rng: random.Random) -> Optional[int]:
+    """Goldberg & Harrelson's avoid heuristic, see the module notes."""
+    graph = context.graph
+    vertex_count = graph.vertex_count()
+    chosen = set(table.landmarks)
+    candidates = [v for v in range(vertex_count) if v not in chosen]
+    if not candidates:
+        return None
+    root = rng.choice(candidates)
+    scratch = context.acquire_scratch()
+    try:
+        search_kernels.dijkstra(graph.offsets, graph.targets, graph.weights,
+                                root, search_kernels.NO_GOAL, scratch)
+        dist = array('d', scratch.dist)
+        parent = array('q', scratch.parent)
+    finally:
+        context.release_scratch(scratch)
+
+    reached = sorted((v for v in range(vertex_count) if dist[v] != INF), key=lambda v: dist[v])
+    size = [0.0] * vertex_count
+    has_landmark = bytearray(vertex_count)
+    children: List[List[int]] = [[] for _ in range(vertex_count)]
+    for v in reached:
+        if parent[v] != -1:
+            children[parent[v]].append(v)
+    # Leaves first: fold each vertex's weight and landmark flag into its parent.
+    for v in reversed(reached):
+        size[v] += dist[v] - (table.lower_bound(root, v) if table.landmarks else 0.0)
+        if v in chosen:
+            has_landmark[v] = 1
+        if has_landmark[v]:
+            size[v] = 0.0
+        p = parent[v]
+        if p != -1:
+            size[p] += size[v]
+            has_landmark[p] |= has_landmark[v]
+
+    vertex = root
+    while True:
+        open_children = [c for c in children[vertex] if not has_landmark[c]]
+        if not open_children:
+            break
+        vertex = max(open_children, key=lambda c: size[c])
+    return vertex if vertex not in chosen else None
+
+
+class ALTAlgorithm(IAlgorithm):
+    """A* with landmark (ALT) lower bounds."""
+
+    def __init__(self, landmark_count: int = 8, strategy: str = "avoid", seed: int = 0,
+                 table: Optional[LandmarkTable] = None) -> None:
+        """Constructor for the algorithm.
+            Args:
+                landmark_count: Landmarks to select when a table is built.
+                strategy: Landmark selection strategy, "farthest" or "avoid".
+                seed: Seed for landmark selection.
+                table: Optional prebuilt table. A table is (re)built
+                automatically whenever the searched graph changes version.
+            Returns:
+                None
+        """
+        self.landmark_count = landmark_count
+        self.strategy = strategy
+        self.seed = seed
+        self.table = table
+
+    @probe_queries
+    def find_path(self, graph: IGraph, start_vertex_name: str, destination_vertex_name: str) -> AlgorithmResult:
+        """
+        Runs A* with the ALT heuristic, taking the max of the landmark
+        triangle-inequality bounds and the haversine bound.
+
+        Args:
+            graph: The graph to search.
+            start_vertex_name: The name of the starting vertex.
+            destination_vertex_name: The name of the destination vertex.
+        Returns:
+            AlgorithmResult containing path details and performance metrics.
+        """
+        start_time = time.time()
+        context = get_query_context(graph)
+        compact = context.graph
+        start = compact.vertex_id(start_vertex_name)
+        goal = compact.vertex_id(destination_vertex_name)
+        if start is None or goal is None:
+            return AlgorithmResult(
+                textual_directions="Start/destination vertex not found.",
+                total_distance=0.0,
+                vertices_explored=0,
+                edges_evaluated=0,
+                execution_time=time.time() - start_time,
+                path_found=False
+            )
+        if self.table is None or self.table.graph is not compact:
+            self.table = LandmarkTable.build(graph, self.landmark_count, self.strategy, self.seed)
+
+        h = self.table.heuristic(context, start, goal)
+        scratch = context.acquire_scratch()
+        try:
+            outcome = active_kernels().astar(compact.offsets, compact.targets, compact.weights,
+                                            start, goal, h, scratch)
+            if not outcome.found:
+                return AlgorithmResult(
+                    textual_directions="No path found.",
+                    total_distance=0.0,
+                    vertices_explored=outcome.vertices_explored,
+                    edges_evaluated=outcome.edges_evaluated,
+                    execution_time=time.time() - start_time,
+                    path_found=False
+                )
+            return AlgorithmResult(
+                textual_directions=" -> ".join(compact.names[v] for v in scratch.path_to(goal)),
+                total_distance=outcome.distance,
+                vertices_explored=outcome.vertices_explored,
+                edges_evaluated=outcome.edges_evaluated,
+                execution_time=time.time() - start_time,
+                path_found=True
+            )
+        finally:
+            context.release_scratch(scratch)
+
+    def get_name(self) -> str:
+        return "ALT (A* with Landmarks)"
@@ -0,0 +1,323 @@
+from __future__ import annotations
+from array import array
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, ProcessPoolExecutor, wait
+from multiprocessing import shared_memory
+from typing import Dict, Iterable, Iterator, List, Optional, Sequence, Set, Tuple
+import argparse
+import json
+import os
+import random
+import struct
+import time
+
+from graph_interfaces import IAlgorithm, IGraph, AlgorithmResult
+from compact_graph import CompactGraph
+from algorithms import DijkstraAlgorithm, greedyBestFirstAlgorithm, AStarAlgorithm
+
+"""
+Multi-process query execution.
+
+The search kernels are pure Python, so one process only ever uses one core.
+ParallelQueryExecutor spreads a batch of (start, destination) queries over a
+pool of worker processes without pickling the graph for every task:
+
+1. The CSR arrays of the graph (plus its vertex names, coordinates and
+   highways) are copied once into a single multiprocessing.shared_memory block.
+2. Each worker attaches to that block in its initializer and builds a
+   CompactGraph whose arrays are zero-copy memoryviews onto the shared pages.
+3. Queries are cut into chunks of chunk_size pairs; a task only carries its
+   chunk of names and sends back a list of AlgorithmResults.
+
+Results can be streamed back in submission order (map) or as soon as each
+chunk finishes (as_completed). Only a bounded number of chunks is in flight at
+once, so arbitrarily long query iterators do not pile up in memory.
+
+Shared block layout (all native byte order):
+
+    header   6 x int64: vertex count, edge count, name byte count, highway
+             count H, highway byte count, 1 reserved
+    offsets  int64[V + 1]
+    targets  int64[E]
+    weights  float64[E]
+    lat/lon  float64[V] each
+    names    int64[V + 1] byte offsets
+    highways int64[H + 1] byte offsets
+    edge highways  int32[E], index into the highway table (-1 when unknown)
+    then the UTF-8 name bytes and the UTF-8 highway bytes
+"""
+
+DEFAULT_ALGORITHMS: Dict[str, IAlgorithm] = {
+    "dijkstra": DijkstraAlgorithm(),
+    "greedy": greedyBestFirstAlgorithm(),
+    "astar": AStarAlgorithm(),
+}
+
+_HEADER = struct.Struct('6q')
+
+Query = Tuple[str, str]
+
+
+class SharedGraph:
+    """Class that owns a CompactGraph copied into shared memory."""
+
+    def __init__(self, graph: CompactGraph) -> None:
+        """Constructor that copies the graph into a new shared memory block.
+            Args:
+                graph: The graph to share with worker processes.
+            Returns:
+                None
+        """
+        name_offsets, name_blob = _encode_strings(graph.names)
+        highway_offsets, highway_blob = _encode_strings(graph.highways)
+        # The int32 section comes after every 8-byte one so all stay aligned.
+        sections = [
+            array('q', graph.offsets), array('q', graph.targets), array('d', graph.weights),
+            array('d', graph.latitudes), array('d', graph.longitudes), name_offsets,
+            highway_offsets, array('i', graph.edge_highways),
+        ]
+        size = (_HEADER.size + sum(len(section) * section.itemsize for section in sections)
+                + len(name_blob) + len(highway_blob))
+        self.shm = shared_memory.SharedMemory(create=True, size=max(size, 1))
+        buffer = self.shm.buf
+        _HEADER.pack_into(buffer, 0, graph.vertex_count(), graph.edge_count(), len(name_blob),
+                          len(graph.highways), len(highway_blob), 0)
+        position = _HEADER.size
+        for raw in [section.tobytes() for section in sections] + [name_blob, highway_blob]:
+            buffer[position:position + len(raw)] = raw
+            position += len(raw)
+
+    @property
+    def name(self) -> str:
+        """Get the name workers use to attach to the shared block."""
+        return self.shm.name
+
+    def close(self) -> None:
+        """Release and unlink the shared block.
+            Args:
+                None
+            Returns:
+                None
+        """
+        self.shm.close()
+        self.shm.unlink()
+
+
+def attach_shared_graph(shm: shared_memory.SharedMemory) -> CompactGraph:
+    """Build a CompactGraph whose arrays are views onto a SharedGraph block.
+    The caller must keep shm open for as long as the graph is used.
+        Args:
+            shm: The attached shared memory block.
+        Returns:
+            A CompactGraph backed by the shared pages.
+    """
+    buffer = shm.buf
+    vertex_count, edge_count, name_size, highway_count, highway_size = _HEADER.unpack_from(buffer, 0)[:5]
+    position = _HEADER.size
+
+    def take(count: int, code: str) -> memoryview:
+        nonlocal position
+        end = position + count * struct.calcsize(code)
+        view = buffer[position:end].cast(code)
+        position = end
+        return view
+
+    offsets = take(vertex_count + 1, 'q')
+    targets = take(edge_count, 'q')
+    weights = take(edge_count, 'd')
+    latitudes = take(vertex_count, 'd')
+    longitudes = take(vertex_count, 'd')
+    name_offsets = take(vertex_count + 1, 'q')
+    highway_offsets = take(highway_count + 1, 'q')
+    edge_highways = take(edge_count, 'i')
+    names = _decode_strings(bytes(take(name_size, 'B')), name_offsets)
+    highways = _decode_strings(bytes(take(highway_size, 'B')), highway_offsets)
+    return CompactGraph(names, offsets, targets, weights, latitudes, longitudes, highways, edge_highways)
+
+
+def _encode_strings(strings: Sequence[str]) -> Tuple[array, bytes]:
+    encoded = [string.encode('utf-8') for string in strings]
+    offsets = array('q', [0])
+    for string in encoded:
+        offsets.append(offsets[-1] + len(string))
+    return offsets, b''.join(encoded)
+
+def _decode_strings(blob: bytes, offsets: Sequence[int]) -> List[str]:
+    return [blob[offsets[i]:offsets[i + 1]].decode('utf-8') for i in range(len(offsets) - 1)]
+
+
+# Per-process worker state, set once by _init_worker.
+_worker_shm: Optional[shared_memory.SharedMemory] = None
+_worker_graph: Optional[CompactGraph] = None
+_worker_algorithms: Dict[str, IAlgorithm] = {}
+
+def _init_worker(shm_name: str, algorithms: Dict[str, IAlgorithm]) -> None:
+    global _worker_shm, _worker_graph, _worker_algorithms
+    _worker_shm = shared_memory.SharedMemory(name=shm_name)
+    _worker_graph = attach_shared_graph(_worker_shm)
+    _worker_algorithms = algorithms
+
+def _run_chunk(algorithm_key: str, first_index: int, queries: List[Query]) -> Tuple[int, List[AlgorithmResult]]:
+    algorithm = _worker_algorithms[algorithm_key]
+    return first_index, [algorithm.find_path(_worker_graph, start, destination) for start, destination in queries]
+
+
+class ParallelQueryExecutor:
+    """Class for running batches of path queries on a pool of processes."""
+
+    def __init__(self, graph: IGraph, workers: Optional[int] = None, chunk_size: int = 256,
+                 algorithms: Optional[Dict[str, IAlgorithm]] = None) -> None:
+        """Constructor that shares the graph and starts the worker pool.
+            Args:
+                graph: The graph every query runs against.
+                workers: Number of worker processes (default: os.cpu_count()).
+                chunk_size: Number of queries sent to a worker per task.
+                algorithms: Algorithms workers can run, by key (default:
+                "dijkstra", "greedy" and "astar"). Sent to each worker once.
+            Returns:
+                None
+        """
+        compact = graph if isinstance(graph, CompactGraph) else CompactGraph.from_graph(graph)
+        self.workers = workers or os.cpu_count() or 1
+        self.chunk_size = chunk_size
+        self.algorithms = dict(algorithms or DEFAULT_ALGORITHMS)
+        self._shared = SharedGraph(compact)
+        self._pool = ProcessPoolExecutor(max_workers=self.workers, initializer=_init_worker,
+                                         initargs=(self._shared.name, self.algorithms))
+
+    def __enter__(self) -> ParallelQueryExecutor:
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def close(self) -> None:
+        """Stop the workers and free the shared graph.
+            Args:
+                None
+            Returns:
+                None
+        """
+        self._pool.shutdown(wait=True)
+        self._shared.close()
+
+    def map(self, queries: Iterable[Query], algorithm: str = "dijkstra") -> Iterator[AlgorithmResult]:
+        """Run queries in parallel and yield results in the order given.
+            Args:
+                queries: (start name, destination name) pairs.
+                algorithm: Key of the algorithm to run.
+            Returns:
+                Iterator of AlgorithmResult, one per query, in input order.
+        """
+        self._check_algorithm(algorithm)
+        pending: deque[Future] = deque()
+        for first_index, chunk in self._chunks(queries):
+            if len(pending) >= self._max_in_flight:
+                yield from pending.popleft().result()[1]
+            pending.append(self._pool.submit(_run_chunk, algorithm, first_index, chunk))
+        while pending:
+            yield from pending.popleft().result()[1]
+
+    def as_completed(self, queries: Iterable[Query],
+                     algorithm: str = "dijkstra") -> Iterator[Tuple[int, AlgorithmResult]]:
+        """Run queries in parallel and yield results as soon as their chunk
+        finishes.
+            Args:
+                queries: (start name, destination name) pairs.
+                algorithm: Key of the algorithm to run.
+            Returns:
+                Iterator of (query index, AlgorithmResult) pairs in completion order.
+        """
+        self._check_algorithm(algorithm)
+        pending: Set[Future] = set()
+        for first_index, chunk in self._chunks(queries):
+            if len(pending) >= self._max_in_flight:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield from _indexed(future)
+            pending.add(self._pool.submit(_run_chunk, algorithm, first_index, chunk))
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield from _indexed(future)
+
+    @property
+    def _max_in_flight(self) -> int:
+        return 2 * self.workers
+
+    def _check_algorithm(self, algorithm: str) -> None:
+        if algorithm not in self.algorithms:
+            raise ValueError(f"Unknown algorithm: {algorithm}")
+
+    def _chunks(self, queries: Iterable[Query]) -> Iterator[Tuple[int, List[Query]]]:
+        """Cut the query stream into (index of first query, chunk) pairs."""
+        chunk: List[Query] = []
+        first_index = 0
+        for query in queries:
+            chunk.append(query)
+            if len(chunk) == self.chunk_size:
+                yield first_index, chunk
+                first_index += len(chunk)
+                chunk = []
+        if chunk:
+            yield first_index, chunk
+
+
+def _indexed(future: Future) -> Iterator[Tuple[int, AlgorithmResult]]:
+    first_index, results = future.result()
+    for offset, result in enumerate(results):
+        yield first_index + offset, result
+
+
+def scaling_benchmark(graph: IGraph, queries: Sequence[Query], max_workers: Optional[int] = None,
+                      algorithm: str = "dijkstra", chunk_size: int = 256) -> List[dict]:
+    """Time the same query batch with 1..max_workers worker processes.
+        Args:
+            graph: The graph to query.
+            queries: The (start, destination) pairs to run.
+            max_workers: Largest pool size to try (default: os.cpu_count()).
+            algorithm: Key of the algorithm to run.
+            chunk_size: Queries per task.
+        Returns:
+            One dict per pool size with workers, seconds, queries_per_second
+            and speedup relative to a single worker. Pool start-up is not timed.
+    """
+    max_workers = max_workers or os.cpu_count() or 1
+    rows = []
+    baseline = None
+    for workers in range(1, max_workers + 1):
+        with ParallelQueryExecutor(graph, workers=workers, chunk_size=chunk_size) as executor:
+            # Warm up every worker so process start-up is excluded.
+            list(executor.map(queries[:workers * chunk_size], algorithm))
+            start = time.perf_counter()
+            count = sum(1 for _ in executor.map(queries, algorithm))
+            seconds = time.perf_counter() - start
+        baseline = baseline or seconds
+        rows.append({
+            "workers": workers,
+            "queries": count,
+            "seconds": seconds,
+            "queries_per_second": count / seconds if seconds else float('inf'),
+            "speedup": baseline / seconds if seconds else float('inf'),
+        })
+    return rows
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Parallel query scaling benchmark.")
+    parser.add_argument("--graph", default="graph_v2.txt")
+    parser.add_argument("--vertices", default="vertices_v1.txt")
+    parser.add_argument("--queries", type=int, default=20000)
+    parser.add_argument("--max-workers", type=int, default=None)
+    parser.add_argument("--algorithm", default="dijkstra", choices=sorted(DEFAULT_ALGORITHMS))
+    parser.add_argument("--seed", type=int, default=351)
+    args = parser.parse_args()
+
+    graph = CompactGraph.from_files(args.graph, args.vertices)
+    rng = random.Random(args.seed)
+    queries = [(rng.choice(graph.names), rng.choice(graph.names)) for _ in range(args.queries)]
+    for row in scaling_benchmark(graph, queries, args.max_workers, args.algorithm):
+        print(json.dumps(row))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,315 @@
+from __future__ import annotations
+from array import array
+from collections import OrderedDict
+from dataclasses import dataclass, replace
+from typing import Dict, Hashable, List, Optional, Tuple
+import sys
+import threading
+import time
+import weakref
+
+from graph_interfaces import IAlgorithm, IGraph, AlgorithmResult
+from compact_graph import CompactGraph
+from query_context import get_query_context
+from algorithms import DijkstraAlgorithm
+import search_kernels
+from instrumentation import active_kernels, probe_queries
+
+"""
+Shortest-path result caching.
+
+CachedAlgorithm wraps any IAlgorithm and remembers its AlgorithmResults in an
+LRU map keyed by (graph, graph version, start, destination); each wrapper
+caches one algorithm, so the algorithm is implied by the wrapper. The map is
+bounded both by entry count and by an estimate of the bytes held, which also
+counts the Dijkstra trees described below.
+
+Entries never go stale: Graph.get_version() changes on add_edge, remove_edge,
+Edge.set_weight, vertex removal and every other mutation, and the first query
+that sees a new version drops every entry cached for the older one. Graphs
+without get_version() cannot be tracked, so their queries bypass the cache.
+
+When the wrapped algorithm is DijkstraAlgorithm, a miss grows the complete
+shortest-path tree of the origin once and keeps it (in a second, smaller LRU).
+Any later destination from the same origin is then read off the tree. Since a
+full Dijkstra settles vertices in exactly the order a goal-directed one would,
+the tree also records each vertex's settle rank, so the vertices explored and
+edges evaluated reported for a tree answer are identical to what running
+DijkstraAlgorithm would have reported.
+"""
+
+RESULT_OVERHEAD_BYTES = 200
+# A tree holds four 8-byte arrays indexed by vertex id (see size_bytes).
+TREE_BYTES_PER_VERTEX = 32
+
+
+@dataclass
+class CacheStats:
+    # tree_hits counts the misses that were answered from a cached tree.
+    hits: int = 0
+    misses: int = 0
+    tree_hits: int = 0
+    evictions: int = 0
+    invalidations: int = 0
+    entries: int = 0
+    trees: int = 0
+    bytes: int = 0
+
+    @property
+    def hit_rate(self) -> float:
+        """Get the fraction of lookups answered without a new search."""
+        lookups = self.hits + self.misses
+        return (self.hits + self.tree_hits) / lookups if lookups else 0.0
+
+
+@dataclass
+class _ShortestPathTree:
+    graph: CompactGraph
+    dist: array
+    parent: array
+    settle_rank: array
+    edges_before: array
+    settled: int
+    edges_total: int
+
+    def size_bytes(self) -> int:
+        return sum(a.buffer_info()[1] * a.itemsize
+                   for a in (self.dist, self.parent, self.settle_rank, self.edges_before))
+
+
+class CachedAlgorithm(IAlgorithm):
+    """IAlgorithm wrapper that caches results of another IAlgorithm."""
+
+    def __init__(self, algorithm: IAlgorithm, max_entries: int = 10000, max_bytes: int = 64 * 1024 * 1024,
+                 reuse_dijkstra_trees: bool = True, max_trees: int = 16) -> None:
+        """Constructor for the cache.
+            Args:
+                algorithm: The algorithm whose results are cached.
+                max_entries: Maximum number of cached results.
+                max_bytes: Approximate memory budget for cached results and
+                shortest-path trees together.
+                reuse_dijkstra_trees: Answer Dijkstra misses from per-origin
+                shortest-path trees.
+                max_trees: Maximum number of shortest-path trees kept.
+            Returns:
+                None
+        """
+        self.algorithm = algorithm
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.max_trees = max_trees
+        self.reuse_trees = (reuse_dijkstra_trees and isinstance(algorithm, DijkstraAlgorithm)
+                            and algorithm.profile is None)
+        self._entries: OrderedDict[Hashable, Tuple[AlgorithmResult, int]] = OrderedDict()
+        self._trees: OrderedDict[Hashable, _ShortestPathTree] = OrderedDict()
+        self._versions: Dict[int, int] = {}
+        self._stats = CacheStats()
+        self._result_bytes = 0
+        self._tree_bytes = 0
+        self._lock = threading.RLock()
+
+    @probe_queries
+    def find_path(self, graph: IGraph, start_vertex_name: str, destination_vertex_name: str) -> AlgorithmResult:
+        """
+        Returns the cached result for this query when there is one for the
+        graph's current version, otherwise runs the wrapped algorithm (or reads
+        the origin's Dijkstra tree) and caches the answer.
+
+        Args:
+            graph: The graph to search.
+            start_vertex_name: The name of the starting vertex.
+            destination_vertex_name: The name of the destination vertex.
+        Returns:
+            AlgorithmResult containing path details and performance metrics.
+        """
+        start_time = time.time()
+        version = _graph_version(graph)
+        if version is None:
+            with self._lock:
+                self._stats.misses += 1
+            return self.algorithm.find_path(graph, start_vertex_name, destination_vertex_name)
+
+        graph_key = id(graph)
+        key = (graph_key, version, start_vertex_name, destination_vertex_name)
+        with self._lock:
+            self._track(graph, graph_key, version)
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self._stats.hits += 1
+                return replace(entry[0], execution_time=time.time() - start_time)
+            self._stats.misses += 1
+
+        result = None
+        if self.reuse_trees:
+            result = self._from_tree(graph, graph_key, version, start_vertex_name,
+                                     destination_vertex_name, start_time)
+        if result is None:
+            result = self.algorithm.find_path(graph, start_vertex_name, destination_vertex_name)
+        with self._lock:
+            self._store(key, result)
+        return result
+
+    def get_name(self) -> str:
+        return f"Cached {self.algorithm.get_name()}"
+
+    def stats(self) -> CacheStats:
+        """Get a snapshot of the cache counters.
+            Args:
+                None
+            Returns:
+                CacheStats with hit/miss/eviction counts and current size.
+        """
+        with self._lock:
+            return replace(self._stats, entries=len(self._entries), trees=len(self._trees),
+                           bytes=self._result_bytes + self._tree_bytes)
+
+    def clear(self) -> None:
+        """Drop every cached result and tree.
+            Args:
+                None
+            Returns:
+                None
+        """
+        with self._lock:
+            self._entries.clear()
+            self._trees.clear()
+            self._result_bytes = 0
+            self._tree_bytes = 0
+
+    def _track(self, graph: IGraph, graph_key: int, version: int) -> None:
+        """Purge a graph's entries when its version moves on."""
+        known = self._versions.get(graph_key)
+        if known == version:
+            return
+        if known is None:
+            # Forget the graph's entries when it is garbage collected, so a new
+            # graph that reuses its id() can never see them.
+            weakref.finalize(graph, self._forget, graph_key)
+        else:
+            self._forget(graph_key, count_invalidations=True)
+        self._versions[graph_key] = version
+
+    def _forget(self, graph_key: int, count_invalidations: bool = False) -> None:
+        with self._lock:
+            stale = [key for key in self._entries if key[0] == graph_key]
+            for key in stale:
+                self._result_bytes -= self._entries.pop(key)[1]
+            for key in [key for key in self._trees if key[0] == graph_key]:
+                self._tree_bytes -= self._trees.pop(key).size_bytes()
+            if count_invalidations:
+                self._stats.invalidations += len(stale)
+            else:
+                self._versions.pop(graph_key, None)
+
+    def _store(self, key: Hashable, result: AlgorithmResult) -> None:
+        if key in self._entries:
+            return
+        size = RESULT_OVERHEAD_BYTES + sys.getsizeof(result.textual_directions)
+        self._entries[key] = (result, size)
+        self._result_bytes += size
+        self._evict()
+
+    def _store_tree(self, tree_key: Hashable, tree: _ShortestPathTree) -> None:
+        if tree_key in self._trees:
+            return
+        self._trees[tree_key] = tree
+        self._tree_bytes += tree.size_bytes()
+        self._evict()
+
+    def _evict(self) -> None:
+        """Drop least recently used trees, then results, until both the
+        count limits and the shared byte budget hold. Trees go first: one
+        tree takes as much memory as thousands of results."""
+        while self._trees and (len(self._trees) > self.max_trees
+                               or self._result_bytes + self._tree_bytes > self.max_bytes):
+            _, tree = self._trees.popitem(last=False)
+            self._tree_bytes -= tree.size_bytes()
+        while self._entries and (len(self._entries) > self.max_entries
+                                 or self._result_bytes + self._tree_bytes > self.max_bytes):
+            _, (_, evicted_size) = self._entries.popitem(last=False)
+            self._result_bytes -= evicted_size
+            self._stats.evictions += 1
+
+    def _from_tree(self, graph: IGraph, graph_key: int, version: int, start_vertex_name: str,
+                   destination_vertex_name: str, start_time: float) -> Optional[AlgorithmResult]:
+        """Answer a Dijkstra query from the origin's shortest-path tree,
+        growing the tree first if it is not cached. Returns None when either
+        vertex is unknown so the wrapped algorithm reports it, and when a tree
+        would not fit in max_bytes: it would be evicted as soon as it was
+        stored, and every miss would pay for a full Dijkstra."""
+        context = get_query_context(graph)
+        compact = context.graph
+        if TREE_BYTES_PER_VERTEX * compact.vertex_count() > self.max_bytes:
+            return None
+        start = compact.vertex_id(start_vertex_name)
+        goal = compact.vertex_id(destination_vertex_name)
+        if start is None or goal is None:
+            return None
+
+        tree_key = (graph_key, version, start)
+        with self._lock:
+            tree = self._trees.get(tree_key)
+            if tree is not None:
+                self._trees.move_to_end(tree_key)
+                self._stats.tree_hits += 1
+        if tree is None:
+            tree = _grow_tree(context, start)
+            with self._lock:
+                self._store_tree(tree_key, tree)
+
+        rank = tree.settle_rank[goal]
+        if rank == -1:
+            return AlgorithmResult(
+                textual_directions="No path found.",
+                total_distance=0.0,
+                vertices_explored=tree.settled,
+                edges_evaluated=tree.edges_total,
+                execution_time=time.time() - start_time,
+                path_found=False
+            )
+        path: List[str] = []
+        vertex = goal
+        while vertex != -1:
+            path.append(compact.names[vertex])
+            vertex = tree.parent[vertex]
+        path.reverse()
+        return AlgorithmResult(
+            textual_directions=" -> ".join(path),
+            total_distance=tree.dist[goal],
+            vertices_explored=rank + 1,
+            edges_evaluated=tree.edges_before[goal],
+            execution_time=time.time() - start_time,
+            path_found=True
+        )
+
+
+def _grow_tree(context, start: int) -> _ShortestPathTree:
+    compact = context.graph
+    vertex_count = compact.vertex_count()
+    order: List[int] = []
+    scratch = context.acquire_scratch()
+    try:
+        outcome = active_kernels().dijkstra(compact.offsets, compact.targets, compact.weights,
+                                            start, search_kernels.NO_GOAL, scratch, order)
+        dist = array('d', scratch.dist)
+        parent = array('q', scratch.parent)
+    finally:
+        context.release_scratch(scratch)
+    settle_rank = array('q', [-1]) * vertex_count
+    edges_before = array('q', [0]) * vertex_count
+    offsets = compact.offsets
+    evaluated = 0
+    for rank, vertex in enumerate(order):
+        settle_rank[vertex] = rank
+        edges_before[vertex] = evaluated
+        evaluated += offsets[vertex + 1] - offsets[vertex]
+    return _ShortestPathTree(compact, dist, parent, settle_rank, edges_before,
+                             outcome.vertices_explored, outcome.edges_evaluated)
+
+
+def _graph_version(graph: IGraph) -> Optional[int]:
+    if isinstance(graph, CompactGraph):
+        return 0
+    get_version = getattr(graph, 'get_version', None)
+    return get_version() if get_version is not None else None
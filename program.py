@@ -3,10 +3,10 @@ from graph_interfaces import IGraph, IVertex
 from graph_impl import Graph, Vertex, Edge
 import csv
 from collections import deque
-from graph_interfaces import IAlgorithm
-from graph_interfaces import AlgorithmResult
 from graph_interfaces import IGraph, IVertex
 from algorithms import DijkstraAlgorithm, greedyBestFirstAlgorithm, AStarAlgorithm
+from algorithms import BidirectionalDijkstraAlgorithm, BidirectionalAStarAlgorithm
+from spatial_index import Endpoint, SnappedAlgorithm
 
 def read_graph(graph_file_path: str, vertices_file_path: str = "vertices_v1.txt") -> IGraph:  
     """Read the graph and vertex coordinates from the files and 
@@ -50,23 +50,43 @@ def read_graph(graph_file_path: str, vertices_file_path: str = "vertices_v1.txt"
                 v_destination = Vertex(destination, lat, lon)
                 vertices[destination] = v_destination
                 graph.add_vertex(v_destination)
-            edge_name = f"{source}->{destination}"
-            edge = Edge(edge_name, vertices[destination], distance)
+            # The edge's "source->destination" name is built when it is added.
+            edge = Edge(None, vertices[destination], distance, highway, source=vertices[source])
             graph.add_edge(edge)
     return graph
 
 
+def parse_endpoint(text: str) -> Endpoint:
+    """Read a city name, or a "latitude, longitude" pair to snap to the
+    nearest city.
+        Args:
+            text: What the user typed.
+        Returns:
+            The city name, or a (latitude, longitude) tuple.
+    """
+    parts = text.split(',')
+    if len(parts) == 2:
+        try:
+            return (float(parts[0]), float(parts[1]))
+        except ValueError:
+            pass
+    return text
+
 def main() -> None:
     graph: IGraph = read_graph("graph_v2.txt", "vertices_v1.txt")
     algorithms = {
         "1": DijkstraAlgorithm(),
         "2": greedyBestFirstAlgorithm(),
-        "3": AStarAlgorithm()
+        "3": AStarAlgorithm(),
+        "4": BidirectionalDijkstraAlgorithm(),
+        "5": BidirectionalAStarAlgorithm()
     }
     algo_names = {
         "1": "Dijkstra's Algorithm",
         "2": "Greedy Best-First Search",
-        "3": "A* Algorithm"
+        "3": "A* Algorithm",
+        "4": "Bidirectional Dijkstra's Algorithm",
+        "5": "Bidirectional A* Algorithm"
     }
 
     print("Welcome to the Oregon Pathfinder!")
@@ -75,17 +95,23 @@ def main() -> None:
         print("1. Dijkstra's Algorithm")
         print("2. Greedy Best-First Search")
         print("3. A* Algorithm")
-        choice = input("Enter choice (1-3): ").strip()
+        print("4. Bidirectional Dijkstra's Algorithm")
+        print("5. Bidirectional A* Algorithm")
+        choice = input("Enter choice (1-5): ").strip()
         if choice not in algorithms:
-            print("Invalid choice. Please enter 1, 2, or 3.")
+            print("Invalid choice. Please enter 1, 2, 3, 4, or 5.")
             continue
 
-        start_city = input("\nEnter start city: ").strip()
-        dest_city = input("Enter destination city: ").strip()
+        start_city = parse_endpoint(input("\nEnter start city (or latitude, longitude): ").strip())
+        dest_city = parse_endpoint(input("Enter destination city (or latitude, longitude): ").strip())
 
         print(f"\nRunning {algo_names[choice]}...\n")
-        algorithm: IAlgorithm = algorithms[choice]
-        result: AlgorithmResult = algorithm.find_path(graph, start_city, dest_city)
+        algorithm = SnappedAlgorithm(algorithms[choice])
+        result = algorithm.find_path(graph, start_city, dest_city)
+        for point, city, miles in ((start_city, result.start_vertex, result.start_snap_distance),
+                                   (dest_city, result.destination_vertex, result.destination_snap_distance)):
+            if not isinstance(point, str) and city:
+                print(f"Snapped {point} to {city} ({miles:.1f} miles away)")
 
         if result.path_found:
             print(f"Path found: {result.textual_directions.replace('->', '→')}")
@@ -0,0 +1,148 @@
+from __future__ import annotations
+from typing import Callable, List, Optional
+import threading
+import weakref
+
+from graph_interfaces import IGraph
+from compact_graph import CompactGraph
+from coordinates import CoordinateStore
+from search_kernels import SearchScratch
+
+"""
+Prepared per-graph query state.
+
+Building the name index and CSR arrays for a graph costs O(V + E). A
+QueryContext does that once per graph version and is then shared by every
+algorithm that searches the same graph, together with the coordinates
+prepared for the heuristic (coordinates.py) and a pool of reusable SearchScratch
+arrays. get_query_context(graph) hands out the cached context and rebuilds it
+only when graph.get_version() has moved on, i.e. after add_vertex,
+remove_vertex, add_edge, remove_edge, or an edge weight / coordinate change
+on a graph_impl.Graph.
+
+Graphs that do not expose get_version() cannot be tracked, so they get a
+fresh context on every call. A CompactGraph is frozen and is treated as
+version 0 forever.
+"""
+
+class QueryContext:
+    """Class for the search state prepared once per graph version."""
+
+    def __init__(self, graph: CompactGraph, version: int) -> None:
+        """Constructor for the query context.
+            Args:
+                graph: The CSR form of the graph being searched.
+                version: The graph version the context was built from.
+            Returns:
+                None
+        """
+        self.graph = graph
+        self.version = version
+        # The coordinate store is built on the first heuristic() call, so
+        # contexts for searches that never need it (Dijkstra, a freshly
+        # memory-mapped snapshot) cost nothing to create.
+        self._coordinates: Optional[CoordinateStore] = None
+        self._spatial_index = None
+        self._haversine_consistent: Optional[bool] = None
+        self._scratch_pool: List[SearchScratch] = []
+
+    @property
+    def coordinates(self) -> CoordinateStore:
+        """Get the graph's coordinates in radians, built on first use."""
+        if self._coordinates is None:
+            self._coordinates = CoordinateStore(self.graph.latitudes, self.graph.longitudes)
+        return self._coordinates
+
+    @property
+    def spatial_index(self):
+        """Get the nearest-vertex index over the graph's coordinates, built on
+        first use (spatial_index.SpatialIndex)."""
+        if self._spatial_index is None:
+            from spatial_index import SpatialIndex
+            self._spatial_index = SpatialIndex(self.graph.latitudes, self.graph.longitudes)
+        return self._spatial_index
+
+    @property
+    def haversine_consistent(self) -> bool:
+        """Check, once per graph version, whether the haversine heuristic is
+        consistent: every vertex has coordinates and no edge is shorter than
+        the great-circle distance between its ends. A* stays optimal either
+        way, but potentials that cannot reopen vertices (bidirectional A*)
+        need this."""
+        if self._haversine_consistent is None:
+            coordinates = self.coordinates
+            consistent = coordinates.has_all_coordinates
+            if consistent:
+                graph = self.graph
+                offsets, targets, weights = graph.offsets, graph.targets, graph.weights
+                haversine = coordinates.haversine
+                consistent = all(weights[e] >= haversine(u, targets[e]) - 1e-9
+                                 for u in range(graph.vertex_count()) for e in range(offsets[u], offsets[u + 1]))
+            self._haversine_consistent = consistent
+        return self._haversine_consistent
+
+    def heuristic(self, goal: int, approximate: bool = False) -> Callable[[int], float]:
+        """Get the straight-line heuristic h(v) towards goal.
+            Args:
+                goal: The goal vertex id.
+                approximate: Use the cheaper equirectangular lower bound
+                instead of the haversine distance.
+            Returns:
+                Function giving the straight-line miles from a vertex id to goal.
+        """
+        if approximate:
+            return self.coordinates.equirectangular_distances(goal)
+        return self.coordinates.goal_distances(goal)
+
+    def acquire_scratch(self) -> SearchScratch:
+        """Take a scratch space from the pool, allocating one if it is empty.
+        Every acquire should be paired with release_scratch.
+            Args:
+                None
+            Returns:
+                A SearchScratch sized for this graph.
+        """
+        try:
+            return self._scratch_pool.pop()
+        except IndexError:
+            return SearchScratch(self.graph.vertex_count())
+
+    def release_scratch(self, scratch: SearchScratch) -> None:
+        """Return a scratch space to the pool for the next query.
+            Args:
+                scratch: The scratch space obtained from acquire_scratch.
+            Returns:
+                None
+        """
+        self._scratch_pool.append(scratch)
+
+
+_contexts: "weakref.WeakKeyDictionary[IGraph, QueryContext]" = weakref.WeakKeyDictionary()
+_contexts_lock = threading.Lock()
+
+def get_query_context(graph: IGraph) -> QueryContext:
+    """Get the prepared query context for graph, building it if the graph has
+    changed since the cached one was made.
+        Args:
+            graph: The graph about to be searched.
+        Returns:
+            The QueryContext for the graph's current version.
+    """
+    if isinstance(graph, CompactGraph):
+        version = 0
+    else:
+        get_version = getattr(graph, 'get_version', None)
+        if get_version is None:
+            return QueryContext(CompactGraph.from_graph(graph), 0)
+        version = get_version()
+
+    context = _contexts.get(graph)
+    if context is not None and context.version == version:
+        return context
+    with _contexts_lock:
+        context = _contexts.get(graph)
+        if context is None or context.version != version:
+            compact = graph if isinstance(graph, CompactGraph) else CompactGraph.from_graph(graph)
+            context = QueryContext(compact, version)
+            _contexts[graph] = context
+    return context
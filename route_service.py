@@ -0,0 +1,499 @@
+from __future__ import annotations
+from concurrent.futures import Future
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Tuple
+import argparse
+import asyncio
+import itertools
+import json
+import random
+import time
+
+from graph_interfaces import IAlgorithm, AlgorithmResult
+from algorithms import ALGORITHMS
+from concurrent_queries import ConcurrentQueryExecutor, GraphStore
+from instrumentation import LatencyHistogram
+from program import read_graph
+
+"""
+Route query service.
+
+program.main answers one human at a time from a blocking input() loop. This
+module serves the same algorithms to many clients over a local TCP socket,
+speaking line-delimited JSON: one request object per line in, one response
+object per line out.
+
+    {"id": 1, "start": "Portland", "destination": "Medford", "algorithm": "astar", "deadline_ms": 500}
+    {"id": 1, "ok": true, "path_found": true, "directions": "Portland -> ...", "distance": 272.1, ...}
+    {"id": 2, "op": "stats"}
+
+A connection may send many requests without waiting; responses come back as
+each one finishes, matched by "id". How a request is served:
+
+* The event loop only parses and routes. Searches run on the thread pool of a
+  concurrent_queries.ConcurrentQueryExecutor, against an immutable graph
+  version from a GraphStore, so the loop never blocks on a search and graph
+  updates never block queries.
+* Identical requests in flight at the same time (same graph version,
+  algorithm, start and destination) are coalesced: the first one starts a
+  search and the others wait on the same result.
+* Backpressure: at most max_pending searches are queued or running. A new
+  search beyond that is rejected at once with "overloaded" instead of growing
+  a queue whose wait every later request would pay. Each connection also has
+  at most max_connection_in_flight requests open; past that the service stops
+  reading from it, so TCP flow control slows the client down.
+* Every request has a deadline (deadline_ms, or default_deadline). A request
+  past its deadline is answered with "deadline exceeded". When every request
+  waiting on a search has given up and the search has not started yet, it is
+  cancelled.
+* Latency histograms (end to end per algorithm, and search time alone) are
+  returned by the "stats" request.
+
+Serve the Oregon graph, or benchmark the service with local clients:
+
+    python route_service.py serve --port 8765
+    python route_service.py query Portland Medford --port 8765
+    python route_service.py bench --clients 16 --requests 4000
+"""
+
+
+class ServiceOverloaded(RuntimeError):
+    """Raised when a search is rejected because max_pending are queued."""
+
+
+@dataclass
+class ServiceStats:
+    requests: int = 0
+    completed: int = 0
+    coalesced: int = 0
+    rejected: int = 0
+    deadline_exceeded: int = 0
+    cancelled_searches: int = 0
+    errors: int = 0
+    latency: Dict[str, LatencyHistogram] = field(default_factory=dict)
+    search: LatencyHistogram = field(default_factory=LatencyHistogram)
+
+
+class _Flight:
+    """One search in progress and the number of requests waiting on it."""
+    __slots__ = ('search', 'future', 'waiters')
+
+    def __init__(self, search: Future) -> None:
+        self.search = search
+        self.future = asyncio.wrap_future(search)
+        self.waiters = 0
+
+
+class RouteService:
+    """Class for serving path queries to many clients over asyncio."""
+
+    def __init__(self, store: GraphStore, algorithms: Optional[Dict[str, IAlgorithm]] = None,
+                 workers: Optional[int] = None, max_pending: int = 64, default_deadline: float = 2.0,
+                 max_connection_in_flight: int = 32) -> None:
+        """Constructor for the service. Call it from the event loop thread.
+            Args:
+                store: The store whose latest graph version is queried.
+                algorithms: Algorithms by key (default: algorithms.ALGORITHMS).
+                workers: Number of search threads (default: os.cpu_count()).
+                max_pending: Most searches queued or running at once.
+                default_deadline: Seconds a request may take when it does not
+                set deadline_ms.
+                max_connection_in_flight: Most open requests per connection.
+            Returns:
+                None
+        """
+        self.store = store
+        self.algorithms = dict(algorithms or ALGORITHMS)
+        self.max_pending = max_pending
+        self.default_deadline = default_deadline
+        self.max_connection_in_flight = max_connection_in_flight
+        self.stats = ServiceStats()
+        self._executor = ConcurrentQueryExecutor(store, workers, self.algorithms)
+        self._in_flight: Dict[Tuple[int, str, str, str], _Flight] = {}
+        self._servers: List[asyncio.Server] = []
+
+    async def route(self, start: str, destination: str, algorithm: str = "astar",
+                    deadline: Optional[float] = None) -> Tuple[AlgorithmResult, int, bool]:
+        """Answer one query on the latest graph version.
+            Args:
+                start: Start vertex name.
+                destination: Destination vertex name.
+                algorithm: Key of the algorithm to run.
+                deadline: Seconds the caller will wait (default:
+                default_deadline).
+            Returns:
+                The AlgorithmResult, the graph version it was computed on and
+                whether it was coalesced with an identical request.
+            Raises:
+                ValueError: Unknown algorithm or a non-positive deadline.
+                ServiceOverloaded: max_pending searches are already queued.
+                asyncio.TimeoutError: The deadline passed first.
+        """
+        if algorithm not in self.algorithms:
+            raise ValueError(f"Unknown algorithm: {algorithm}")
+        deadline = self.default_deadline if deadline is None else deadline
+        if not deadline > 0:
+            raise ValueError("deadline must be positive")
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        snapshot = self.store.snapshot()
+        key = (snapshot.version, algorithm, start, destination)
+        flight = self._in_flight.get(key)
+        coalesced = flight is not None
+        if coalesced:
+            self.stats.coalesced += 1
+        else:
+            if len(self._in_flight) >= self.max_pending:
+                self.stats.rejected += 1
+                raise ServiceOverloaded(f"{self.max_pending} searches already pending")
+            flight = self._in_flight[key] = _Flight(self._executor.submit(start, destination, algorithm, snapshot))
+            flight.future.add_done_callback(lambda done: self._finish(key, flight))
+
+        flight.waiters += 1
+        try:
+            result = await asyncio.wait_for(asyncio.shield(flight.future), deadline)
+        except asyncio.TimeoutError:
+            self.stats.deadline_exceeded += 1
+            raise
+        finally:
+            flight.waiters -= 1
+            if flight.waiters == 0 and flight.search.cancel():
+                # Nobody wants the answer any more and no worker has started
+                # the search yet.
+                self._in_flight.pop(key, None)
+        self.stats.completed += 1
+        self.stats.latency.setdefault(algorithm, LatencyHistogram()).record(loop.time() - started)
+        return result, snapshot.version, coalesced
+
+    def _finish(self, key: Tuple[int, str, str, str], flight: _Flight) -> None:
+        if self._in_flight.get(key) is flight:
+            del self._in_flight[key]
+        if flight.future.cancelled():
+            self.stats.cancelled_searches += 1
+        elif flight.future.exception() is None:
+            self.stats.search.record(flight.future.result().execution_time)
+
+    async def handle_request(self, request: dict) -> dict:
+        """Answer one decoded JSON request.
+            Args:
+                request: A route request, or {"op": "stats"}.
+            Returns:
+                The response object, echoing the request's "id".
+        """
+        self.stats.requests += 1
+        response: dict = {"id": request.get("id")} if isinstance(request, dict) else {"id": None}
+        try:
+            if not isinstance(request, dict):
+                raise ValueError("request must be a JSON object")
+            op = request.get("op", "route")
+            if op == "stats":
+                response.update(ok=True, stats=self.stats_summary())
+            elif op == "route":
+                start, destination = request.get("start"), request.get("destination")
+                if not isinstance(start, str) or not isinstance(destination, str):
+                    raise ValueError("start and destination must be strings")
+                deadline_ms = request.get("deadline_ms")
+                result, version, coalesced = await self.route(
+                    start, destination, request.get("algorithm", "astar"),
+                    None if deadline_ms is None else float(deadline_ms) / 1000)
+                response.update(
+                    ok=True,
+                    path_found=result.path_found,
+                    directions=result.textual_directions,
+                    distance=result.total_distance,
+                    vertices_explored=result.vertices_explored,
+                    edges_evaluated=result.edges_evaluated,
+                    search_ms=1000 * result.execution_time,
+                    version=version,
+                    coalesced=coalesced,
+                )
+            else:
+                raise ValueError(f"Unknown op: {op}")
+        except ServiceOverloaded:
+            response.update(ok=False, error="overloaded")
+        except asyncio.TimeoutError:
+            response.update(ok=False, error="deadline exceeded")
+        except (TypeError, ValueError) as error:
+            self.stats.errors += 1
+            response.update(ok=False, error=str(error))
+        return response
+
+    def stats_summary(self) -> dict:
+        """Get the counters and latency histograms, ready for JSON."""
+        stats = self.stats
+        return {
+            "version": self.store.snapshot().version,
+            "requests": stats.requests,
+            "completed": stats.completed,
+            "coalesced": stats.coalesced,
+            "rejected": stats.rejected,
+            "deadline_exceeded": stats.deadline_exceeded,
+            "cancelled_searches": stats.cancelled_searches,
+            "errors": stats.errors,
+            "pending": len(self._in_flight),
+            "latency": {key: histogram.summary() for key, histogram in sorted(stats.latency.items())},
+            "search": stats.search.summary(),
+        }
+
+    async def start(self, host: str = "127.0.0.1", port: int = 8765) -> asyncio.Server:
+        """Start listening for connections.
+            Args:
+                host: Interface to bind.
+                port: TCP port (0 picks a free one).
+            Returns:
+                The asyncio Server; its sockets give the bound address.
+        """
+        server = await asyncio.start_server(self._handle_connection, host, port)
+        self._servers.append(server)
+        return server
+
+    async def close(self) -> None:
+        """Stop listening and shut the search threads down.
+            Args:
+                None
+            Returns:
+                None
+        """
+        for server in self._servers:
+            server.close()
+            await server.wait_closed()
+        self._servers.clear()
+        await asyncio.get_running_loop().run_in_executor(None, self._executor.close)
+
+    async def _handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        slots = asyncio.Semaphore(self.max_connection_in_flight)
+        tasks = set()
+        try:
+            while True:
+                try:
+                    line = await reader.readline()
+                except (asyncio.LimitOverrunError, ValueError):
+                    writer.write(b'{"id": null, "ok": false, "error": "request line too long"}\n')
+                    break
+                if not line:
+                    break
+                if not line.strip():
+                    continue
+                await slots.acquire()
+                task = asyncio.create_task(self._respond(line, writer, slots))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+            if tasks:
+                await asyncio.gather(*tasks)
+        except ConnectionError:
+            pass
+        finally:
+            for task in tasks:
+                task.cancel()
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except ConnectionError:
+                pass
+
+    async def _respond(self, line: bytes, writer: asyncio.StreamWriter, slots: asyncio.Semaphore) -> None:
+        try:
+            try:
+                request = json.loads(line)
+            except ValueError as error:
+                self.stats.requests += 1
+                self.stats.errors += 1
+                response = {"id": None, "ok": False, "error": f"invalid JSON: {error}"}
+            else:
+                response = await self.handle_request(request)
+            writer.write(json.dumps(response).encode('utf-8') + b'\n')
+            await writer.drain()
+        finally:
+            slots.release()
+
+
+class RouteClient:
+    """Class for a client connection that can have many requests open."""
+
+    def __init__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        self._reader = reader
+        self._writer = writer
+        self._ids = itertools.count(1)
+        self._waiting: Dict[int, asyncio.Future] = {}
+        self._receiver = asyncio.create_task(self._receive())
+
+    @classmethod
+    async def connect(cls, host: str = "127.0.0.1", port: int = 8765) -> RouteClient:
+        """Open a connection to a RouteService.
+            Args:
+                host: Server address.
+                port: Server port.
+            Returns:
+                The connected client.
+        """
+        reader, writer = await asyncio.open_connection(host, port)
+        return cls(reader, writer)
+
+    async def request(self, payload: dict) -> dict:
+        """Send one request and wait for its response.
+            Args:
+                payload: The request object; its "id" is set by the client.
+            Returns:
+                The response object.
+        """
+        request_id = next(self._ids)
+        future = asyncio.get_running_loop().create_future()
+        self._waiting[request_id] = future
+        self._writer.write(json.dumps({**payload, "id": request_id}).encode('utf-8') + b'\n')
+        await self._writer.drain()
+        return await future
+
+    async def route(self, start: str, destination: str, algorithm: str = "astar",
+                    deadline_ms: Optional[float] = None) -> dict:
+        """Ask for a route.
+            Args:
+                start: Start vertex name.
+                destination: Destination vertex name.
+                algorithm: Key of the algorithm to run.
+                deadline_ms: Milliseconds to wait (default: the server's).
+            Returns:
+                The response object.
+        """
+        payload = {"start": start, "destination": destination, "algorithm": algorithm}
+        if deadline_ms is not None:
+            payload["deadline_ms"] = deadline_ms
+        return await self.request(payload)
+
+    async def stats(self) -> dict:
+        """Get the server's counters and latency histograms."""
+        return (await self.request({"op": "stats"}))["stats"]
+
+    async def close(self) -> None:
+        """Close the connection; open requests fail with ConnectionError."""
+        self._writer.close()
+        try:
+            await self._writer.wait_closed()
+        except ConnectionError:
+            pass
+        await self._receiver
+
+    async def _receive(self) -> None:
+        try:
+            while True:
+                line = await self._reader.readline()
+                if not line:
+                    break
+                response = json.loads(line)
+                future = self._waiting.pop(response.get("id"), None)
+                if future is not None and not future.done():
+                    future.set_result(response)
+        except ConnectionError:
+            pass
+        finally:
+            for future in self._waiting.values():
+                if not future.done():
+                    future.set_exception(ConnectionError("connection closed"))
+            self._waiting.clear()
+
+
+async def load_test(service: RouteService, queries: List[Tuple[str, str]], clients: int = 8,
+                    algorithm: str = "astar", deadline_ms: Optional[float] = None) -> dict:
+    """Start service on a free local port and send queries to it from
+    several concurrent clients, each keeping up to 8 requests open.
+        Args:
+            service: The service to load.
+            queries: The (start, destination) pairs, dealt round-robin to the
+            clients.
+            clients: Number of client connections.
+            algorithm: Key of the algorithm to ask for.
+            deadline_ms: Deadline sent with every request.
+        Returns:
+            Client-side counts and latency percentiles, plus the server's stats.
+    """
+    server = await service.start("127.0.0.1", 0)
+    port = server.sockets[0].getsockname()[1]
+    latency = LatencyHistogram()
+    outcomes: Dict[str, int] = {}
+
+    async def run_client(share: List[Tuple[str, str]]) -> None:
+        client = await RouteClient.connect("127.0.0.1", port)
+        window = asyncio.Semaphore(8)
+
+        async def one(start: str, destination: str) -> None:
+            async with window:
+                sent = time.perf_counter()
+                response = await client.route(start, destination, algorithm, deadline_ms)
+                latency.record(time.perf_counter() - sent)
+                outcome = "ok" if response["ok"] else response["error"]
+                outcomes[outcome] = outcomes.get(outcome, 0) + 1
+        try:
+            await asyncio.gather(*(one(start, destination) for start, destination in share))
+        finally:
+            await client.close()
+
+    started = time.perf_counter()
+    await asyncio.gather(*(run_client(queries[i::clients]) for i in range(clients)))
+    seconds = time.perf_counter() - started
+    return {
+        "requests": len(queries),
+        "seconds": seconds,
+        "requests_per_second": len(queries) / seconds if seconds else float('inf'),
+        "outcomes": outcomes,
+        "client_latency": {key: value for key, value in latency.summary().items() if key != "buckets"},
+        "server": service.stats_summary(),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Line-delimited JSON route service.")
+    parser.add_argument("--graph", default="graph_v2.txt")
+    parser.add_argument("--vertices", default="vertices_v1.txt")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--max-pending", type=int, default=64)
+    parser.add_argument("--deadline-ms", type=float, default=None)
+    parser.add_argument("--algorithm", default="astar", choices=sorted(ALGORITHMS))
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("serve", help="serve until interrupted")
+    query = commands.add_parser("query", help="ask a running service for one route")
+    query.add_argument("start")
+    query.add_argument("destination")
+    bench = commands.add_parser("bench", help="load an in-process service from local clients")
+    bench.add_argument("--clients", type=int, default=8)
+    bench.add_argument("--requests", type=int, default=4000)
+    bench.add_argument("--hot-pairs", type=int, default=200,
+                       help="draw queries from this many distinct pairs (0 for all pairs)")
+    bench.add_argument("--seed", type=int, default=351)
+    args = parser.parse_args()
+
+    async def run() -> None:
+        if args.command == "query":
+            client = await RouteClient.connect(args.host, args.port)
+            try:
+                print(json.dumps(await client.route(args.start, args.destination, args.algorithm,
+                                                    args.deadline_ms), indent=2))
+            finally:
+                await client.close()
+            return
+
+        default_deadline = args.deadline_ms / 1000 if args.deadline_ms else 2.0
+        service = RouteService(GraphStore(read_graph(args.graph, args.vertices)), workers=args.workers,
+                               max_pending=args.max_pending, default_deadline=default_deadline)
+        try:
+            if args.command == "serve":
+                server = await service.start(args.host, args.port)
+                print(f"Serving on {', '.join(str(s.getsockname()) for s in server.sockets)}")
+                await server.serve_forever()
+            else:
+                rng = random.Random(args.seed)
+                names = list(service.store.snapshot().graph.names)
+                pairs = [(rng.choice(names), rng.choice(names)) for _ in range(args.hot_pairs or args.requests)]
+                queries = [rng.choice(pairs) for _ in range(args.requests)]
+                report = await load_test(service, queries, args.clients, args.algorithm)
+                print(json.dumps(report, indent=2))
+        finally:
+            await service.close()
+
+    try:
+        asyncio.run(run())
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,561 @@
+from __future__ import annotations
+from array import array
+from dataclasses import dataclass
+from typing import Callable, List, Optional, Protocol, Sequence, Tuple
+import heapq
+import math
+
+"""
+Integer-id search kernels.
+
+These are the inner loops behind DijkstraAlgorithm, AStarAlgorithm and
+greedyBestFirstAlgorithm. They run on the CSR arrays of a CompactGraph
+(offsets, targets, weights) and keep every piece of per-vertex state in dense
+arrays indexed by vertex id instead of dicts keyed by vertex name:
+
+    dist[v]    best known distance from the start (inf if unreached)
+    parent[v]  predecessor of v on that path (-1 for none)
+    closed[v]  1 once v has been settled
+    hval[v]    memoised heuristic value for v (-1.0 if not computed yet)
+
+The frontier is a plain heapq list with lazy deletion: a vertex may sit on the
+heap more than once and stale entries are skipped when popped, which is
+cheaper in Python than maintaining decrease-key positions. Heap entries are
+(priority, sequence, vertex) tuples; the increasing sequence number is the
+same tie-breaker the original PriorityQueue code used, so vertices with equal
+priority still come out in insertion order.
+
+A SearchScratch can be reused between searches. It remembers which vertices a
+search touched and only resets those, so a small local query on a large graph
+does not pay O(V) to clear its state.
+
+dijkstra, astar, greedy and bidirectional take an optional probe
+(instrumentation.SearchProbe while a query is being recorded). It is told
+about every pop, settled or skipped as stale, with the frontier size after
+it, and on return about the heap totals, which are derived from the
+sequence counter and the frontier left over. The loops carry no extra
+counters, and without a probe each pop costs one more test.
+"""
+
+INF = math.inf
+NO_GOAL = -1
+
+
+class KernelProbe(Protocol):
+    def settled(self, vertex: int, distance: float, frontier_size: int, side: int) -> None: ...
+
+    def skipped(self, frontier_size: int) -> None: ...
+
+    def kernel_done(self, pushes: int, pops: int, vertices_explored: int) -> None: ...
+
+
+class SearchScratch:
+    """Reusable per-vertex state arrays for the search kernels."""
+
+    def __init__(self, vertex_count: int) -> None:
+        """Constructor for the scratch space.
+            Args:
+                vertex_count: Number of vertices in the graph being searched.
+            Returns:
+                None
+        """
+        self.vertex_count = vertex_count
+        self.dist = array('d', [INF]) * vertex_count
+        self.parent = array('q', [-1]) * vertex_count
+        self.closed = bytearray(vertex_count)
+        self.hval = array('d', [-1.0]) * vertex_count
+        self.touched: List[int] = []
+
+    def reset(self) -> None:
+        """Clear the state left behind by the previous search.
+            Args:
+                None
+            Returns:
+                None
+        """
+        touched = self.touched
+        if len(touched) > self.vertex_count // 4:
+            n = self.vertex_count
+            self.dist = array('d', [INF]) * n
+            self.parent = array('q', [-1]) * n
+            self.closed = bytearray(n)
+            self.hval = array('d', [-1.0]) * n
+        else:
+            dist, parent, closed, hval = self.dist, self.parent, self.closed, self.hval
+            for v in touched:
+                dist[v] = INF
+                parent[v] = -1
+                closed[v] = 0
+                hval[v] = -1.0
+        touched.clear()
+
+    def path_to(self, vertex: int) -> List[int]:
+        """Get the vertex ids on the path from the search start to vertex,
+        following the parent array of the last search.
+            Args:
+                vertex: The vertex id to walk back from.
+            Returns:
+                List of vertex ids, start first.
+        """
+        path = []
+        parent = self.parent
+        while vertex != -1:
+            path.append(vertex)
+            vertex = parent[vertex]
+        path.reverse()
+        return path
+
+
+@dataclass
+class SearchOutcome:
+    found: bool
+    distance: float
+    vertices_explored: int
+    edges_evaluated: int
+
+
+def dijkstra(offsets: Sequence[int], targets: Sequence[int], weights: Sequence[float],
+             start: int, goal: int, scratch: SearchScratch,
+             settle_order: Optional[List[int]] = None, probe: Optional[KernelProbe] = None) -> SearchOutcome:
+    """Dijkstra's algorithm from start until goal is settled. Pass goal=NO_GOAL
+    to settle every reachable vertex and leave the full shortest-path tree in
+    scratch.dist / scratch.parent.
+        Args:
+            offsets: CSR offsets array.
+            targets: CSR edge target array.
+            weights: CSR edge weight array.
+            start: Start vertex id.
+            goal: Goal vertex id, or NO_GOAL.
+            scratch: State arrays sized for the graph; reset before use.
+            settle_order: Optional list that receives the vertex ids in the
+            order they are settled.
+            probe: Optional KernelProbe to report the search to.
+        Returns:
+            SearchOutcome with the goal distance and search counters.
+    """
+    scratch.reset()
+    dist, parent, closed, touched = scratch.dist, scratch.parent, scratch.closed, scratch.touched
+    heappush, heappop = heapq.heappush, heapq.heappop
+    dist[start] = 0.0
+    touched.append(start)
+    frontier = [(0.0, 0, start)]
+    sequence = 1
+    vertices_explored = 0
+    edges_evaluated = 0
+
+    while frontier:
+        d, _, u = heappop(frontier)
+        if closed[u]:
+            if probe is not None:
+                probe.skipped(len(frontier))
+            continue
+        closed[u] = 1
+        vertices_explored += 1
+        if probe is not None:
+            probe.settled(u, d, len(frontier), 0)
+        if settle_order is not None:
+            settle_order.append(u)
+        if u == goal:
+            if probe is not None:
+                probe.kernel_done(sequence, sequence - len(frontier), vertices_explored)
+            return SearchOutcome(True, d, vertices_explored, edges_evaluated)
+        first, last = offsets[u], offsets[u + 1]
+        edges_evaluated += last - first
+        for e in range(first, last):
+            v = targets[e]
+            nd = d + weights[e]
+            if nd < dist[v] and not closed[v]:
+                if dist[v] == INF:
+                    touched.append(v)
+                dist[v] = nd
+                parent[v] = u
+                heappush(frontier, (nd, sequence, v))
+                sequence += 1
+
+    if probe is not None:
+        probe.kernel_done(sequence, sequence, vertices_explored)
+    return SearchOutcome(False, INF, vertices_explored, edges_evaluated)
+
+
+def dijkstra_to_targets(offsets: Sequence[int], targets: Sequence[int], weights: Sequence[float],
+                        start: int, is_target: bytearray, target_count: int,
+                        scratch: SearchScratch) -> SearchOutcome:
+    """One-to-many Dijkstra: grow a single shortest-path tree from start and
+    stop as soon as every vertex flagged in is_target has been settled (or the
+    reachable part of the graph is exhausted). The distances and tree are left
+    in scratch.dist / scratch.parent.
+        Args:
+            offsets: CSR offsets array.
+            targets: CSR edge target array.
+            weights: CSR edge weight array.
+            start: Start vertex id.
+            is_target: is_target[v] is 1 for every destination vertex id.
+            target_count: Number of distinct vertices flagged in is_target.
+            scratch: State arrays sized for the graph; reset before use.
+        Returns:
+            SearchOutcome; found is True when every target was reached.
+    """
+    scratch.reset()
+    dist, parent, closed, touched = scratch.dist, scratch.parent, scratch.closed, scratch.touched
+    heappush, heappop = heapq.heappush, heapq.heappop
+    dist[start] = 0.0
+    touched.append(start)
+    frontier = [(0.0, 0, start)]
+    sequence = 1
+    remaining = target_count
+    vertices_explored = 0
+    edges_evaluated = 0
+
+    while frontier:
+        d, _, u = heappop(frontier)
+        if closed[u]:
+            continue
+        closed[u] = 1
+        vertices_explored += 1
+        if is_target[u]:
+            remaining -= 1
+            if remaining == 0:
+                return SearchOutcome(True, d, vertices_explored, edges_evaluated)
+        first, last = offsets[u], offsets[u + 1]
+        edges_evaluated += last - first
+        for e in range(first, last):
+            v = targets[e]
+            nd = d + weights[e]
+            if nd < dist[v] and not closed[v]:
+                if dist[v] == INF:
+                    touched.append(v)
+                dist[v] = nd
+                parent[v] = u
+                heappush(frontier, (nd, sequence, v))
+                sequence += 1
+
+    return SearchOutcome(remaining == 0, INF, vertices_explored, edges_evaluated)
+
+
+def dijkstra_within(offsets: Sequence[int], targets: Sequence[int], weights: Sequence[float],
+                    sources: Sequence[int], max_distance: float, max_count: int, scratch: SearchScratch,
+                    settled: array, settled_dist: array) -> SearchOutcome:
+    """Multi-source Dijkstra that settles vertices in order of distance from
+    the nearest source and stops at max_distance or after max_count
+    vertices, whichever comes first.
+        Args:
+            offsets: CSR offsets array.
+            targets: CSR edge target array.
+            weights: CSR edge weight array.
+            sources: Start vertex ids, all at distance 0.
+            max_distance: Largest distance to settle (inclusive).
+            max_count: Largest number of vertices to settle.
+            scratch: State arrays sized for the graph; reset before use.
+            settled: array('q') that receives the settled vertex ids in order.
+            settled_dist: array('d') that receives their distances.
+        Returns:
+            SearchOutcome; found is True when max_count cut the search short
+            while more vertices were in range, and distance is the distance
+            of the last vertex settled.
+    """
+    scratch.reset()
+    dist, parent, closed, touched = scratch.dist, scratch.parent, scratch.closed, scratch.touched
+    heappush, heappop = heapq.heappush, heapq.heappop
+    frontier = []
+    sequence = 0
+    for source in sources:
+        if dist[source] == INF:
+            dist[source] = 0.0
+            touched.append(source)
+            frontier.append((0.0, sequence, source))
+            sequence += 1
+    append_vertex, append_dist = settled.append, settled_dist.append
+    last_distance = 0.0 if frontier else INF
+    vertices_explored = 0
+    edges_evaluated = 0
+
+    while frontier:
+        d, _, u = heappop(frontier)
+        if closed[u]:
+            continue
+        if vertices_explored >= max_count:
+            return SearchOutcome(True, last_distance, vertices_explored, edges_evaluated)
+        closed[u] = 1
+        vertices_explored += 1
+        last_distance = d
+        append_vertex(u)
+        append_dist(d)
+        first, last = offsets[u], offsets[u + 1]
+        edges_evaluated += last - first
+        for e in range(first, last):
+            v = targets[e]
+            nd = d + weights[e]
+            if nd < dist[v] and nd <= max_distance and not closed[v]:
+                if dist[v] == INF:
+                    touched.append(v)
+                dist[v] = nd
+                parent[v] = u
+                heappush(frontier, (nd, sequence, v))
+                sequence += 1
+
+    return SearchOutcome(False, last_distance, vertices_explored, edges_evaluated)
+
+
+def astar(offsets: Sequence[int], targets: Sequence[int], weights: Sequence[float],
+          start: int, goal: int, h: Callable[[int], float], scratch: SearchScratch,
+          probe: Optional[KernelProbe] = None) -> SearchOutcome:
+    """A* search from start to goal. h only has to be admissible: a closed
+    vertex that is reached again by a shorter path is reopened and expanded
+    again, so the result stays optimal when h is inconsistent. The haversine
+    bound is inconsistent on roads shorter than the great-circle distance
+    between their ends (Bend-Redmond in graph_v2.txt) and next to vertices
+    without coordinates, where h is 0.
+        Args:
+            offsets: CSR offsets array.
+            targets: CSR edge target array.
+            weights: CSR edge weight array.
+            start: Start vertex id.
+            goal: Goal vertex id.
+            h: Heuristic estimate of the distance from a vertex id to goal.
+            scratch: State arrays sized for the graph; reset before use.
+            probe: Optional KernelProbe to report the search to.
+        Returns:
+            SearchOutcome with the goal distance and search counters.
+    """
+    scratch.reset()
+    dist, parent, closed, hval, touched = (scratch.dist, scratch.parent, scratch.closed,
+                                           scratch.hval, scratch.touched)
+    heappush, heappop = heapq.heappush, heapq.heappop
+    dist[start] = 0.0
+    hval[start] = h(start)
+    touched.append(start)
+    frontier = [(hval[start], 0, start)]
+    sequence = 1
+    vertices_explored = 0
+    edges_evaluated = 0
+
+    while frontier:
+        _, _, u = heappop(frontier)
+        if closed[u]:
+            if probe is not None:
+                probe.skipped(len(frontier))
+            continue
+        closed[u] = 1
+        vertices_explored += 1
+        d = dist[u]
+        if probe is not None:
+            probe.settled(u, d, len(frontier), 0)
+        if u == goal:
+            if probe is not None:
+                probe.kernel_done(sequence, sequence - len(frontier), vertices_explored)
+            return SearchOutcome(True, d, vertices_explored, edges_evaluated)
+        first, last = offsets[u], offsets[u + 1]
+        edges_evaluated += last - first
+        for e in range(first, last):
+            v = targets[e]
+            nd = d + weights[e]
+            if nd < dist[v]:
+                closed[v] = 0
+                hv = hval[v]
+                if hv < 0.0:
+                    touched.append(v)
+                    hv = hval[v] = h(v)
+                dist[v] = nd
+                parent[v] = u
+                heappush(frontier, (nd + hv, sequence, v))
+                sequence += 1
+
+    if probe is not None:
+        probe.kernel_done(sequence, sequence, vertices_explored)
+    return SearchOutcome(False, INF, vertices_explored, edges_evaluated)
+
+
+def greedy(offsets: Sequence[int], targets: Sequence[int], weights: Sequence[float],
+           start: int, goal: int, h: Callable[[int], float], scratch: SearchScratch,
+           probe: Optional[KernelProbe] = None) -> SearchOutcome:
+    """Greedy best-first search from start to goal, ordered by h alone. A
+    vertex's parent is fixed by the first vertex that discovers it, and
+    scratch.dist holds the length of that discovery path.
+        Args:
+            offsets: CSR offsets array.
+            targets: CSR edge target array.
+            weights: CSR edge weight array.
+            start: Start vertex id.
+            goal: Goal vertex id.
+            h: Heuristic estimate of the distance from a vertex id to goal.
+            scratch: State arrays sized for the graph; reset before use.
+            probe: Optional KernelProbe to report the search to.
+        Returns:
+            SearchOutcome with the length of the path found and search counters.
+    """
+    scratch.reset()
+    dist, parent, closed, touched = scratch.dist, scratch.parent, scratch.closed, scratch.touched
+    heappush, heappop = heapq.heappush, heapq.heappop
+    dist[start] = 0.0
+    touched.append(start)
+    frontier = [(h(start), 0, start)]
+    sequence = 1
+    vertices_explored = 0
+    edges_evaluated = 0
+
+    while frontier:
+        _, _, u = heappop(frontier)
+        if closed[u]:
+            if probe is not None:
+                probe.skipped(len(frontier))
+            continue
+        closed[u] = 1
+        vertices_explored += 1
+        d = dist[u]
+        if probe is not None:
+            probe.settled(u, d, len(frontier), 0)
+        if u == goal:
+            if probe is not None:
+                probe.kernel_done(sequence, sequence - len(frontier), vertices_explored)
+            return SearchOutcome(True, d, vertices_explored, edges_evaluated)
+        first, last = offsets[u], offsets[u + 1]
+        edges_evaluated += last - first
+        for e in range(first, last):
+            v = targets[e]
+            if dist[v] == INF:
+                touched.append(v)
+                dist[v] = d + weights[e]
+                parent[v] = u
+                heappush(frontier, (h(v), sequence, v))
+                sequence += 1
+
+    if probe is not None:
+        probe.kernel_done(sequence, sequence, vertices_explored)
+    return SearchOutcome(False, INF, vertices_explored, edges_evaluated)
+
+
+@dataclass
+class BidirectionalOutcome:
+    found: bool
+    distance: float
+    meeting_vertex: int
+    vertices_explored: int
+    edges_evaluated: int
+
+
+def bidirectional(forward: Tuple[Sequence[int], Sequence[int], Sequence[float]],
+                  backward: Tuple[Sequence[int], Sequence[int], Sequence[float]],
+                  start: int, goal: int, forward_scratch: SearchScratch, backward_scratch: SearchScratch,
+                  potential: Optional[Callable[[int], float]] = None,
+                  probe: Optional[KernelProbe] = None) -> BidirectionalOutcome:
+    """Bidirectional Dijkstra / A*. One search grows forward from start over the
+    forward CSR arrays, the other grows backward from goal over the reversed
+    CSR arrays, and the side with the smaller frontier key is expanded next.
+
+    With potential=None this is plain bidirectional Dijkstra. Otherwise the
+    forward search uses p(v) and the backward search -p(v), which makes both
+    searches Dijkstra on the same reduced-cost graph (the "consistent average
+    potential" of Ikeda et al. / Goldberg-Harrelson when p(v) is
+    (h_goal(v) - h_start(v)) / 2). In both cases the search can stop as soon
+    as the two frontier minimums add up to at least the best path seen.
+
+    Forward distances and parents are left in forward_scratch; backward_scratch
+    holds distances to goal and parent[v] is the next vertex towards goal.
+        Args:
+            forward: (offsets, targets, weights) of the graph.
+            backward: (offsets, targets, weights) of the reversed graph.
+            start: Start vertex id.
+            goal: Goal vertex id.
+            forward_scratch: State arrays for the forward search.
+            backward_scratch: State arrays for the backward search.
+            potential: Optional consistent potential function p(v).
+            probe: Optional KernelProbe to report the search to; vertices
+            settled by the backward search are reported with side 1.
+        Returns:
+            BidirectionalOutcome with the distance and the vertex where the
+            shortest path found joins the two search trees.
+    """
+    forward_scratch.reset()
+    backward_scratch.reset()
+    f_offsets, f_targets, f_weights = forward
+    b_offsets, b_targets, b_weights = backward
+    f_dist, f_parent, f_closed, f_touched = (forward_scratch.dist, forward_scratch.parent,
+                                             forward_scratch.closed, forward_scratch.touched)
+    b_dist, b_parent, b_closed, b_touched = (backward_scratch.dist, backward_scratch.parent,
+                                             backward_scratch.closed, backward_scratch.touched)
+    heappush, heappop = heapq.heappush, heapq.heappop
+    if potential is None:
+        p = lambda v: 0.0
+    else:
+        cache = {}
+
+        def p(v: int) -> float:
+            value = cache.get(v)
+            if value is None:
+                value = cache[v] = potential(v)
+            return value
+
+    f_dist[start] = 0.0
+    f_touched.append(start)
+    b_dist[goal] = 0.0
+    b_touched.append(goal)
+    f_frontier = [(p(start), 0, start)]
+    b_frontier = [(-p(goal), 0, goal)]
+    sequence = 1
+    best = 0.0 if start == goal else INF
+    meeting = start if start == goal else -1
+    vertices_explored = 0
+    edges_evaluated = 0
+
+    while f_frontier and b_frontier:
+        if f_frontier[0][0] + b_frontier[0][0] >= best:
+            break
+        if f_frontier[0][0] <= b_frontier[0][0]:
+            _, _, u = heappop(f_frontier)
+            if f_closed[u]:
+                if probe is not None:
+                    probe.skipped(len(f_frontier) + len(b_frontier))
+                continue
+            f_closed[u] = 1
+            vertices_explored += 1
+            d = f_dist[u]
+            if probe is not None:
+                probe.settled(u, d, len(f_frontier) + len(b_frontier), 0)
+            first, last = f_offsets[u], f_offsets[u + 1]
+            edges_evaluated += last - first
+            for e in range(first, last):
+                v = f_targets[e]
+                nd = d + f_weights[e]
+                if nd < f_dist[v]:
+                    if f_dist[v] == INF:
+                        f_touched.append(v)
+                    f_dist[v] = nd
+                    f_parent[v] = u
+                    heappush(f_frontier, (nd + p(v), sequence, v))
+                    sequence += 1
+                    through = nd + b_dist[v]
+                    if through < best:
+                        best = through
+                        meeting = v
+        else:
+            _, _, u = heappop(b_frontier)
+            if b_closed[u]:
+                if probe is not None:
+                    probe.skipped(len(f_frontier) + len(b_frontier))
+                continue
+            b_closed[u] = 1
+            vertices_explored += 1
+            d = b_dist[u]
+            if probe is not None:
+                probe.settled(u, d, len(f_frontier) + len(b_frontier), 1)
+            first, last = b_offsets[u], b_offsets[u + 1]
+            edges_evaluated += last - first
+            for e in range(first, last):
+                v = b_targets[e]
+                nd = d + b_weights[e]
+                if nd < b_dist[v]:
+                    if b_dist[v] == INF:
+                        b_touched.append(v)
+                    b_dist[v] = nd
+                    b_parent[v] = u
+                    heappush(b_frontier, (nd - p(v), sequence, v))
+                    sequence += 1
+                    through = f_dist[v] + nd
+                    if through < best:
+                        best = through
+                        meeting = v
+
+    if probe is not None:
+        # Both frontiers start with one entry, but sequence only counts one.
+        probe.kernel_done(sequence + 1, sequence + 1 - len(f_frontier) - len(b_frontier), vertices_explored)
+    return BidirectionalOutcome(meeting != -1, best, meeting, vertices_explored, edges_evaluated)
@@ -0,0 +1,237 @@
+from __future__ import annotations
+from array import array
+from bisect import bisect_left
+from typing import Iterator, List, Mapping, Sequence, Tuple, Union, overload
+import mmap
+import os
+import struct
+import sys
+import time
+
+from graph_interfaces import IGraph
+from compact_graph import CompactGraph
+
+"""
+Binary graph snapshots.
+
+program.read_graph parses the CSV files and builds a Vertex and an Edge object
+per row on every start-up. A snapshot stores a graph already in CSR form, so
+loading it is a matter of mapping the file into memory:
+
+    python snapshot.py graph_v2.txt vertices_v1.txt oregon.snap
+
+    graph = load_snapshot("oregon.snap")
+
+load_snapshot memory-maps the file read-only and hands CompactGraph typed
+memoryviews straight onto the mapped pages. Nothing is parsed or copied, so
+start-up time does not grow with the size of the graph, pages are only read
+from disk when a search touches them, and every process that maps the same
+snapshot shares one copy in the page cache. Vertex names are decoded only when
+asked for, and name lookups binary-search a name-sorted permutation stored in
+the file instead of building a dict. The CSV files remain the import format.
+
+Layout (little-endian, every section starts on an 8-byte boundary):
+
+    header         magic b"PFSN", format version, V, E, name bytes,
+                   highway count H, highway bytes
+    offsets        int64[V + 1]
+    targets        int64[E]
+    weights        float64[E]
+    latitudes      float64[V] (NaN when unknown)
+    longitudes     float64[V] (NaN when unknown)
+    edge highways  int32[E], index into the highway table (-1 when unknown)
+    name offsets   int64[V + 1] byte offsets into the name bytes
+    name order     int64[V] vertex ids sorted by UTF-8 name
+    highway offs   int64[H + 1] byte offsets into the highway bytes
+    name bytes     UTF-8
+    highway bytes  UTF-8
+"""
+
+SNAPSHOT_MAGIC = b"PFSN"
+SNAPSHOT_FORMAT_VERSION = 1
+_SNAPSHOT_HEADER = struct.Struct('<4sHxxqqqqq')
+
+
+class _StringTable(Sequence[str]):
+    """Read-only list of strings decoded on demand from offsets and bytes."""
+
+    def __init__(self, offsets: Sequence[int], blob: memoryview) -> None:
+        self._offsets = offsets
+        self._blob = blob
+
+    def __len__(self) -> int:
+        return len(self._offsets) - 1
+
+    @overload
+    def __getitem__(self, i: int) -> str: ...
+    @overload
+    def __getitem__(self, i: slice) -> List[str]: ...
+
+    def __getitem__(self, i: Union[int, slice]) -> Union[str, List[str]]:
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError("string table index out of range")
+        return str(self.encoded(i), 'utf-8')
+
+    def __iter__(self) -> Iterator[str]:
+        return (self[i] for i in range(len(self)))
+
+    def encoded(self, i: int) -> bytes:
+        """Get the raw UTF-8 bytes of string i."""
+        return bytes(self._blob[self._offsets[i]:self._offsets[i + 1]])
+
+
+class _SnapshotIndex(Mapping[str, int]):
+    """Name to vertex id mapping backed by the snapshot's sorted name order."""
+
+    def __init__(self, names: _StringTable, order: Sequence[int]) -> None:
+        self._names = names
+        self._order = order
+
+    def __getitem__(self, name: str) -> int:
+        key = name.encode('utf-8')
+        order = self._order
+        position = bisect_left(range(len(order)), key, key=lambda i: self._names.encoded(order[i]))
+        if position < len(order) and self._names.encoded(order[position]) == key:
+            return order[position]
+        raise KeyError(name)
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._names)
+
+    def __len__(self) -> int:
+        return len(self._names)
+
+
+def save_snapshot(graph: IGraph, path: str) -> None:
+    """Write a graph to a binary snapshot file.
+    The file is written next to path and then renamed over it, so processes
+    that still have an older snapshot mapped keep reading a consistent file.
+        Args:
+            graph: The graph to store.
+            path: Destination file path.
+        Returns:
+            None
+    """
+    compact = graph if isinstance(graph, CompactGraph) else CompactGraph.from_graph(graph)
+    names = list(compact.names)
+    name_offsets, name_blob = _encode_strings(names)
+    highway_offsets, highway_blob = _encode_strings(list(compact.highways))
+    encoded = [name.encode('utf-8') for name in names]
+    name_order = array('q', sorted(range(len(names)), key=encoded.__getitem__))
+
+    sections = [
+        array('q', compact.offsets), array('q', compact.targets), array('d', compact.weights),
+        array('d', compact.latitudes), array('d', compact.longitudes), array('i', compact.edge_highways),
+        name_offsets, name_order, highway_offsets,
+    ]
+    temporary = f"{path}.tmp"
+    try:
+        with open(temporary, 'wb') as file:
+            file.write(_SNAPSHOT_HEADER.pack(SNAPSHOT_MAGIC, SNAPSHOT_FORMAT_VERSION, compact.vertex_count(),
+                                             compact.edge_count(), len(name_blob), len(compact.highways),
+                                             len(highway_blob)))
+            for section in sections:
+                if sys.byteorder != 'little':
+                    section.byteswap()
+                _write_aligned(file, section.tobytes())
+            _write_aligned(file, name_blob)
+            file.write(highway_blob)
+        os.replace(temporary, path)
+    except BaseException:
+        # Do not leave a partial file behind (a full disk, an interrupt).
+        try:
+            os.unlink(temporary)
+        except FileNotFoundError:
+            pass
+        raise
+
+
+def load_snapshot(path: str) -> CompactGraph:
+    """Memory-map a snapshot written by save_snapshot.
+        Args:
+            path: The snapshot file.
+        Returns:
+            A read-only CompactGraph backed by the mapped file.
+    """
+    with open(path, 'rb') as file:
+        mapped = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+    buffer = memoryview(mapped)
+    if len(buffer) < _SNAPSHOT_HEADER.size:
+        raise ValueError(f"{path} is not a graph snapshot")
+    (magic, version, vertex_count, edge_count, name_size,
+     highway_count, highway_size) = _SNAPSHOT_HEADER.unpack_from(buffer, 0)
+    if magic != SNAPSHOT_MAGIC:
+        raise ValueError(f"{path} is not a graph snapshot")
+    if version != SNAPSHOT_FORMAT_VERSION:
+        raise ValueError(f"unsupported snapshot version {version}")
+    position = _SNAPSHOT_HEADER.size
+
+    def take(count: int, typecode: str) -> Union[memoryview, array]:
+        nonlocal position
+        end = position + count * struct.calcsize(typecode)
+        if end > len(buffer):
+            raise ValueError(f"{path} is truncated")
+        section = buffer[position:end]
+        position = _aligned(end)
+        if sys.byteorder != 'little':
+            # The pages cannot be shared as-is on a big-endian host, so fall
+            # back to a byte-swapped private copy.
+            values = array(typecode, section.tobytes())
+            values.byteswap()
+            return values
+        return section.cast(typecode)
+
+    offsets = take(vertex_count + 1, 'q')
+    targets = take(edge_count, 'q')
+    weights = take(edge_count, 'd')
+    latitudes = take(vertex_count, 'd')
+    longitudes = take(vertex_count, 'd')
+    edge_highways = take(edge_count, 'i')
+    name_offsets = take(vertex_count + 1, 'q')
+    name_order = take(vertex_count, 'q')
+    highway_offsets = take(highway_count + 1, 'q')
+    name_blob = take(name_size, 'B')
+    highway_blob = take(highway_size, 'B')
+
+    names = _StringTable(name_offsets, name_blob)
+    highways = list(_StringTable(highway_offsets, highway_blob))
+    return CompactGraph(names, offsets, targets, weights, latitudes, longitudes, highways,
+                        edge_highways, _SnapshotIndex(names, name_order))
+
+
+def _encode_strings(strings: List[str]) -> Tuple[array, bytes]:
+    encoded = [string.encode('utf-8') for string in strings]
+    offsets = array('q', [0])
+    for string in encoded:
+        offsets.append(offsets[-1] + len(string))
+    return offsets, b''.join(encoded)
+
+def _aligned(position: int) -> int:
+    return (position + 7) & ~7
+
+def _write_aligned(file, data: bytes) -> None:
+    file.write(data)
+    padding = _aligned(len(data)) - len(data)
+    file.write(b'\0' * padding)
+
+
+def main() -> None:
+    if len(sys.argv) != 4:
+        print("usage: python snapshot.py GRAPH_CSV VERTICES_CSV OUTPUT_FILE")
+        sys.exit(2)
+    start = time.perf_counter()
+    graph = CompactGraph.from_files(sys.argv[1], sys.argv[2])
+    parsed = time.perf_counter()
+    save_snapshot(graph, sys.argv[3])
+    loaded_start = time.perf_counter()
+    load_snapshot(sys.argv[3])
+    loaded = time.perf_counter()
+    print(f"Wrote {graph.vertex_count()} vertices and {graph.edge_count()} edges to {sys.argv[3]}; "
+          f"CSV import took {parsed - start:.4f} seconds, snapshot load took {loaded - loaded_start:.4f} seconds.")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+import math
+import unittest
+
+from algorithms import ALGORITHMS
+from arc_flags import flagged_search
+from graph_impl import EARTH_RADIUS_MILES, Edge, Graph, Vertex
+from query_context import get_query_context
+from time_dependent import TimeDependentAlgorithm, TrafficModel
+import search_kernels
+
+"""
+Regression tests for the search kernels.
+
+Run with "python -m unittest" from the project directory.
+"""
+
+
+def _latitude(miles: float) -> float:
+    """Latitude on the prime meridian that many miles north of the equator."""
+    return math.degrees(miles / EARTH_RADIUS_MILES)
+
+
+def _inconsistent_graph() -> Graph:
+    """Five vertices on the prime meridian, with G on the equator. The haversine
+    bound is 8 at B and 2 at C, but the road B->C is only 1 mile long, so the
+    bound is admissible and not consistent: C is first closed through A (6)
+    before B offers the shorter 4. The shortest S->G path is S->B->C->G, 14.
+    """
+    graph = Graph()
+    vertices = {name: Vertex(name, _latitude(miles), 0.0)
+                for name, miles in (("S", 0.0), ("A", 0.0), ("B", 8.0), ("C", 2.0), ("G", 0.0))}
+    for vertex in vertices.values():
+        graph.add_vertex(vertex)
+    for source, destination, weight in (("S", "A", 1.0), ("S", "B", 3.0), ("A", "C", 5.0),
+                                        ("B", "C", 1.0), ("C", "G", 10.0)):
+        graph.add_edge(Edge(None, vertices[destination], weight, source=vertices[source]))
+    return graph
+
+
+def _missing_coordinates_graph() -> Graph:
+    """S->A->M->G (94.4) beats the direct S->G road (119.4), but M has no
+    coordinates, so its h is 0 and the bidirectional A* potential is not
+    consistent around it."""
+    graph = Graph()
+    vertices = {"S": Vertex("S", 1.5, 1.9), "A": Vertex("A", 1.3, 1.8), "M": Vertex("M"),
+                "G": Vertex("G", 1.5, 0.2)}
+    for vertex in vertices.values():
+        graph.add_vertex(vertex)
+    for source, destination, weight in (("S", "A", 43.4), ("A", "M", 24.0), ("M", "G", 27.0),
+                                        ("S", "G", 119.4)):
+        graph.add_edge(Edge(None, vertices[destination], weight, source=vertices[source]))
+    return graph
+
+
+class AStarTest(unittest.TestCase):
+
+    def test_kernel_reopens_closed_vertex(self) -> None:
+        graph = _inconsistent_graph()
+        context = get_query_context(graph)
+        compact = context.graph
+        start, goal = compact.vertex_id("S"), compact.vertex_id("G")
+        scratch = context.acquire_scratch()
+        try:
+            outcome = search_kernels.astar(compact.offsets, compact.targets, compact.weights,
+                                           start, goal, context.heuristic(goal), scratch)
+            self.assertTrue(outcome.found)
+            self.assertAlmostEqual(outcome.distance, 14.0)
+            self.assertEqual([compact.names[v] for v in scratch.path_to(goal)],
+                             ["S", "B", "C", "G"])
+        finally:
+            context.release_scratch(scratch)
+
+    def test_algorithm_is_optimal_with_inconsistent_heuristic(self) -> None:
+        result = ALGORITHMS["astar"].find_path(_inconsistent_graph(), "S", "G")
+        self.assertTrue(result.path_found)
+        self.assertAlmostEqual(result.total_distance, 14.0)
+
+    def test_flagged_search_reopens_closed_vertex(self) -> None:
+        graph = _inconsistent_graph()
+        context = get_query_context(graph)
+        compact = context.graph
+        start, goal = compact.vertex_id("S"), compact.vertex_id("G")
+        allowed = bytearray(b"\x01" * len(compact.targets))
+        scratch = context.acquire_scratch()
+        try:
+            outcome = flagged_search(compact.offsets, compact.targets, compact.weights,
+                                     start, goal, allowed, context.heuristic(goal), scratch)
+            self.assertAlmostEqual(outcome.distance, 14.0)
+        finally:
+            context.release_scratch(scratch)
+
+    def test_bidirectional_astar_with_inconsistent_potential(self) -> None:
+        for graph in (_inconsistent_graph(), _missing_coordinates_graph()):
+            result = ALGORITHMS["bidirectional-astar"].find_path(graph, "S", "G")
+            expected = ALGORITHMS["dijkstra"].find_path(graph, "S", "G")
+            self.assertTrue(result.path_found)
+            self.assertAlmostEqual(result.total_distance, expected.total_distance)
+
+    def test_time_dependent_astar_reopens_closed_vertex(self) -> None:
+        # At the default 60 mph every mile takes a minute.
+        algorithm = TimeDependentAlgorithm(TrafficModel(), departure_time=480.0)
+        result = algorithm.find_path(_inconsistent_graph(), "S", "G")
+        self.assertTrue(result.path_found)
+        self.assertAlmostEqual(result.arrival_time, 494.0)
+        self.assertAlmostEqual(result.total_distance, 14.0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,419 @@
+from __future__ import annotations
+from array import array
+from bisect import bisect_right
+from dataclasses import dataclass, field
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+import heapq
+import math
+import time
+
+from graph_interfaces import IAlgorithm, IGraph, AlgorithmResult
+from compact_graph import CompactGraph
+from query_context import get_query_context
+from search_kernels import INF, SearchOutcome, SearchScratch
+from instrumentation import probe_queries
+
+"""
+Time-dependent travel times.
+
+An edge's weight is its length in miles. Its travel time in minutes depends on
+when it is entered:
+
+    travel_time(e, t) = base_minutes[e] * factor(profile[e], t)
+
+where base_minutes is the free-flow time (length / speed) and factor is a
+congestion profile: a periodic piecewise-linear function of the time of day
+(minutes after midnight, period 1440). Profiles are shared. All breakpoints of
+all profiles are stored in one pair of flat arrays (times, factors) with an
+offsets array marking where each profile starts, and each edge only stores a
+profile id and its base time. A network with millions of edges and a dozen
+profiles (say one per road class) therefore costs about 12 bytes per edge, no
+matter how detailed the profiles are.
+
+The time-dependent search is Dijkstra (or A*) on arrival time. It is exact
+when every edge is FIFO, which means leaving later never gets you there
+earlier:
+
+    travel_time(e, t') - travel_time(e, t) >= -(t' - t)
+
+For these profiles that is base_minutes[e] * slope >= -1 for every falling
+segment, and TimeDependentGraph checks it when it is built. The A* variant
+uses the straight-line distance times the fewest minutes any edge takes per
+mile (at its fastest time of day), which never overestimates.
+
+    standard = TrafficModel.standard_profiles()
+    model = TrafficModel(standard.profiles, {"I-5N": standard.heavy_rush_hour},
+                         default_profile=standard.rush_hour)
+    result = TimeDependentAlgorithm(model, departure_time=8 * 60).find_path(graph, "Salem", "Portland")
+    result.arrival_time, result.total_distance
+"""
+
+MINUTES_PER_DAY = 1440.0
+
+
+class TravelTimeProfiles:
+    """Class for a set of periodic piecewise-linear congestion profiles."""
+
+    def __init__(self, period: float = MINUTES_PER_DAY) -> None:
+        """Constructor for an empty profile set.
+            Args:
+                period: Length of the cycle the profiles repeat over, in minutes.
+            Returns:
+                None
+        """
+        self.period = period
+        self.offsets = array('q', [0])
+        self.times = array('d')
+        self.factors = array('d')
+        self.min_factors = array('d')
+        self.min_slopes = array('d')
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def add(self, points: Sequence[Tuple[float, float]]) -> int:
+        """Add a profile.
+            Args:
+                points: (minute of the period, factor) breakpoints with
+                strictly increasing minutes in [0, period) and positive
+                factors. The profile is linear between breakpoints and wraps
+                from the last one back to the first.
+            Returns:
+                The id of the new profile.
+        """
+        if not points:
+            raise ValueError("a profile needs at least one breakpoint")
+        previous = -math.inf
+        for minute, factor in points:
+            if not 0 <= minute < self.period or minute <= previous:
+                raise ValueError("profile minutes must increase strictly within [0, period)")
+            if factor <= 0:
+                raise ValueError("profile factors must be positive")
+            previous = minute
+        self.times.extend(minute for minute, _ in points)
+        self.factors.extend(factor for _, factor in points)
+        self.offsets.append(len(self.times))
+        self.min_factors.append(min(factor for _, factor in points))
+        wrapped = list(points) + [(points[0][0] + self.period, points[0][1])]
+        self.min_slopes.append(min(((f1 - f0) / (t1 - t0) for (t0, f0), (t1, f1) in zip(wrapped, wrapped[1:])),
+                                   default=0.0))
+        return len(self) - 1
+
+    def factor(self, profile: int, minute: float) -> float:
+        """Evaluate a profile.
+            Args:
+                profile: The profile id.
+                minute: Time in minutes (any value; it is reduced modulo period).
+            Returns:
+                The congestion factor at that time.
+        """
+        times, factors = self.times, self.factors
+        first, last = self.offsets[profile], self.offsets[profile + 1]
+        period = self.period
+        t = minute % period
+        i = bisect_right(times, t, first, last)
+        if i == first:
+            t0, f0 = times[last - 1] - period, factors[last - 1]
+            t1, f1 = times[first], factors[first]
+        elif i == last:
+            t0, f0 = times[last - 1], factors[last - 1]
+            t1, f1 = times[first] + period, factors[first]
+        else:
+            t0, f0 = times[i - 1], factors[i - 1]
+            t1, f1 = times[i], factors[i]
+        if t1 == t0:
+            return f0
+        return f0 + (f1 - f0) * (t - t0) / (t1 - t0)
+
+
+@dataclass
+class StandardProfiles:
+    profiles: TravelTimeProfiles
+    free_flow: int
+    rush_hour: int
+    heavy_rush_hour: int
+
+
+@dataclass
+class TrafficModel:
+    """How to turn a graph's edges into time-dependent edges.
+
+    Edges on a highway listed in highway_profiles use that profile, others use
+    default_profile (None: constant free-flow time). Free-flow speed comes from
+    highway_speeds, falling back to speed_mph.
+    """
+    profiles: TravelTimeProfiles = field(default_factory=TravelTimeProfiles)
+    highway_profiles: Dict[str, int] = field(default_factory=dict)
+    default_profile: Optional[int] = None
+    speed_mph: float = 60.0
+    highway_speeds: Dict[str, float] = field(default_factory=dict)
+
+    @staticmethod
+    def standard_profiles(peak_factor: float = 1.6, heavy_peak_factor: float = 2.0) -> StandardProfiles:
+        """Build a profile set with a flat profile and two weekday rush-hour
+        profiles (peaks around 8:00 and 17:00, two-hour ramps).
+            Args:
+                peak_factor: Travel time multiplier at the peak of rush_hour.
+                heavy_peak_factor: Multiplier at the peak of heavy_rush_hour.
+            Returns:
+                StandardProfiles with the profile set and the three ids.
+        """
+        profiles = TravelTimeProfiles()
+        free_flow = profiles.add([(0.0, 1.0)])
+
+        def rush(peak: float) -> List[Tuple[float, float]]:
+            return [(0.0, 1.0), (6 * 60.0, 1.0), (8 * 60.0, peak), (10 * 60.0, 1.0),
+                    (15 * 60.0, 1.0), (17 * 60.0, peak), (19 * 60.0, 1.0)]
+        return StandardProfiles(profiles, free_flow, profiles.add(rush(peak_factor)),
+                                profiles.add(rush(heavy_peak_factor)))
+
+    def build(self, graph: IGraph) -> TimeDependentGraph:
+        """Attach this model's profiles to every edge of a graph.
+            Args:
+                graph: The graph to build from.
+            Returns:
+                The TimeDependentGraph for the graph's current version.
+        """
+        compact = get_query_context(graph).graph
+        edge_count = compact.edge_count()
+        base_minutes = array('d', [0.0]) * edge_count
+        edge_profiles = array('i', [-1]) * edge_count
+        default = -1 if self.default_profile is None else self.default_profile
+        for slot in range(edge_count):
+            highway = compact.highway_name(slot)
+            speed = self.highway_speeds.get(highway, self.speed_mph)
+            base_minutes[slot] = compact.weights[slot] / speed * 60.0
+            edge_profiles[slot] = self.highway_profiles.get(highway, default)
+        return TimeDependentGraph(compact, self.profiles, base_minutes, edge_profiles)
+
+
+class TimeDependentGraph:
+    """Class for a CompactGraph with a travel-time profile on every edge."""
+
+    def __init__(self, graph: CompactGraph, profiles: TravelTimeProfiles,
+                 base_minutes: Sequence[float], edge_profiles: Sequence[int]) -> None:
+        """Constructor that checks every edge is FIFO.
+            Args:
+                graph: The underlying graph; edge slots index the arrays below.
+                profiles: The shared profile set.
+                base_minutes: Free-flow travel time per edge slot.
+                edge_profiles: Profile id per edge slot (-1 for constant time).
+            Returns:
+                None
+        """
+        self.graph = graph
+        self.profiles = profiles
+        self.base_minutes = base_minutes
+        self.edge_profiles = edge_profiles
+        minutes_per_mile = math.inf
+        for slot in range(graph.edge_count()):
+            profile = edge_profiles[slot]
+            base = base_minutes[slot]
+            if profile >= 0 and base * profiles.min_slopes[profile] < -1.0:
+                raise ValueError(f"edge {graph.get_edges()[slot].get_name()} is not FIFO: its travel "
+                                 f"time falls faster than time passes; use a gentler profile")
+            fastest = base * (profiles.min_factors[profile] if profile >= 0 else 1.0)
+            weight = graph.weights[slot]
+            if weight > 0:
+                minutes_per_mile = min(minutes_per_mile, fastest / weight)
+        self.min_minutes_per_mile = 0.0 if minutes_per_mile == math.inf else minutes_per_mile
+
+    def travel_time(self, slot: int, minute: float) -> float:
+        """Get the minutes needed to traverse an edge entered at a given time.
+            Args:
+                slot: The edge slot.
+                minute: Entry time in minutes.
+            Returns:
+                The travel time in minutes.
+        """
+        profile = self.edge_profiles[slot]
+        if profile < 0:
+            return self.base_minutes[slot]
+        return self.base_minutes[slot] * self.profiles.factor(profile, minute)
+
+
+def time_dependent_search(network: TimeDependentGraph, start: int, goal: int, departure: float,
+                          h: Optional[Callable[[int], float]], scratch: SearchScratch) -> SearchOutcome:
+    """Earliest-arrival search from start to goal leaving at departure.
+    scratch.dist holds arrival times; outcome.distance is the goal's.
+        Args:
+            network: The time-dependent graph.
+            start: Start vertex id.
+            goal: Goal vertex id.
+            departure: Departure time in minutes.
+            h: Lower bound on the minutes from a vertex id to goal (None for
+            plain Dijkstra). It need not be consistent (it is not next to
+            vertices without coordinates): a closed vertex reached at an
+            earlier time is reopened.
+            scratch: State arrays sized for the graph; reset before use.
+        Returns:
+            SearchOutcome with the arrival time and search counters.
+    """
+    scratch.reset()
+    dist, parent, closed, hval, touched = (scratch.dist, scratch.parent, scratch.closed,
+                                           scratch.hval, scratch.touched)
+    graph = network.graph
+    offsets, targets = graph.offsets, graph.targets
+    base_minutes, edge_profiles, factor = network.base_minutes, network.edge_profiles, network.profiles.factor
+    heappush, heappop = heapq.heappush, heapq.heappop
+    dist[start] = departure
+    hval[start] = h(start) if h else 0.0
+    touched.append(start)
+    frontier = [(departure + hval[start], 0, start)]
+    sequence = 1
+    vertices_explored = 0
+    edges_evaluated = 0
+
+    while frontier:
+        _, _, u = heappop(frontier)
+        if closed[u]:
+            continue
+        closed[u] = 1
+        vertices_explored += 1
+        t = dist[u]
+        if u == goal:
+            return SearchOutcome(True, t, vertices_explored, edges_evaluated)
+        first, last = offsets[u], offsets[u + 1]
+        edges_evaluated += last - first
+        for e in range(first, last):
+            v = targets[e]
+            profile = edge_profiles[e]
+            arrival = t + (base_minutes[e] if profile < 0 else base_minutes[e] * factor(profile, t))
+            if arrival < dist[v]:
+                closed[v] = 0
+                hv = hval[v]
+                if hv < 0.0:
+                    touched.append(v)
+                    hv = hval[v] = h(v) if h else 0.0
+                dist[v] = arrival
+                parent[v] = u
+                heappush(frontier, (arrival + hv, sequence, v))
+                sequence += 1
+
+    return SearchOutcome(False, INF, vertices_explored, edges_evaluated)
+
+
+@dataclass
+class TimeDependentResult(AlgorithmResult):
+    # Times are minutes after midnight of the departure day.
+    departure_time: float = 0.0
+    arrival_time: float = 0.0
+
+    @property
+    def travel_time(self) -> float:
+        return self.arrival_time - self.departure_time
+
+
+def format_minutes(minutes: float) -> str:
+    """Format minutes after midnight as HH:MM, with +Nd for later days."""
+    days, minute = divmod(round(minutes), int(MINUTES_PER_DAY))
+    text = f"{minute // 60:02d}:{minute % 60:02d}"
+    return f"{text} +{days}d" if days else text
+
+
+class TimeDependentAlgorithm(IAlgorithm):
+    """Earliest-arrival routing for a departure time."""
+
+    def __init__(self, model: TrafficModel, departure_time: float = 8 * 60.0, use_heuristic: bool = True) -> None:
+        """Constructor for the algorithm.
+            Args:
+                model: Profiles and speeds used to build the time-dependent
+                graph. It is rebuilt whenever the searched graph changes version.
+                departure_time: Departure in minutes after midnight.
+                use_heuristic: Run A* with a straight-line bound instead of
+                Dijkstra.
+            Returns:
+                None
+        """
+        self.model = model
+        self.departure_time = departure_time
+        self.use_heuristic = use_heuristic
+        self.network: Optional[TimeDependentGraph] = None
+
+    def find_path(self, graph: IGraph, start_vertex_name: str, destination_vertex_name: str) -> TimeDependentResult:
+        """
+        Finds the earliest-arrival route leaving at self.departure_time.
+
+        Args:
+            graph: The graph to search.
+            start_vertex_name: The name of the starting vertex.
+            destination_vertex_name: The name of the destination vertex.
+        Returns:
+            TimeDependentResult with the path's length in total_distance and
+            the departure and arrival times.
+        """
+        return self.find_path_at(graph, start_vertex_name, destination_vertex_name, self.departure_time)
+
+    @probe_queries
+    def find_path_at(self, graph: IGraph, start_vertex_name: str, destination_vertex_name: str,
+                     departure_time: float) -> TimeDependentResult:
+        """Like find_path, for an explicit departure time in minutes."""
+        start_time = time.time()
+        context = get_query_context(graph)
+        compact = context.graph
+        start = compact.vertex_id(start_vertex_name)
+        goal = compact.vertex_id(destination_vertex_name)
+        if start is None or goal is None:
+            return TimeDependentResult(
+                textual_directions="Start/destination vertex not found.",
+                total_distance=0.0,
+                vertices_explored=0,
+                edges_evaluated=0,
+                execution_time=time.time() - start_time,
+                path_found=False,
+                departure_time=departure_time,
+                arrival_time=departure_time
+            )
+        network = self.network
+        if network is None or network.graph is not compact:
+            network = self.network = self.model.build(graph)
+
+        h = None
+        if self.use_heuristic and network.min_minutes_per_mile > 0:
+            miles = context.heuristic(goal)
+            minutes_per_mile = network.min_minutes_per_mile
+            h = lambda v: miles(v) * minutes_per_mile
+        scratch = context.acquire_scratch()
+        try:
+            outcome = time_dependent_search(network, start, goal, departure_time, h, scratch)
+            if not outcome.found:
+                return TimeDependentResult(
+                    textual_directions="No path found.",
+                    total_distance=0.0,
+                    vertices_explored=outcome.vertices_explored,
+                    edges_evaluated=outcome.edges_evaluated,
+                    execution_time=time.time() - start_time,
+                    path_found=False,
+                    departure_time=departure_time,
+                    arrival_time=departure_time
+                )
+            path = scratch.path_to(goal)
+            miles_travelled = sum(compact.weights[_edge_slot(network, scratch, u, v)] for u, v in zip(path, path[1:]))
+            return TimeDependentResult(
+                textual_directions=" -> ".join(compact.names[v] for v in path),
+                total_distance=miles_travelled,
+                vertices_explored=outcome.vertices_explored,
+                edges_evaluated=outcome.edges_evaluated,
+                execution_time=time.time() - start_time,
+                path_found=True,
+                departure_time=departure_time,
+                arrival_time=outcome.distance
+            )
+        finally:
+            context.release_scratch(scratch)
+
+    def get_name(self) -> str:
+        return "Time-Dependent A*" if self.use_heuristic else "Time-Dependent Dijkstra"
+
+
+def _edge_slot(network: TimeDependentGraph, scratch: SearchScratch, u: int, v: int) -> int:
+    """Find the edge u->v the search used: the one arriving earliest."""
+    graph = network.graph
+    leave = scratch.dist[u]
+    best_slot, best_arrival = -1, INF
+    for slot in range(graph.offsets[u], graph.offsets[u + 1]):
+        if graph.targets[slot] == v:
+            arrival = leave + network.travel_time(slot, leave)
+            if arrival < best_arrival:
+                best_slot, best_arrival = slot, arrival
+    return best_slot